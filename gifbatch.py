@@ -0,0 +1,308 @@
+"""Apply a mask to many GIFs/videos from the command line.
+
+Example:
+    python gifbatch.py --mask mask.png --size 480 --out done/ clips/*.mp4
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import glob
+import itertools
+import os
+import sys
+import time
+
+from PIL import Image
+
+import gifbudget
+import gifcache
+import gifcore
+import gifencode
+import gifstore
+import gifstream
+import gifvideo
+
+_worker_mask = None
+
+
+def parse_size(text):
+    """Parse "480", "480x270" or "x270" into (width, height) with None for a free side."""
+    width, _, height = text.lower().partition('x')
+    try:
+        return (int(width) if width else None), (int(height) if height else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size: {text}")
+
+
+def collect_inputs(patterns):
+    """Expand directories and glob patterns into a sorted list of supported files."""
+    supported = gifcore.IMAGE_EXTENSIONS + gifcore.VIDEO_EXTENSIONS
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern) or [pattern]
+        for path in candidates:
+            if os.path.isfile(path) and gifcore.file_extension(path) in supported:
+                found.append(path)
+    return sorted(set(found))
+
+
+def output_path(input_path, out_dir, format='gif', taken=None):
+    """input_path's output in out_dir: its name with format's extension.
+
+    taken maps the outputs already handed out (without their extension,
+    since other formats only swap it) to the inputs they belong to. When
+    another input already has the name, e.g. clip.gif and clip.mp4, or two
+    clip.mp4 in different folders, the input's own extension is added, then
+    a number, until it is unique; the name used is recorded in taken.
+    """
+    stem, extension = os.path.splitext(os.path.basename(input_path))
+    base = os.path.join(out_dir, stem)
+    if taken is not None:
+        source = os.path.normcase(os.path.abspath(input_path))
+        suffix = f"{base}-{extension[1:]}" if extension else base
+        for candidate in itertools.chain([base, suffix], (f"{suffix}-{n}" for n in itertools.count(2))):
+            if taken.setdefault(os.path.normcase(candidate), source) == source:
+                base = candidate
+                break
+    return base + gifencode.EXTENSIONS[format]
+
+
+def add_encoder_arguments(parser):
+    parser.add_argument('--format', dest='formats', nargs='+', choices=gifencode.FORMATS, default=None,
+                        help="output format(s); with several, each file is written in all of them "
+                             "and encode time and size are reported per format")
+    parser.add_argument('--quality', type=int, default=gifencode.WEBP_QUALITY, help="WebP quality, 0-100")
+    parser.add_argument('--lossless', action='store_true', help="lossless WebP")
+    parser.add_argument('--effort', type=int, default=gifencode.EFFORT, choices=range(7),
+                        help="WebP/APNG compression effort, 0 (fastest) to 6 (smallest)")
+
+
+def encoder_options(args):
+    return {'quality': args.quality, 'lossless': args.lossless, 'effort': args.effort}
+
+
+def _init_worker(mask_path, memory_budget=None, cache=True):
+    global _worker_mask
+    gifcache.ENABLED = cache
+    if memory_budget is not None:
+        gifstore.MEMORY_BUDGET = memory_budget
+    _worker_mask = gifcore.load_mask(mask_path) if mask_path else None
+
+
+def _resized(frame, size):
+    return frame if frame.size == size else frame.resize(size, Image.LANCZOS)
+
+
+def process_file(input_path, output_name, size=(None, None), add=False, flip=False, duration=100,
+                 optimize=True, video_options=None, mask=None, dedup=None, formats=None, encoder_options=None,
+                 max_size=None, retime=None, blend=False, stream=False):
+    """Load, resize, mask and save one file. Returns a stats dict.
+
+    Videos are decoded by ffmpeg straight at the requested size; video_options
+    may set fps, start and end. With a dedup threshold, runs of duplicate
+    frames are merged into one longer frame before anything else happens.
+    retime resamples the clip to that many fps (blending frames with blend),
+    before the resize so dropped frames are never resized.
+    With formats, the result is written once per format, next to
+    output_name with that format's extension; encoder_options go to save_gif.
+    With max_size (bytes), each output is shrunk, reduced in colors/quality
+    and frame rate as little as needed to fit. With stream, a video goes
+    through gifstream instead, so memory doesn't grow with its length.
+    """
+    mask = mask if mask is not None else _worker_mask
+    if stream and gifcore.is_video_file(input_path):
+        return _stream_file(input_path, output_name, size, add, flip, duration, optimize, video_options, mask,
+                            formats, encoder_options)
+    start = time.perf_counter()
+    if gifcore.is_video_file(input_path):
+        frames = gifcore.load_video_frames(input_path, width=size[0], height=size[1], **(video_options or {}))
+    else:
+        frames = gifcore.load_frames(input_path)
+    decoded = time.perf_counter()
+    source_frames = len(frames)
+    if dedup is not None:
+        frames, holds = gifcore.merge_duplicates(frames, dedup)
+        duration = [duration * hold for hold in holds]
+    if retime is not None:
+        durations = duration if isinstance(duration, list) else [duration] * len(frames)
+        frames, duration = gifcore.retime(frames, durations, retime, blend)
+
+    target_size = gifcore.fit_size(frames[0].size, *size)
+    if target_size != frames[0].size:
+        frames = gifcore.resize_frames(frames, target_size)
+    if mask is not None:
+        gifcore.apply_mask(frames, mask, add=add, flip=flip)
+    outputs = []
+    for format in formats or [None]:
+        name = output_name if format is None else os.path.splitext(output_name)[0] + gifencode.EXTENSIONS[format]
+        encode_start = time.perf_counter()
+        # Files already run in parallel, so each one encodes on a single thread
+        if max_size is not None:
+            options = encoder_options or {}
+            saved = gifbudget.export_within(frames, name, max_size, target_size, _resized, duration=duration,
+                                            format=format, lossless=options.get('lossless', False),
+                                            effort=options.get('effort', gifencode.EFFORT), workers=1)
+        else:
+            saved = gifcore.save_gif(frames, name, duration=duration, optimize=optimize, workers=1, format=format,
+                                     **(encoder_options or {}))
+        output = {'format': saved['format'], 'output': name, 'bytes': saved['bytes'],
+                  'seconds': time.perf_counter() - encode_start}
+        if max_size is not None:
+            output.update(predicted_bytes=saved['predicted_bytes'], fits=saved['fits'],
+                          settings=gifbudget.describe(saved['settings'], saved['settings']['size']))
+        outputs.append(output)
+    end = time.perf_counter()
+
+    return {
+        'input': input_path,
+        'output': outputs[0]['output'],
+        'outputs': outputs,
+        'frames': len(frames),
+        'source_frames': source_frames,
+        'decode_seconds': decoded - start,
+        'seconds': end - start,
+        'bytes': outputs[0]['bytes'],
+    }
+
+
+def _stream_file(input_path, output_name, size, add, flip, duration, optimize, video_options, mask, formats,
+                 encoder_options):
+    """process_file for a video converted by gifstream, once per format."""
+    start = time.perf_counter()
+    info = gifvideo.probe(input_path)
+    outputs = []
+    for format in formats or [None]:
+        name = output_name if format is None else os.path.splitext(output_name)[0] + gifencode.EXTENSIONS[format]
+        # Files already run in parallel, so each one encodes on a single thread
+        saved = gifstream.convert_video(input_path, name, mask=mask, add=add, flip=flip, width=size[0],
+                                        height=size[1], duration=duration, format=format, optimize=optimize,
+                                        workers=1, info=info, **(video_options or {}), **(encoder_options or {}))
+        outputs.append({'format': saved['format'], 'output': name, 'bytes': saved['bytes'],
+                        'seconds': saved['seconds'], 'peak_depths': saved['peak_depths']})
+    return {
+        'input': input_path,
+        'output': outputs[0]['output'],
+        'outputs': outputs,
+        'frames': saved['frames'],
+        'source_frames': saved['frames'],
+        'decode_seconds': 0.0,  # overlaps the encode
+        'seconds': time.perf_counter() - start,
+        'bytes': outputs[0]['bytes'],
+    }
+
+
+def run_batch(inputs, out_dir, mask_path=None, size=(None, None), add=False, flip=False,
+              duration=100, optimize=True, video_options=None, workers=None, memory_budget=None,
+              cache=True, dedup=None, formats=None, encoder_options=None, max_size=None, retime=None, blend=False,
+              stream=False, report=print):
+    """Process inputs across a process pool and report per-file timing and throughput."""
+    os.makedirs(out_dir, exist_ok=True)
+    results = []
+    failures = []
+    start = time.perf_counter()
+    taken = {}
+    outputs = {path: output_path(path, out_dir, taken=taken) for path in inputs}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(mask_path, memory_budget, cache)) as pool:
+        futures = {
+            pool.submit(process_file, path, outputs[path], size, add, flip, duration, optimize,
+                        video_options, dedup=dedup, formats=formats, encoder_options=encoder_options,
+                        max_size=max_size, retime=retime, blend=blend, stream=stream): path
+            for path in inputs
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                failures.append(path)
+                report(f"FAILED {path}: {e}")
+                continue
+            results.append(stats)
+            merged = f" (from {stats['source_frames']} source frames)" if stats['source_frames'] != stats['frames'] else ""
+            report(f"{os.path.basename(path)}: {stats['frames']} frames{merged} in {stats['seconds']:.2f}s "
+                   f"(decode {stats['decode_seconds']:.2f}s, "
+                   f"{stats['frames'] / max(stats['seconds'], 1e-9):.1f} frames/s, {stats['bytes']} bytes)")
+            if max_size is not None:
+                for output in stats['outputs']:
+                    report(f"    {output['format']}: {output['settings']}, predicted {output['predicted_bytes']} "
+                           f"bytes, actual {output['bytes']}" + ("" if output['fits'] else " (OVER THE LIMIT)"))
+            elif 'peak_depths' in stats['outputs'][0]:
+                for output in stats['outputs']:
+                    peaks = output['peak_depths']
+                    report(f"    {output['format']}: streamed in {output['seconds']:.2f}s, deepest queues "
+                           f"{peaks['decoded']} decoded, {peaks['composited']} composited, "
+                           f"{peaks['encoding']} encoding")
+            elif len(stats['outputs']) > 1:
+                report("    " + ", ".join(f"{output['format']} {output['seconds']:.2f}s {output['bytes']} bytes"
+                                          for output in stats['outputs']))
+    elapsed = time.perf_counter() - start
+
+    total_frames = sum(stats['frames'] for stats in results)
+    report(f"Done: {len(results)} files, {len(failures)} failed, {total_frames} frames in {elapsed:.2f}s "
+           f"({len(results) / max(elapsed, 1e-9):.2f} files/s, {total_frames / max(elapsed, 1e-9):.1f} frames/s)")
+    if formats and len(formats) > 1:
+        for format in formats:
+            written = [output for stats in results for output in stats['outputs'] if output['format'] == format]
+            report(f"  {format}: {sum(output['seconds'] for output in written):.2f}s encoding, "
+                   f"{sum(output['bytes'] for output in written)} bytes")
+    return results, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a mask to many GIFs or videos in parallel.")
+    parser.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+    parser.add_argument('--mask', help="PNG mask to apply")
+    parser.add_argument('--size', type=parse_size, default=(None, None),
+                        help="output size as WIDTH, WIDTHxHEIGHT or xHEIGHT")
+    parser.add_argument('--out', default='gifbruhh_out', help="output directory")
+    parser.add_argument('--add', action='store_true', help="paste the mask instead of cutting it out")
+    parser.add_argument('--flip', action='store_true', help="flip the mask horizontally")
+    parser.add_argument('--speed', type=int, default=100, help="frame duration in milliseconds")
+    parser.add_argument('--dedup', type=float, nargs='?', const=gifcore.DEDUP_THRESHOLD, default=None,
+                        metavar='THRESHOLD', help="merge runs of (near-)duplicate frames into longer frames; "
+                                                  "0 merges only identical frames")
+    parser.add_argument('--retime', type=float, default=None, metavar='FPS',
+                        help="resample the frames to this frame rate, keeping the clip's length")
+    parser.add_argument('--blend', action='store_true',
+                        help="with --retime, blend the frames a slot covers instead of dropping them")
+    parser.add_argument('--fps', type=float, default=gifcore.VIDEO_FPS, help="frame rate to decode videos at")
+    parser.add_argument('--start', type=float, default=0, help="video start time in seconds")
+    parser.add_argument('--end', type=float, default=None, help="video end time in seconds")
+    parser.add_argument('--no-optimize', dest='optimize', action='store_false',
+                        help="write full frames instead of inter-frame deltas")
+    add_encoder_arguments(parser)
+    parser.add_argument('--max-size', type=int, default=None, metavar='KB',
+                        help="fit each output in this many KB, at the best size, colors/quality and frame rate "
+                             "predicted to fit (the size from --size is the largest wanted)")
+    parser.add_argument('--stream', action='store_true',
+                        help="convert videos frame by frame through bounded queues, so memory stays flat however "
+                             "long they are (not with --dedup, --retime or --max-size, which need the whole clip)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--memory-budget', type=int, default=None, metavar='MB',
+                        help="decoded frames per file above this spill to a scratch file")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="don't read or write the decoded-frame cache")
+    args = parser.parse_args(argv)
+    if args.stream and (args.dedup is not None or args.retime is not None or args.max_size is not None):
+        parser.error("--stream can't be combined with --dedup, --retime or --max-size")
+
+    inputs = collect_inputs(args.inputs)
+    if args.mask:
+        inputs = [path for path in inputs if os.path.abspath(path) != os.path.abspath(args.mask)]
+    if not inputs:
+        print("No supported input files found.", file=sys.stderr)
+        return 1
+
+    _, failures = run_batch(inputs, args.out, args.mask, args.size, args.add, args.flip,
+                            args.speed, args.optimize,
+                            {'fps': args.fps, 'start': args.start, 'end': args.end}, args.workers,
+                            args.memory_budget * 1024 ** 2 if args.memory_budget else None, args.cache, args.dedup,
+                            args.formats, encoder_options(args), args.max_size * 1024 if args.max_size else None,
+                            args.retime, args.blend, args.stream)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
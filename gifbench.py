@@ -0,0 +1,273 @@
+"""Benchmark the load, resize, composite, preview and save paths headlessly.
+
+Synthetic GIFs, PNG masks and videos are generated into a work directory,
+then every stage runs in a fresh process at each size and frame count so
+its peak RSS is its own. Results go to a JSON file and can be compared
+against a stored baseline.
+
+Example:
+    python gifbench.py --out bench.json --baseline bench_baseline.json
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+import numpy as np
+
+import gifcache
+import gifcore
+import gifencode
+import gifvideo
+from gifedits import EditList, Mask, Resize
+from gifpreview import PreviewRenderer
+
+SIZES = [(320, 240), (640, 480), (1280, 720)]
+FRAME_COUNTS = [10, 50]
+STAGES = ['load_gif', 'load_video', 'resize', 'add', 'cutout', 'preview', 'save', 'save_webp', 'save_apng']
+VIDEO_FPS = 10
+TOLERANCE = 0.2  # slowdown / growth against the baseline that counts as a regression
+
+
+def synthetic_frames(size, count, seed=0):
+    """A gradient background with a moving box and some noise, so frames differ like real footage."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    for i in range(count):
+        pixels = np.empty((height, width, 3), dtype=np.uint8)
+        pixels[..., 0] = (x + i * 4) % 256
+        pixels[..., 1] = y
+        pixels[..., 2] = (x[::-1] + y) / 2
+        box = (i * width // max(count, 1)) % width
+        pixels[height // 3:height // 3 * 2, box:box + width // 8] = (255, 255, 255)
+        noise = rng.integers(0, 8, (height, width, 1), dtype=np.uint8)
+        yield Image.fromarray(pixels + noise, "RGB")
+
+
+def make_gif(path, size, count):
+    frames = list(synthetic_frames(size, count))
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=100, loop=0)
+
+
+def make_mask(path, size=(400, 300)):
+    """A speech-bubble style mask: opaque shape, soft edge, transparent surround."""
+    mask = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((size[0] // 8, 0, size[0] * 7 // 8, size[1] * 2 // 3), fill=(255, 255, 255, 255))
+    draw.polygon([(size[0] // 3, size[1] // 2), (size[0] // 4, size[1]), (size[0] // 2, size[1] // 2)],
+                 fill=(255, 255, 255, 160))
+    mask.save(path)
+
+
+def make_video(path, size, count):
+    """Encode synthetic frames at VIDEO_FPS with ffmpeg's built-in mpeg4 encoder."""
+    command = [gifvideo.ffmpeg_exe(), "-v", "error", "-y", "-f", "rawvideo", "-pix_fmt", "rgb24",
+               "-s", f"{size[0]}x{size[1]}", "-r", str(VIDEO_FPS), "-i", "-",
+               "-c:v", "mpeg4", "-q:v", "3", "-pix_fmt", "yuv420p", path]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    for frame in synthetic_frames(size, count):
+        process.stdin.write(frame.tobytes())
+    process.stdin.close()
+    error = process.stderr.read().decode("utf-8", "replace")
+    if process.wait():
+        raise RuntimeError(error.strip())
+
+
+def prepare_inputs(workdir, sizes, counts, video=True):
+    """Generate any missing input files. Returns the set of stages that can't run (no ffmpeg)."""
+    os.makedirs(workdir, exist_ok=True)
+    mask_path = os.path.join(workdir, "mask.png")
+    if not os.path.exists(mask_path):
+        make_mask(mask_path)
+    skipped = set()
+    for size in sizes:
+        for count in counts:
+            gif_path = input_path(workdir, size, count, ".gif")
+            if not os.path.exists(gif_path):
+                make_gif(gif_path, size, count)
+            video_path = input_path(workdir, size, count, ".mp4")
+            if video and 'load_video' not in skipped and not os.path.exists(video_path):
+                try:
+                    make_video(video_path, size, count)
+                except (OSError, RuntimeError) as e:
+                    print(f"Skipping video stages: {e}", file=sys.stderr)
+                    skipped.add('load_video')
+    if not video:
+        skipped.add('load_video')
+    return skipped
+
+
+def input_path(workdir, size, count, extension):
+    return os.path.join(workdir, f"bench_{size[0]}x{size[1]}_{count}{extension}")
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where it can't be read."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_stage(stage, workdir, size, count):
+    """Run one stage in this process and return its result dict. Setup isn't timed."""
+    gifcache.ENABLED = False
+    gif_path = input_path(workdir, size, count, ".gif")
+    mask = gifcore.load_mask(os.path.join(workdir, "mask.png"))
+    frames = gifcore.load_image_frames(gif_path) if stage != 'load_gif' else None
+    output_bytes = None
+
+    if stage == 'load_gif':
+        start = time.perf_counter()
+        frames = gifcore.load_image_frames(gif_path)
+        seconds = time.perf_counter() - start
+        output_bytes = frames.nbytes
+    elif stage == 'load_video':
+        start = time.perf_counter()
+        frames = gifcore.load_video_frames(input_path(workdir, size, count, ".mp4"), fps=VIDEO_FPS)
+        seconds = time.perf_counter() - start
+        output_bytes = frames.nbytes
+    elif stage in ('resize', 'add', 'cutout'):
+        edits = EditList()
+        if stage == 'resize':
+            edits.add(Resize((size[0] * 3 // 4, size[1] * 3 // 4)))
+        else:
+            edits.add(Mask(mask.resize(size), add=stage == 'add'))
+        start = time.perf_counter()
+        for _ in edits.iter_frames(frames):
+            pass
+        seconds = time.perf_counter() - start
+    elif stage == 'preview':
+        edits = EditList()
+        edits.add(Mask(mask.resize(size)))
+        renderer = PreviewRenderer(1280, 720)
+        overlay = mask.resize(size)
+        start = time.perf_counter()
+        for index, source in enumerate(frames):
+            renderer.render_edited(index, source, edits, overlay)
+        seconds = time.perf_counter() - start
+    elif stage in ('save', 'save_webp', 'save_apng'):
+        format = stage[5:] or 'gif'
+        edits = EditList()
+        edits.add(Mask(mask.resize(size)))
+        output = os.path.join(workdir, f"out_{size[0]}x{size[1]}_{count}{gifencode.EXTENSIONS[format]}")
+        start = time.perf_counter()
+        stats = gifencode.export_animation(list(frames), output, format, prepare=edits.render)
+        seconds = time.perf_counter() - start
+        output_bytes = stats['bytes']
+        os.remove(output)
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    return {
+        'case': f"{stage}/{size[0]}x{size[1]}/{count}",
+        'stage': stage,
+        'size': list(size),
+        'frames': count,
+        'seconds': seconds,
+        'peak_rss': peak_rss(),
+        'bytes': output_bytes,
+    }
+
+
+def run_isolated(stage, workdir, size, count):
+    # A fresh process per case, so peak RSS isn't inherited from earlier cases
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(run_stage, stage, workdir, size, count).result()
+
+
+def run_suite(workdir, stages=STAGES, sizes=SIZES, counts=FRAME_COUNTS, repeat=1, report=print):
+    skipped = prepare_inputs(workdir, sizes, counts, video='load_video' in stages)
+    results = []
+    for stage in stages:
+        if stage in skipped:
+            continue
+        for size in sizes:
+            for count in counts:
+                runs = [run_isolated(stage, workdir, size, count) for _ in range(repeat)]
+                # The fastest run is the least disturbed by the rest of the machine
+                result = min(runs, key=lambda run: run['seconds'])
+                results.append(result)
+                report(format_result(result))
+    return results
+
+
+def format_result(result):
+    rss = f"{result['peak_rss'] / 1024 ** 2:.0f} MB" if result['peak_rss'] else "n/a"
+    size = f", {result['bytes']} bytes" if result['bytes'] is not None else ""
+    return f"{result['case']}: {result['seconds'] * 1000:.1f} ms, peak RSS {rss}{size}"
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pillow': Image.__version__,
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Return a message for every case that got slower or bigger than baseline by more than tolerance."""
+    previous = {result['case']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(result['case'])
+        if old is None:
+            continue
+        for key, label in (('seconds', "time"), ('peak_rss', "peak RSS"), ('bytes', "output size")):
+            if old.get(key) and result.get(key) and result[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{result['case']}: {label} {old[key]:.4g} -> {result[key]:.4g} "
+                                   f"(+{(result[key] / old[key] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark gifbruhh's processing stages.")
+    parser.add_argument('--out', default='bench_results.json', help="JSON file to write results to")
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="allowed slowdown/growth against the baseline (0.2 = 20%%)")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--quick', action='store_true', help="smallest size and frame count only")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case; the fastest is kept")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'gifbruhh-bench'),
+                        help="where synthetic inputs are generated and kept between runs")
+    args = parser.parse_args(argv)
+
+    sizes = SIZES[:1] if args.quick else SIZES
+    counts = FRAME_COUNTS[:1] if args.quick else FRAME_COUNTS
+    results = run_suite(args.workdir, args.stages, sizes, counts, args.repeat)
+    with open(args.out, "w") as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
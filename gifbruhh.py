@@ -1,15 +1,37 @@
-from PIL import Image, ImageTk, ImageSequence
-from tkinter import filedialog, messagebox, simpledialog, Menu
-import customtkinter as ctk
+import gifstartup
+
+with gifstartup.timing("PIL"):
+    from PIL import Image, ImageTk
+with gifstartup.timing("tkinter"):
+    from tkinter import filedialog, messagebox, simpledialog, Menu
+with gifstartup.timing("customtkinter"):
+    import customtkinter as ctk
 import os
 import sys
-from moviepy.editor import VideoFileClip
 import threading
+with gifstartup.timing("editor modules"):
+    import gifprofile
+    from gifdispatch import Dispatcher
+    from gifplayback import PlaybackEngine
+    from gifpreview import MipPyramid, PreviewRenderer
+    from gifedits import EditedFrames, EditList, Mask, Resize, Speed
+    from gifworker import Cancelled, FrameJobExecutor
+
+# numpy, ffmpeg and the encoder aren't needed to show the window: they're
+# imported on first use, or by gifstartup.warm_up once the window is up
+gifbudget = gifstartup.lazy_import("gifbudget")
+gifcache = gifstartup.lazy_import("gifcache")
+gifcore = gifstartup.lazy_import("gifcore")
+gifencode = gifstartup.lazy_import("gifencode")
+gifstore = gifstartup.lazy_import("gifstore")
+gifstream = gifstartup.lazy_import("gifstream")
+gifvideo = gifstartup.lazy_import("gifvideo")
 
 
 class GifEditor:
     MAX_WIDTH = 1280
     MAX_HEIGHT = 720
+    DRAG_REFINE_DELAY = 150  # ms without motion before a drag is rendered at full quality
     CONFIG_FILE = os.path.join(os.getenv('APPDATA'), 'gifbruhh', 'config.txt')
 
     def __init__(self, root):
@@ -17,6 +39,9 @@ class GifEditor:
         ctk.set_appearance_mode("dark")
 
         os.makedirs(os.path.dirname(self.CONFIG_FILE), exist_ok=True)
+        gifcache.CACHE_DIR = os.path.join(os.path.dirname(self.CONFIG_FILE), 'cache')
+        gifprofile.LOG_PATH = os.path.join(os.path.dirname(self.CONFIG_FILE), 'stats.jsonl')
+        self.encoder_settings = {}  # WebP/APNG quality, lossless and effort; defaults in gifencode
         self.load_config()
 
         # Create a frame and a canvas
@@ -27,9 +52,14 @@ class GifEditor:
         self.canvas.pack(fill=ctk.BOTH, expand=True)
         
         self.image_filename = ""
-        self.png_filename = ""
-        self.frames = []
         self.original_frames = []
+        self.edits = EditList()
+        self.frames = EditedFrames(self.original_frames, self.edits)
+        self.proxy_frames = self.original_frames
+        self.frame_holds = None  # source frames each frame stands for, after merging duplicates
+        self.encode_cache = None  # encoded frames of earlier saves, for quick re-saves
+        self.dedup_threshold = None
+        self.max_kb = 1024  # last limit asked for in Save Under Size
         self.framerate = 10 
         self.gif_speed = 100
         self.mask_img_original = None
@@ -39,6 +69,25 @@ class GifEditor:
         self.stretch_offset = 0
         self.flip_mode = ctk.BooleanVar(value=False)
         self.add_mode = ctk.BooleanVar(value=False)
+        self.shared_palette = ctk.BooleanVar(value=False)
+        self.optimize_frames = ctk.BooleanVar(value=True)
+        self.blend_frames = ctk.BooleanVar(value=False)
+        self.proxy_editing = ctk.BooleanVar(value=True)
+        self.instrumentation = ctk.BooleanVar(value=gifprofile.ENABLED)
+        self.preview = PreviewRenderer(self.MAX_WIDTH, self.MAX_HEIGHT)
+        self.tk_img = None
+        self.canvas_image = None
+        self.pyramids = {}
+        self.drag_refine = None
+        self.drag_render_id = None
+        self.drag_refine_id = None
+        self.playback = PlaybackEngine(root, self.show_played_frame, self.report_playback)
+        # Loader and export threads reach the widgets only through this
+        self.ui = Dispatcher(root)
+        # Retiming and merging duplicates run here, one job at a time: a new one cancels the last
+        self.frame_jobs = FrameJobExecutor(self.ui)
+        self.load_cancel = None  # threading.Event of the load in progress
+        self.task_cancel = None  # threading.Event of whatever the progress bar is showing
 
         self.progress_frame = ctk.CTkFrame(root, fg_color='transparent', height=2)  # Small height for just the progress bar
         self.progress_frame.pack(side=ctk.BOTTOM, fill=ctk.X)
@@ -88,6 +137,12 @@ class GifEditor:
                                         hover_color=hover_color)
         self.save_button.pack(side=ctk.LEFT, padx=5)
 
+        # Only shown while a load or export is running
+        self.cancel_button = ctk.CTkButton(self.buttons_frame, text="Cancel",
+                                           command=self.cancel_task,
+                                           fg_color=button_color,
+                                           hover_color=hover_color)
+
 
         self.menu_button = ctk.CTkButton(self.buttons_frame, text="Options", 
                                         command=self.show_menu,
@@ -101,11 +156,23 @@ class GifEditor:
         self.options_menu.add_command(label="Remove Canvas", command=self.remove_image)
         self.options_menu.add_command(label="Remove Mask", command=self.remove_mask)
         self.options_menu.add_command(label="Change Framerate", command=self.change_framerate)
+        self.options_menu.add_checkbutton(label="Blend Frames When Retiming", variable=self.blend_frames)
         self.options_menu.add_command(label="Change Speed", command=self.change_gif_speed)
+        self.options_menu.add_command(label="Merge Duplicate Frames...", command=self.merge_duplicate_frames)
         self.options_menu.add_checkbutton(label="Add Mask", variable=self.add_mode, command=self.add_png_toggle)
         self.options_menu.add_checkbutton(label="Flip Mask", variable=self.flip_mode, command=self.display_frame)
         self.options_menu.add_checkbutton(label="Play Animation", variable=self.playing, command=self.toggle_playback)
         self.options_menu.add_checkbutton(label="Lock Aspect Ratio", variable=self.aspect_ratio_locked)
+        self.options_menu.add_checkbutton(label="Shared Palette", variable=self.shared_palette)
+        self.options_menu.add_checkbutton(label="Optimize Frames", variable=self.optimize_frames)
+        self.options_menu.add_command(label="WebP/APNG Settings...", command=self.change_encoder_settings)
+        self.options_menu.add_command(label="Save Under Size...", command=self.save_under_size)
+        self.options_menu.add_command(label="Convert Video (Streaming)...", command=self.convert_video_streaming)
+        self.options_menu.add_checkbutton(label="Proxy Editing", variable=self.proxy_editing,
+                                          command=self.toggle_proxy)
+        self.options_menu.add_checkbutton(label="Record Stage Timings", variable=self.instrumentation,
+                                          command=self.toggle_instrumentation)
+        self.options_menu.add_command(label="Stage Timings...", command=self.show_stats)
         
         # Entry fields for width and height
         self.width_value = ctk.StringVar()
@@ -125,6 +192,7 @@ class GifEditor:
         # Bind for vertical scaling
         self.canvas.bind("<ButtonPress-1>", self.on_button_press)
         self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
+        self.canvas.bind("<ButtonRelease-1>", self.on_button_release)
 
         # Bind for maintaining aspect ratio
         self.canvas.bind("<ButtonPress-3>", self.on_button_press_right)
@@ -143,6 +211,7 @@ class GifEditor:
     def load_config(self):
         """Load configuration from config file."""
         self.last_save_directory = os.path.expanduser("~")  # Default to home directory
+        self.png_filename = ""
         if os.path.exists(self.CONFIG_FILE):
             with open(self.CONFIG_FILE, "r") as f:
                 lines = f.readlines()
@@ -150,7 +219,27 @@ class GifEditor:
                     if line.startswith("SAVE_DIR="):
                         self.last_save_directory = line.strip().split("=")[1]
                     elif line.startswith("PNG_FILE="):
-                        self.png_filename = line.strip().split("=")[1]
+                        self.png_filename = line.strip().split("=", 1)[1]
+                    elif line.startswith("MEMORY_BUDGET_MB="):
+                        # Decoded frames beyond this spill to a scratch file
+                        gifstore.MEMORY_BUDGET = int(line.strip().split("=")[1]) * 1024 ** 2
+                    elif line.startswith("PROFILE="):
+                        gifprofile.ENABLED = line.strip().split("=")[1] == "1"
+                    elif line.startswith("PROFILE_DUMPS="):
+                        # Directory for a cProfile dump of every load and export
+                        gifprofile.PROFILE_DIR = line.strip().split("=", 1)[1] or None
+                    elif line.startswith("CACHE_MB="):
+                        # 0 turns the decoded-frame cache off. Assigned, never read back, so gifcache
+                        # (and numpy with it) isn't imported until the window is up
+                        cache_mb = int(line.strip().split("=")[1])
+                        gifcache.MAX_BYTES = cache_mb * 1024 ** 2
+                        gifcache.ENABLED = cache_mb > 0
+                    elif line.startswith("WEBP_QUALITY="):
+                        self.encoder_settings['quality'] = int(line.strip().split("=")[1])
+                    elif line.startswith("WEBP_LOSSLESS="):
+                        self.encoder_settings['lossless'] = line.strip().split("=")[1] == "1"
+                    elif line.startswith("EFFORT="):
+                        self.encoder_settings['effort'] = int(line.strip().split("=")[1])
 
     def save_config(self):
         """Save configuration to config file."""
@@ -158,19 +247,28 @@ class GifEditor:
             f.write(f"SAVE_DIR={self.last_save_directory}\n")
             if self.png_filename:
                 f.write(f"PNG_FILE={self.png_filename}\n")
+            f.write(f"MEMORY_BUDGET_MB={gifstore.MEMORY_BUDGET // 1024 ** 2}\n")
+            f.write(f"CACHE_MB={gifcache.MAX_BYTES // 1024 ** 2 if gifcache.ENABLED else 0}\n")
+            f.write(f"PROFILE={int(gifprofile.ENABLED)}\n")
+            if gifprofile.PROFILE_DIR:
+                f.write(f"PROFILE_DUMPS={gifprofile.PROFILE_DIR}\n")
+            if 'quality' in self.encoder_settings:
+                f.write(f"WEBP_QUALITY={self.encoder_settings['quality']}\n")
+            if 'lossless' in self.encoder_settings:
+                f.write(f"WEBP_LOSSLESS={int(self.encoder_settings['lossless'])}\n")
+            if 'effort' in self.encoder_settings:
+                f.write(f"EFFORT={self.encoder_settings['effort']}\n")
 
     def load_last_png(self):
-        if os.path.exists(self.CONFIG_FILE):
-            with open(self.CONFIG_FILE, "r") as f:
-                self.png_filename = f.read().strip()
-            if os.path.exists(self.png_filename):
-                try:
-                    self.mask_img_original = Image.open(self.png_filename).convert("RGBA")
-                    self.reset_mask()
-                    self.display_frame()
-                    self.update_cutout_button()
-                except Exception as e:
-                    print(f"Failed to load the last PNG: {e}")
+        # png_filename is PNG_FILE from the config, read by load_config
+        if self.png_filename and os.path.exists(self.png_filename):
+            try:
+                self.mask_img_original = gifcore.load_mask(self.png_filename)
+                self.reset_mask()
+                self.display_frame()
+                self.update_cutout_button()
+            except Exception as e:
+                print(f"Failed to load the last PNG: {e}")
 
     def load_image(self):
         self.image_filename = filedialog.askopenfilename(
@@ -178,106 +276,166 @@ class GifEditor:
         if not self.image_filename:
             return
 
-        threading.Thread(target=self._load_content).start()
-
-   
-    def _load_content(self):
-        # Clear previous frames
-        self.frames.clear()
-        self.original_frames.clear()
-
-        file_name = os.path.basename(self.image_filename)
-        self.root.title(f"gifbruhh - {file_name}")
-
-        file_ext = os.path.splitext(self.image_filename)[1].lower()
-
-        # Reset and show progress bar
-        self.progress.set(0)  # Reset the progress bar
-        self.progress.pack(side=ctk.BOTTOM, fill=ctk.X, pady=(0, 0))
-        self.root.update_idletasks()
-
-        if file_ext in ['.gif', '.png', '.jpg', '.jpeg']:
-            self._load_image_file()
-        elif file_ext in ['.mp4', '.mov', '.m4v', '.mkv']:
-            self._load_video()
-
-    def _load_video(self):
+        # Videos are decoded by ffmpeg at the rate, range and size chosen up front
+        self.video_options = {}
+        if gifcore.is_video_file(self.image_filename):
+            try:
+                info = gifvideo.probe(self.image_filename)
+            except FileNotFoundError:
+                messagebox.showerror("FFmpeg Missing", "Please install FFmpeg and ensure it's in your PATH.")
+                return
+            except Exception as e:
+                messagebox.showerror("Error", f"An error occurred while reading the video: {str(e)}")
+                return
+            dialog = VideoOptionsDialog(self.root, info, gifcore.VIDEO_FPS)
+            self.root.wait_window(dialog)
+            if dialog.result is None:
+                return
+            self.video_options = dict(dialog.result, info=info)
+
+        # Stop a load still running, and clear the previous frames
+        if self.load_cancel is not None:
+            self.load_cancel.set()
+        cancel = self.load_cancel = threading.Event()
+        self.set_source_frames([])
+        self.root.title(f"gifbruhh - {os.path.basename(self.image_filename)}")
+        self.show_progress(cancel)
+        threading.Thread(target=self._load_content, args=(self.image_filename, self.video_options, cancel),
+                         daemon=True, name="gifbruhh-load").start()
+
+    def _load_content(self, filename, video_options, cancel):
+        """Decode filename on the loader thread; the result goes back to the Tk thread through self.ui."""
+        def on_progress(done, total):
+            self.ui.progress("load", self.set_task_progress, cancel, done, total)
+
+        frames, error = None, None
         try:
-            clip = VideoFileClip(self.image_filename)
-            target_fps = 5  # Example target frame rate
-            resized_clip = clip.set_fps(target_fps)
-
-            total_frames = int(clip.duration * target_fps)  # Total number of frames
-            for frame in resized_clip.iter_frames(dtype='uint8'):
-                pil_frame = Image.fromarray(frame, 'RGB').convert("RGBA")
-                self.frames.append(pil_frame)
-                self.original_frames.append(pil_frame.copy())
-
-                # Update progress bar
-                self.progress.set(len(self.frames) / total_frames)
-                self.root.update_idletasks()
-
-            clip.close()
-
+            if gifcore.is_video_file(filename):
+                with gifprofile.stage("decode_video", profile=True, source=filename) as record:
+                    frames = gifcore.load_video_frames(filename, progress=on_progress, cancelled=cancel.is_set,
+                                                       **video_options)
+                    record['frames'] = len(frames)
+                    record['bytes'] = frames.nbytes
+            elif gifcore.file_extension(filename) == '.gif':
+                # Frame 0 comes back right away; the rest keep decoding in the background
+                with gifprofile.stage("decode_gif_first_frame", source=filename):
+                    frames = gifcore.stream_gif_frames(
+                        filename, progress=on_progress, cancelled=cancel.is_set,
+                        on_done=lambda frames, error: self.ui.post(self.finish_gif_decode, frames, error, cancel))
+            else:
+                with gifprofile.stage("decode_image", profile=True, source=filename) as record:
+                    frames = gifcore.load_image_frames(filename)
+                    record['frames'] = len(frames)
+                    record['bytes'] = frames.nbytes
+        except Exception as e:
+            error = e
+        self.ui.post(self.finish_load, filename, frames, error, cancel)
+
+    def finish_load(self, filename, frames, error, cancel):
+        if cancel is not self.load_cancel:
+            return  # Another file was loaded meanwhile
+        if error is not None:
+            if isinstance(error, FileNotFoundError) and gifcore.is_video_file(filename):
+                messagebox.showerror("FFmpeg Missing", "Please install FFmpeg and ensure it's in your PATH.")
+            elif gifcore.is_video_file(filename):
+                messagebox.showerror("Error", f"An error occurred while processing the video: {str(error)}")
+            else:
+                messagebox.showerror("Error", f"An error occurred while loading the image: {str(error)}")
+        else:
+            # A cancelled load keeps the frames decoded so far
+            self.set_source_frames(frames)
             if self.frames:
-                frame_width, frame_height = self.frames[0].size
+                frame_width, frame_height = self.original_frames.size
                 self.width_value.set(str(frame_width))
                 self.height_value.set(str(frame_height))
+        self.after_loading()
 
-        except FileNotFoundError:
-            messagebox.showerror("FFmpeg Missing", "Please install FFmpeg and ensure it's in your PATH.")
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while processing the video: {str(e)}")
-        finally:
-            self.after_loading()
+    def show_progress(self, cancel):
+        """Show the progress bar and Cancel button for the task that stops when cancel is set."""
+        self.task_cancel = cancel
+        self.progress.set(0)
+        self.progress.pack(side=ctk.BOTTOM, fill=ctk.X, pady=(0, 0))
+        self.cancel_button.configure(state=ctk.NORMAL)
+        self.cancel_button.pack(side=ctk.RIGHT, padx=5)
 
-    def _load_image_file(self):
-        try:
-            im = Image.open(self.image_filename)
-            if im.format != 'GIF':
-                im = im.convert("RGBA")
-                self.frames = [im]
-                self.original_frames = [im.copy()]
-            else:
-                self.frames = [frame.copy().convert("RGBA") for frame in ImageSequence.Iterator(im)]
-                self.original_frames = [frame.copy() for frame in self.frames]
+    def set_task_progress(self, cancel, done, total):
+        if cancel is self.task_cancel:
+            self.progress.set(done / max(total, 1))
 
-            if self.frames:
-                frame_width, frame_height = self.frames[0].size
-                self.width_value.set(str(frame_width))
-                self.height_value.set(str(frame_height))
+    def hide_progress(self, cancel):
+        """Hide the progress bar, unless another task has taken it over since cancel's started."""
+        if cancel is not self.task_cancel:
+            return
+        self.task_cancel = None
+        self.progress.pack_forget()
+        self.cancel_button.pack_forget()
+
+    def cancel_task(self):
+        if self.task_cancel is not None:
+            self.task_cancel.set()
+            self.cancel_button.configure(state=ctk.DISABLED)
+
+    def set_source_frames(self, frames):
+        """Replace the source frames and drop all edits made to the previous ones."""
+        if self.playback.running:
+            self.stop_playback()
+        self.frame_jobs.cancel()
+        self.original_frames = frames
+        self.frame_holds = None
+        if self.encode_cache is not None:
+            self.encode_cache.clear()
+        self.edits.clear()
+        self.frames = EditedFrames(self.original_frames, self.edits)
+        self.update_proxy()
+
+    def update_proxy(self):
+        """Edit on frames downscaled to the preview box; the export still reads the full-resolution sources."""
+        if self.proxy_editing.get():
+            self.proxy_frames = gifstore.proxy(self.original_frames, self.MAX_WIDTH, self.MAX_HEIGHT)
+        else:
+            self.proxy_frames = self.original_frames
+        self.pyramids.clear()
+        self.preview.clear()
 
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while loading the image: {str(e)}")
-        finally:
-            self.after_loading()
+    def toggle_proxy(self):
+        self.update_proxy()
+        self.display_frame()
 
     def after_loading(self):
         if self.frames:
             self.current_frame = 0
-            self.original_image_size = self.frames[0].size
+            self.original_image_size = self.original_frames.size
             self.current_width, self.current_height = self.original_image_size
 
             self.display_frame()  # Display the first frame initially
             self.update_cutout_button()
-            self.save_button.configure(state=ctk.NORMAL)
 
-        self.progress.pack_forget()  # Hide the progress bar
+        if getattr(self.original_frames, 'complete', True):
+            if self.frames:
+                self.save_button.configure(state=ctk.NORMAL)
+            self.hide_progress(self.load_cancel)
+
+    def finish_gif_decode(self, frames, error, cancel):
+        if frames is not self.original_frames:
+            return  # Another file was loaded meanwhile
+        self.ui.discard("load")
+        self.hide_progress(cancel)
+        self.save_button.configure(state=ctk.NORMAL)
+        if error is not None:
+            messagebox.showerror("Error", f"Only {len(frames)} frames could be loaded: {str(error)}")
 
 
     def load_png(self):
-        self.png_filename = filedialog.askopenfilename(filetypes=[("PNG Files", "*.png")])
-        if not self.png_filename:
-            return
+        png_filename = filedialog.askopenfilename(filetypes=[("PNG Files", "*.png")])
+        if not png_filename:
+            return  # Keep the mask remembered so far
+        self.png_filename = png_filename
 
-        # Write the PNG filename to config
-        if not os.path.exists(os.path.dirname(self.CONFIG_FILE)):
-            os.makedirs(os.path.dirname(self.CONFIG_FILE))
-        with open(self.CONFIG_FILE, "w") as f:
-            f.write(f"PNG_FILE={self.png_filename}\n")
+        # Remember the mask, keeping the rest of the config
+        self.save_config()
 
         try:
-            self.mask_img_original = Image.open(self.png_filename).convert("RGBA")
+            self.mask_img_original = gifcore.load_mask(self.png_filename)
             self.reset_mask()  # Ensure we're resetting the mask size appropriately
             self.display_frame()  # Immediately display the updated frame with the mask
             self.update_cutout_button()
@@ -287,8 +445,8 @@ class GifEditor:
     def reset_image(self):
         """Reset the image to its original size while maintaining mask height scaling."""
         if self.frames:
-            # Reset the frames to their original size
-            self.frames = [frame.copy() for frame in self.original_frames]
+            # Drop every edit except the speed; the source frames were never modified
+            self.edits.clear(keep=Speed)
             self.current_width, self.current_height = self.original_image_size
             self.width_value.set(str(self.current_width))
             self.height_value.set(str(self.current_height))
@@ -308,8 +466,7 @@ class GifEditor:
 
     def remove_image(self):
         # Clear all frames and states
-        self.frames.clear()
-        self.original_frames.clear()
+        self.set_source_frames([])
         self.image_filename = ""
         self.mask_img_original = None
         self.mask_img_resized = None
@@ -317,6 +474,10 @@ class GifEditor:
         
         # Reset the canvas
         self.canvas.delete("all")
+        self.canvas_image = None
+        self.tk_img = None
+        self.preview.clear()
+        self.pyramids.clear()
         
         # Disable buttons that require an image
         self.cutout_button.configure(state=ctk.DISABLED)
@@ -329,7 +490,7 @@ class GifEditor:
 
     def reset_mask(self):
         if self.mask_img_original and self.frames:
-            self.mask_img_resized = self.mask_img_original.resize(self.frames[self.current_frame].size, Image.LANCZOS)
+            self.mask_img_resized = self.mask_img_original.resize((self.current_width, self.current_height), Image.LANCZOS)
     
     def remove_mask(self):
         """Remove the mask completely."""
@@ -354,10 +515,8 @@ class GifEditor:
                 aspect_ratio = self.original_image_size[1] / self.original_image_size[0]
                 new_height = int(new_width * aspect_ratio)
                 
-            # Always resize using the original full-resolution frames
-            self.frames = [
-                orig_frame.resize((new_width, new_height), Image.LANCZOS) for orig_frame in self.original_frames
-            ]
+            # Only recorded here; frames are resampled from the originals when shown or saved
+            self.edits.add(Resize((new_width, new_height)))
             
             # Calculate current stretch factor before updating dimensions
             if self.mask_img_resized and self.mask_img_original:
@@ -392,65 +551,82 @@ class GifEditor:
             # Start playing if checked
             self.start_playback()
         else:
-            # Stop scheduling further frames when unchecked
-            if self.play_after_id is not None:
-                self.canvas.after_cancel(self.play_after_id)
+            self.stop_playback()
 
     def start_playback(self):
-        # Initialize playback
-        self.play_frames()
-
-    def play_frames(self):
-        if self.playing.get():
-            if self.current_frame < len(self.frames):
-                # Display current frame
-                self.display_frame()
-                self.current_frame += 1
-            else:
-                # Reset to the first frame when done
-                self.current_frame = 0
-
-            # Schedule the next frame display
-            self.play_after_id = self.canvas.after(self.gif_speed, self.play_frames)
+        if not self.frames:
+            self.playing.set(False)
+            return
+        # len() follows a GIF that is still decoding
+        self.playback.start(self.playback_renderer(), lambda: len(self.frames), self.current_frame,
+                            self.frame_duration)
+
+    def frame_duration(self, index):
+        """Display time of frame index in ms; merged duplicates are held for several frames."""
+        holds = self.frame_holds
+        if holds is None or index >= len(holds):
+            return self.gif_speed
+        return self.gif_speed * holds[index]
+
+    def stop_playback(self):
+        self.playback.stop()
+        self.playing.set(False)
+        self.root.title(f"gifbruhh - {os.path.basename(self.image_filename)}" if self.image_filename else "gifbruhh")
+
+    def playback_renderer(self):
+        """Render function for the playback worker, over a snapshot of the current edits and mask.
+
+        It gets its own PreviewRenderer, so the worker never shares a cache with the Tk thread.
+        """
+        renderer = PreviewRenderer(self.MAX_WIDTH, self.MAX_HEIGHT)
+        frames = self.proxy_frames
+        edits = self.edits.copy()
+        mask = self.mask_img_resized
+        flip = self.flip_mode.get()
+        source_size = self.original_frames.size
+        return lambda index: renderer.render_edited(index, frames[index], edits, mask, flip, source_size=source_size)
+
+    def show_played_frame(self, index, image):
+        self.current_frame = index
+        self.show_preview(image)
+
+    def report_playback(self, achieved_fps, target_fps, dropped):
+        self.root.title(f"gifbruhh - {os.path.basename(self.image_filename)} "
+                        f"({achieved_fps:.1f}/{target_fps:.1f} fps, {dropped} dropped)")
 
     def display_frame(self):
         if not self.frames:
             return
+        if self.playback.running:
+            # The next played frame picks up the change
+            self.playback.update(self.playback_renderer())
+            return
 
-        frame = self.frames[self.current_frame]
-
-        if self.mask_img_resized:
-            mask_to_use = self.mask_img_resized
-            if self.flip_mode.get():
-                mask_to_use = mask_to_use.transpose(Image.FLIP_LEFT_RIGHT)
-
-            display_frame = frame.copy()
-            display_frame.paste(mask_to_use, (0, 0), mask_to_use)
+        with gifprofile.stage("preview", index=self.current_frame):
+            source = self.proxy_frames[self.current_frame]
+            display_frame = self.preview.render_edited(self.current_frame, source, self.edits,
+                                                       self.mask_img_resized, self.flip_mode.get(),
+                                                       source_size=self.original_frames.size)
+            self.show_preview(display_frame)
+
+    def show_preview(self, display_frame):
+        """Draw a rendered preview, updating the single canvas image item in place."""
+        if self.tk_img is not None and (self.tk_img.width(), self.tk_img.height()) == display_frame.size:
+            self.tk_img.paste(display_frame)
         else:
-            display_frame = frame
-
-        display_frame = self.resize_to_fit(display_frame)
+            self.tk_img = ImageTk.PhotoImage(display_frame)
+            if self.canvas_image is not None:
+                self.canvas.itemconfigure(self.canvas_image, image=self.tk_img)
+            self.canvas.config(width=display_frame.width, height=display_frame.height)
 
-        self.tk_img = ImageTk.PhotoImage(display_frame)
-        self.canvas.create_image(0, 0, anchor=ctk.NW, image=self.tk_img)
-        self.canvas.config(width=display_frame.width, height=display_frame.height)
+        if self.canvas_image is None:
+            self.canvas_image = self.canvas.create_image(0, 0, anchor=ctk.NW, image=self.tk_img)
         
     def add_png(self):
         if not self.mask_img_resized:
             return
 
-        for i in range(len(self.frames)):
-            frame = self.frames[i]
-            gif_width = frame.width
-            aspect_ratio = self.mask_img_resized.height / self.mask_img_resized.width
-            new_height = int(gif_width * aspect_ratio)
-
-            stretched_mask = self.mask_img_resized.resize((gif_width, max(new_height, 1)), Image.LANCZOS)
-            if self.flip_mode.get():
-                stretched_mask = stretched_mask.transpose(Image.FLIP_LEFT_RIGHT)
-
-            frame.paste(stretched_mask, (0, 0), stretched_mask)
-            self.frames[i] = frame
+        self.edits.add(Mask(self.mask_img_resized, add=True, flip=self.flip_mode.get()))
 
         self.display_frame()
         self.save_button.configure(state=ctk.NORMAL)
@@ -459,45 +635,99 @@ class GifEditor:
         if not self.mask_img_resized:
             return
 
-        for i in range(len(self.frames)):
-            frame = self.frames[i]
-            gif_width = frame.width
-            aspect_ratio = self.mask_img_resized.height / self.mask_img_resized.width
-            new_height = int(gif_width * aspect_ratio)
-
-            stretched_mask = self.mask_img_resized.resize((gif_width, max(new_height, 1)), Image.LANCZOS)
-            if self.flip_mode.get():
-                stretched_mask = stretched_mask.transpose(Image.FLIP_LEFT_RIGHT)
-
-            alpha_mask = stretched_mask.split()[-1]
-            frame.paste((0, 0, 0, 0), (0, 0), alpha_mask)
-            self.frames[i] = frame
+        self.edits.add(Mask(self.mask_img_resized, add=False, flip=self.flip_mode.get()))
 
         self.display_frame()
         self.save_button.configure(state=ctk.NORMAL)
 
     def on_button_press(self, event):
         self.start_y = event.y
+        if self.mask_img_resized:
+            self.drag_mask_size = self.mask_img_resized.size
 
     def on_mouse_drag(self, event):
         """Handle the vertical scaling of the mask on drag."""
         if self.mask_img_original and self.mask_img_resized:
             delta_y = event.y - self.start_y
-            new_width = self.mask_img_resized.width  # Keep current width
-            new_height = max(self.mask_img_resized.height + delta_y, 1)
+            new_width = self.drag_mask_size[0]  # Keep current width
+            new_height = max(self.drag_mask_size[1] + delta_y, 1)
 
             # Update only the height scaling ratio
             self.height_scale_ratio = new_height / float(self.mask_img_original.height)
 
-            # Resize the mask with updated dimensions
-            self.mask_img_resized = self.mask_img_original.resize((new_width, new_height), Image.LANCZOS)
+            # Defer the full-quality mask resize until the pointer settles
+            self.drag_mask_size = (new_width, new_height)
             self.start_y = event.y
-            self.display_frame()
+            self.schedule_drag_render(self.refine_mask_drag)
+
+    def on_button_release(self, event):
+        self.finish_drag()
+
+    def refine_mask_drag(self):
+        self.mask_img_resized = self.mask_img_original.resize(self.drag_mask_size, Image.LANCZOS)
+        self.display_frame()
+
+    def schedule_drag_render(self, refine):
+        """Coalesce motion events into at most one pending draft render.
+
+        The draft uses the mip pyramids and a cheap resampler; refine() does the
+        full-quality work once no motion has arrived for DRAG_REFINE_DELAY ms.
+        """
+        self.drag_refine = refine
+        if self.drag_render_id is None:
+            self.drag_render_id = self.root.after_idle(self.render_drag_preview)
+        if self.drag_refine_id is not None:
+            self.root.after_cancel(self.drag_refine_id)
+        self.drag_refine_id = self.root.after(self.DRAG_REFINE_DELAY, self.finish_drag)
+
+    def render_drag_preview(self):
+        self.drag_render_id = None
+        if not self.frames:
+            return
+
+        if self.drag_refine == self.refine_frame_drag:
+            frame_pyramid = self.get_pyramid('frame', self.proxy_frames[self.current_frame])
+            frame_size = (self.resize_target_width, self.resize_target_height)
+        else:
+            frame = self.preview.render_edited(self.current_frame, self.proxy_frames[self.current_frame],
+                                               self.edits, source_size=self.original_frames.size)
+            frame_pyramid = self.get_pyramid('frame', frame)
+            frame_size = self.edits.output_size(self.original_frames.size)
+
+        mask_pyramid = None
+        mask_size = None
+        if self.mask_img_original and self.mask_img_resized:
+            mask_pyramid = self.get_pyramid('mask', self.mask_img_original)
+            mask_size = self.drag_mask_size
+
+        draft = self.preview.render_draft(frame_pyramid, frame_size, mask_pyramid, mask_size, self.flip_mode.get())
+        self.show_preview(draft)
+
+    def finish_drag(self):
+        """Cancel any pending draft and run the full-quality render for the last drag state."""
+        if self.drag_render_id is not None:
+            self.root.after_cancel(self.drag_render_id)
+            self.drag_render_id = None
+        if self.drag_refine_id is not None:
+            self.root.after_cancel(self.drag_refine_id)
+            self.drag_refine_id = None
+        if self.drag_refine is not None:
+            refine, self.drag_refine = self.drag_refine, None
+            refine()
+
+    def get_pyramid(self, name, image):
+        """Return the mip pyramid for image, rebuilding it when the image changed."""
+        pyramid = self.pyramids.get(name)
+        if pyramid is None or pyramid.source is not image:
+            pyramid = self.pyramids[name] = MipPyramid(image)
+        return pyramid
 
     def on_button_press_right(self, event):
+        if not self.frames:
+            return
         self.start_x = event.x
         self.start_y = event.y
-        self.initial_frame_width, self.initial_frame_height = self.frames[self.current_frame].size
+        self.initial_frame_width, self.initial_frame_height = self.current_width, self.current_height
         
         # Store original size for calculating final dimensions
         self.resize_target_width = self.initial_frame_width
@@ -508,6 +738,7 @@ class GifEditor:
             self.initial_mask_width, self.initial_mask_height = self.mask_img_resized.size
         else:
             self.initial_mask_width, self.initial_mask_height = self.initial_frame_width, self.initial_frame_height
+        self.drag_mask_size = (self.initial_mask_width, self.initial_mask_height)
         
         # Bind the release event when we start dragging
         self.canvas.bind("<ButtonRelease-3>", self.on_button_release_right)
@@ -520,8 +751,8 @@ class GifEditor:
             if self.aspect_ratio_locked.get():
                 delta = max(delta_x, delta_y, key=abs)
                 scaling_factor = 1 + (delta / float(self.initial_frame_width))
-                new_frame_width = int(self.initial_frame_width * scaling_factor)
-                new_frame_height = int(self.initial_frame_height * scaling_factor)
+                new_frame_width = max(int(self.initial_frame_width * scaling_factor), 1)
+                new_frame_height = max(int(self.initial_frame_height * scaling_factor), 1)
             else:
                 new_frame_width = max(int(self.initial_frame_width + delta_x), 1)
                 new_frame_height = max(int(self.initial_frame_height + delta_y), 1)
@@ -530,63 +761,35 @@ class GifEditor:
             self.resize_target_width = new_frame_width
             self.resize_target_height = new_frame_height
 
-            # Only resize the current frame during drag
-            self.frames[self.current_frame] = self.original_frames[self.current_frame].resize(
-                (new_frame_width, new_frame_height), Image.LANCZOS)
-
-            # Update mask if present
+            # Scale the mask along with the frame
             if self.mask_img_resized:
                 width_ratio = new_frame_width / self.initial_frame_width
                 height_ratio = new_frame_height / self.initial_frame_height
                 
-                new_mask_width = int(self.initial_mask_width * width_ratio)
-                new_mask_height = int(self.initial_mask_height * height_ratio)
-                self.mask_img_resized = self.mask_img_original.resize(
-                    (new_mask_width, new_mask_height), Image.LANCZOS)
+                new_mask_width = max(int(self.initial_mask_width * width_ratio), 1)
+                new_mask_height = max(int(self.initial_mask_height * height_ratio), 1)
+                self.drag_mask_size = (new_mask_width, new_mask_height)
 
             self.width_value.set(str(new_frame_width))
             self.height_value.set(str(new_frame_height))
 
-            self.display_frame()
+            # Only the current frame is resized, and only once the pointer settles
+            self.schedule_drag_render(self.refine_frame_drag)
+
+    def refine_frame_drag(self):
+        self.resize_frames((self.resize_target_width, self.resize_target_height))
+        if self.mask_img_resized:
+            self.mask_img_resized = self.mask_img_original.resize(self.drag_mask_size, Image.LANCZOS)
+        self.display_frame()
 
     def on_button_release_right(self, event):
         if hasattr(self, 'resize_target_width') and hasattr(self, 'resize_target_height'):
-            # Check if the file is an image or video by extension
-            file_ext = os.path.splitext(self.image_filename)[1].lower()
-            is_image = file_ext in ['.gif', '.png', '.jpg', '.jpeg']
-
-            total_frames = len(self.frames)
-
-            if not is_image:
-                # Show progress bar for videos only
-                self.progress.set(0)  # Reset the progress bar
-                self.progress.pack(side=ctk.BOTTOM, fill=ctk.X, pady=(0, 0))
-                self.root.update_idletasks()
-
-            # Resize all frames to the final dimensions
-            for i, original_frame in enumerate(self.original_frames):
-                self.frames[i] = original_frame.resize(
-                    (self.resize_target_width, self.resize_target_height), Image.LANCZOS)
-                
-                if not is_image:
-                    # Update progress bar with normalized value for videos
-                    self.progress.set((i + 1) / total_frames)
-                    self.root.update_idletasks()
+            # Records the final dimensions for all frames and renders at full quality
+            self.finish_drag()
 
-            if not is_image:
-                # Hide progress bar after operation is complete for videos
-                self.progress.pack_forget()
-
-            # Final display update
-            self.display_frame()
-
-    def resize_to_fit(self, image):
-        width, height = image.size
-        if width > self.MAX_WIDTH or height > self.MAX_HEIGHT:
-            scaling_factor = min(self.MAX_WIDTH / width, self.MAX_HEIGHT / height)
-            new_size = (int(width * scaling_factor), int(height * scaling_factor))
-            return image.resize(new_size, Image.LANCZOS)
-        return image
+    def resize_frames(self, size):
+        self.edits.add(Resize(size))
+        self.current_width, self.current_height = size
 
     def apply_action(self):
         if not self.mask_img_original:
@@ -603,16 +806,96 @@ class GifEditor:
         else:
             self.cutout_button.configure(state=ctk.DISABLED)
     
+    def toggle_instrumentation(self):
+        gifprofile.ENABLED = self.instrumentation.get()
+        self.save_config()
+
+    def memory_footprint(self):
+        """(label, bytes) for what the editor currently holds in memory."""
+        footprint = [("Source frames", getattr(self.original_frames, 'nbytes', 0))]
+        if self.proxy_frames is not self.original_frames:
+            footprint.append(("Proxy frames", self.proxy_frames.nbytes))
+        footprint.append(("Preview cache", self.preview.cache.current_bytes))
+        return footprint
+
+    def show_stats(self):
+        StatsDialog(self.root, self.memory_footprint)
+
+    def other_frame_job(self, title, name):
+        """Ask the user to wait, and return True, while a frame job other than name is running.
+
+        Running name again replaces the job; anything else would work on the
+        frames from before it and silently drop its result.
+        """
+        job = self.frame_jobs.job
+        if job is None or job.name == name:
+            return False
+        messagebox.showinfo(title, "Wait for the frames to finish updating first.")
+        return True
+
     def change_framerate(self):
+        """Resample the frames to a new frame rate, keeping the clip's length.
+
+        Lowering the rate drops frames (or blends them, with Blend Frames When
+        Retiming), raising it holds them. The old frames are released, so frame
+        count, memory and encode time follow the new rate; the flip side is
+        that retiming again works on the retimed frames, and blends compound.
+        """
         if not self.frames:
             return
+        if not getattr(self.original_frames, 'complete', True):
+            messagebox.showinfo("Change Framerate", "Wait for the GIF to finish loading first.")
+            return
+        if self.other_frame_job("Change Framerate", "retime"):
+            return
+        total = sum(self.frame_duration(i) for i in range(len(self.original_frames)))
+        current = round(len(self.original_frames) * 1000 / total) if total else self.framerate
         new_framerate = simpledialog.askinteger("Change Framerate", "Enter the new framerate (frames per second):",
-                                                initialvalue=self.framerate, minvalue=1, maxvalue=60)
-        if new_framerate is not None:
-            self.framerate = new_framerate
-            # No need to resize frames when only changing framerate
-            self.display_frame()
-            self.save_button.configure(state=ctk.NORMAL)
+                                                initialvalue=current, minvalue=1, maxvalue=60)
+        if new_framerate is None:
+            return
+        self.framerate = new_framerate
+        if self.playback.running:
+            self.stop_playback()
+
+        # Blending a long clip takes a while, so it runs off the Tk thread
+        sources = self.original_frames
+        durations = [self.frame_duration(i) for i in range(len(sources))]
+        speed = self.gif_speed
+        blend = self.blend_frames.get()
+
+        def retime(job):
+            return gifcore.retime(sources, durations, new_framerate, blend, map_frames=job.map)
+
+        def on_progress(done, total):
+            self.set_task_progress(job.cancel_event, done, total)
+
+        def on_done(result, error):
+            self.hide_progress(job.cancel_event)
+            if isinstance(error, Cancelled) or sources is not self.original_frames:
+                return
+            if isinstance(error, MemoryError):
+                messagebox.showerror("Change Framerate", "Not enough memory to blend the frames.")
+                return
+            if error is not None:
+                messagebox.showerror("Change Framerate", f"Failed to change the framerate: {str(error)}")
+                return
+            self.finish_retime(sources, *result, speed)
+
+        job = self.frame_jobs.submit(retime, on_done, on_progress, name="retime")
+        self.show_progress(job.cancel_event)
+
+    def finish_retime(self, sources, frames, durations, speed):
+        if self.playback.running:
+            self.stop_playback()
+        # Same edits, new frames: durations are kept relative to the speed, so Change Speed still applies
+        self.original_frames = frames
+        self.frame_holds = [duration / speed for duration in durations]
+        self.frames = EditedFrames(self.original_frames, self.edits)
+        self.update_proxy()
+        self.current_frame = min(self.current_frame * len(frames) // max(len(sources), 1), len(frames) - 1)
+        self.display_frame()
+        self.save_button.configure(state=ctk.NORMAL)
             
     def change_gif_speed(self):
         if not self.frames:
@@ -621,12 +904,110 @@ class GifEditor:
         new_speed = simpledialog.askinteger("Change GIF Speed", "Enter the new speed (in milliseconds):", initialvalue=self.gif_speed, minvalue=10, maxvalue=1000)
         if new_speed is not None:
                 self.gif_speed = new_speed
+                self.edits.add(Speed(new_speed))
+                self.playback.update(duration=self.frame_duration)
                 self.save_button.configure(state=ctk.NORMAL)
 
-    def save_gif(self):
+    def merge_duplicate_frames(self):
+        """Collapse runs of (near-)identical frames into one frame shown for the whole run."""
+        if not self.frames:
+            return
+        if not getattr(self.original_frames, 'complete', True):
+            messagebox.showinfo("Merge Duplicate Frames", "Wait for the GIF to finish loading first.")
+            return
+        if self.other_frame_job("Merge Duplicate Frames", "merge"):
+            return
+        threshold = simpledialog.askfloat(
+            "Merge Duplicate Frames",
+            "Largest difference (0-255) between frames that still counts as a duplicate:\n"
+            "0 merges identical frames only.",
+            initialvalue=gifcore.DEDUP_THRESHOLD if self.dedup_threshold is None else self.dedup_threshold,
+            minvalue=0, maxvalue=255)
+        if threshold is None:
+            return
+        self.dedup_threshold = threshold
+        if self.playback.running:
+            self.stop_playback()
+
+        # Comparing every frame of a long clip takes a while, so it runs off the Tk thread
+        sources = self.original_frames
+        holds = self.frame_holds
+
+        def merge(job):
+            return gifcore.merge_duplicates(sources, threshold, holds, map_chunks=job.map)
+
+        def on_progress(done, total):
+            self.set_task_progress(job.cancel_event, done, total)
+
+        def on_done(result, error):
+            self.hide_progress(job.cancel_event)
+            if isinstance(error, Cancelled) or sources is not self.original_frames:
+                return
+            if error is not None:
+                messagebox.showerror("Merge Duplicate Frames", f"Failed to merge the frames: {str(error)}")
+                return
+            self.finish_merge(*result)
+
+        job = self.frame_jobs.submit(merge, on_done, on_progress, name="merge")
+        self.show_progress(job.cancel_event)
+
+    def finish_merge(self, frames, holds):
+        before = len(self.original_frames)
+        if len(frames) == before:
+            messagebox.showinfo("Merge Duplicate Frames", "No duplicate frames found.")
+            return
+        if self.playback.running:
+            self.stop_playback()
+        # Same edits, fewer frames: keep the edit list and only swap what it applies to
+        self.original_frames = frames
+        self.frame_holds = holds
+        self.frames = EditedFrames(self.original_frames, self.edits)
+        self.update_proxy()
+        self.current_frame = min(self.current_frame, len(frames) - 1)
+        self.display_frame()
+        self.save_button.configure(state=ctk.NORMAL)
+        messagebox.showinfo("Merge Duplicate Frames", f"Merged {before} frames into {len(frames)}.")
+
+    def change_encoder_settings(self):
+        """Ask for the WebP quality (or lossless) and the WebP/APNG compression effort."""
+        settings = self.encoder_settings
+        quality = simpledialog.askinteger(
+            "WebP/APNG Settings", "WebP quality (0-100), or 101 for lossless:",
+            initialvalue=101 if settings.get('lossless') else settings.get('quality', gifencode.WEBP_QUALITY),
+            minvalue=0, maxvalue=101)
+        if quality is None:
+            return
+        effort = simpledialog.askinteger(
+            "WebP/APNG Settings", "Compression effort, 0 (fastest) to 6 (smallest):",
+            initialvalue=settings.get('effort', gifencode.EFFORT), minvalue=0, maxvalue=6)
+        if effort is None:
+            return
+        settings['lossless'] = quality > 100
+        if quality <= 100:
+            settings['quality'] = quality
+        settings['effort'] = effort
+        self.save_config()
+
+    def save_under_size(self):
+        """Save at the best size, colors/quality and frame rate predicted to fit a file size limit."""
+        if not self.frames:
+            return
+        if not getattr(self.original_frames, 'complete', True):
+            messagebox.showinfo("Save Under Size", "Wait for the GIF to finish loading first.")
+            return
+        max_kb = simpledialog.askinteger("Save Under Size", "Largest file size (KB):",
+                                         initialvalue=self.max_kb, minvalue=1)
+        if max_kb is None:
+            return
+        self.max_kb = max_kb
+        self.save_gif(max_bytes=max_kb * 1024)
+
+    def save_gif(self, max_bytes=None):
         if not self.frames:
             return
-        output_name = filedialog.asksaveasfilename(initialdir=self.last_save_directory, defaultextension=".gif", filetypes=[("GIF Files", "*.gif")])
+        output_name = filedialog.asksaveasfilename(initialdir=self.last_save_directory, defaultextension=".gif",
+                                                   filetypes=[("GIF Files", "*.gif"), ("Animated WebP", "*.webp"),
+                                                              ("Animated PNG", "*.png *.apng")])
         if not output_name:
             return
         # Update last save directory
@@ -641,18 +1022,234 @@ class GifEditor:
             messagebox.showerror("Error", "Invalid dimensions for saving GIF.")
             return
 
-        # Create a new list of resized frames according to user specifications
-        resized_frames = []
-        for frame in self.frames:
-            resized_frame = frame.resize((save_width, save_height), Image.LANCZOS)
-            resized_frames.append(resized_frame)
-        
-        # Save the GIF with the resized frames and the new speed
+        # Export from a snapshot of the edits so the user can keep working meanwhile.
+        # Every frame is evaluated once, resampled straight from the source to the save size
+        edits = self.edits.copy()
+        size = (save_width, save_height)
+        duration = edits.duration(self.gif_speed)
+        if self.frame_holds is not None:
+            duration = [duration * hold for hold in self.frame_holds]
+        shared_palette = self.shared_palette.get()
+        optimize = self.optimize_frames.get()
+        encoder_settings = dict(self.encoder_settings)
+        if self.encode_cache is None:
+            self.encode_cache = gifencode.EncodeCache()
+        cache = self.encode_cache
+        sources = self.original_frames
+        render_key = edits.render_key(size)
+        cancel = threading.Event()
+        self.save_button.configure(state=ctk.DISABLED)
+        self.show_progress(cancel)
+
+        def on_progress(done, total):
+            self.ui.progress("export", self.set_task_progress, cancel, done, total)
+
+        def export():
+            try:
+                with gifprofile.stage("export", profile=True, frames=len(sources),
+                                      size=list(size)) as record:
+                    if max_bytes is not None:
+                        # Size, colors/quality and frames kept are chosen to fit, so the settings vary
+                        stats = gifbudget.export_within(sources, output_name, max_bytes, size,
+                                                        lambda source, size: edits.render(source, size),
+                                                        duration=duration, progress=on_progress, cancelled=cancel.is_set,
+                                                        lossless=encoder_settings.get('lossless', False),
+                                                        effort=encoder_settings.get('effort', gifencode.EFFORT))
+                    else:
+                        # Unchanged frames with unchanged edits are reused from the last save
+                        keys = [(sources.digest(i), render_key) for i in range(len(sources))]
+                        stats = gifencode.export_animation(sources, output_name,
+                                                           prepare=lambda source: edits.render(source, size),
+                                                           duration=duration, shared_palette=shared_palette,
+                                                           optimize=optimize, progress=on_progress,
+                                                           cancelled=cancel.is_set, cache=cache, keys=keys,
+                                                           **encoder_settings)
+                    record['bytes'] = stats['bytes'] if stats else None
+                    record['format'] = stats['format'] if stats else None
+                result = (True, stats)
+            except Exception as e:
+                result = (False, e)
+            self.ui.post(self.finish_export, result, cancel)
+
+        threading.Thread(target=export, daemon=True, name="gifbruhh-export").start()
+
+    def finish_export(self, export_result, cancel):
+        self.ui.discard("export")
+        self.hide_progress(cancel)
+        self.save_button.configure(state=ctk.NORMAL)
+        success, result = export_result
+        if success and result is None:
+            return  # Cancelled; the partial file is already removed
+        if success:
+            message = (f"{result['format'].upper()} saved successfully :3\n"
+                       f"{result['bytes'] / 1024:.0f} KB in {result['seconds']:.1f}s"
+                       + (f", {result['reused_frames']} frames reused" if result['reused_frames'] else ""))
+            if 'predicted_bytes' in result:
+                message += (f"\n{gifbudget.describe(result['settings'], result['settings']['size'])}\n"
+                            f"Predicted {result['predicted_bytes'] / 1024:.0f} KB")
+                if not result['fits']:
+                    message += "\nStill over the limit after shrinking it; try a smaller size."
+            messagebox.showinfo("Success", message)
+        else:
+            messagebox.showerror("Error", f"Failed to save the GIF: {str(result)}")
+
+    def convert_video_streaming(self):
+        """Convert a video straight to a file with the current mask, add/cut and flip settings.
+
+        Frames go from ffmpeg through the mask and the encoder without ever
+        being loaded into the editor, so memory stays flat however long the
+        clip is. Rate, range and width come from the video options.
+        """
+        filename = filedialog.askopenfilename(filetypes=[("Video Files", "*.mp4 *.mov *.m4v *.mkv")])
+        if not filename:
+            return
         try:
-            resized_frames[0].save(output_name, save_all=True, append_images=resized_frames[1:], loop=0, disposal=2, duration=self.gif_speed)
-            messagebox.showinfo("Success", "GIF saved successfully :3")
+            info = gifvideo.probe(filename)
+        except FileNotFoundError:
+            messagebox.showerror("FFmpeg Missing", "Please install FFmpeg and ensure it's in your PATH.")
+            return
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to save the GIF: {str(e)}")
+            messagebox.showerror("Error", f"An error occurred while reading the video: {str(e)}")
+            return
+        dialog = VideoOptionsDialog(self.root, info, gifcore.VIDEO_FPS)
+        self.root.wait_window(dialog)
+        if dialog.result is None:
+            return
+        output_name = filedialog.asksaveasfilename(initialdir=self.last_save_directory, defaultextension=".gif",
+                                                   filetypes=[("GIF Files", "*.gif"), ("Animated WebP", "*.webp"),
+                                                              ("Animated PNG", "*.png *.apng")])
+        if not output_name:
+            return
+        self.last_save_directory = os.path.dirname(output_name)
+        self.save_config()
+
+        options = dict(dialog.result, info=info, mask=self.mask_img_resized, add=self.add_mode.get(),
+                       flip=self.flip_mode.get(), optimize=self.optimize_frames.get(), **self.encoder_settings)
+        cancel = threading.Event()
+        self.show_progress(cancel)
+
+        def on_report(stats):
+            self.ui.progress("stream", self.show_stream_progress, cancel, stats)
+
+        def convert():
+            try:
+                result = (True, gifstream.convert_video(filename, output_name, report=on_report,
+                                                        cancelled=cancel.is_set, **options))
+            except Exception as e:
+                result = (False, e)
+            self.ui.post(self.finish_stream, result, cancel)
+
+        threading.Thread(target=convert, daemon=True, name="gifbruhh-stream").start()
+
+    def show_stream_progress(self, cancel, stats):
+        if cancel is not self.task_cancel:
+            return
+        self.set_task_progress(cancel, stats['done'], stats['total'])
+        depths = stats['depths']
+        self.root.title(f"gifbruhh - converting {stats['done']}/{stats['total']} frames, {stats['fps']:.1f} frames/s "
+                        f"(queued: {depths['decoded']} decoded, {depths['composited']} composited, "
+                        f"{depths['encoding']} encoding)")
+
+    def finish_stream(self, stream_result, cancel):
+        self.ui.discard("stream")
+        self.hide_progress(cancel)
+        self.root.title(f"gifbruhh - {os.path.basename(self.image_filename)}" if self.image_filename else "gifbruhh")
+        success, result = stream_result
+        if success and result is None:
+            return  # Cancelled; the partial file is already removed
+        if success:
+            peaks = result['peak_depths']
+            messagebox.showinfo("Success", f"{result['format'].upper()} saved successfully :3\n"
+                                           f"{result['frames']} frames, {result['bytes'] / 1024:.0f} KB in "
+                                           f"{result['seconds']:.1f}s ({result['fps']:.1f} frames/s)\n"
+                                           f"Deepest queues: {peaks['decoded']} decoded, "
+                                           f"{peaks['composited']} composited, {peaks['encoding']} encoding")
+        else:
+            messagebox.showerror("Error", f"Failed to convert the video: {str(result)}")
+
+class VideoOptionsDialog(ctk.CTkToplevel):
+    """Asks for the frame rate, time range and width to decode a video at."""
+
+    def __init__(self, parent, info, fps):
+        super().__init__(parent)
+        self.title("Video Options")
+        self.resizable(False, False)
+        self.result = None
+
+        duration = info['duration']
+        summary = f"{info['width']}x{info['height']}, " + (f"{duration:.1f}s" if duration else "unknown length")
+        if info['fps']:
+            summary += f" at {info['fps']:g} fps"
+        ctk.CTkLabel(self, text=summary).grid(row=0, column=0, columnspan=2, padx=10, pady=(10, 5))
+
+        # End is left empty, meaning the end of the video, when the length is unknown
+        fields = [("Frame rate (fps):", fps), ("Start (s):", 0),
+                  ("End (s):", round(duration, 2) if duration else ""), ("Width:", info['width'])]
+        self.values = []
+        for row, (label, value) in enumerate(fields, start=1):
+            ctk.CTkLabel(self, text=label).grid(row=row, column=0, padx=10, pady=5, sticky="w")
+            value_var = ctk.StringVar(value=str(value))
+            ctk.CTkEntry(self, textvariable=value_var, width=80).grid(row=row, column=1, padx=10, pady=5)
+            self.values.append(value_var)
+
+        ctk.CTkButton(self, text="Load", command=self.on_ok).grid(
+            row=len(fields) + 1, column=0, columnspan=2, pady=10)
+        self.bind("<Return>", lambda event: self.on_ok())
+        self.transient(parent)
+        self.after(10, self.grab_set)
+
+    def on_ok(self):
+        fps_text, start_text, end_text, width_text = (value_var.get().strip() for value_var in self.values)
+        try:
+            fps, start, width = float(fps_text), float(start_text), float(width_text)
+            end = float(end_text) if end_text else None  # Empty: to the end of the video
+        except ValueError:
+            messagebox.showerror("Invalid Input", "Please enter numeric values.", parent=self)
+            return
+        if fps <= 0 or start < 0 or (end is not None and end <= start) or width < 2:
+            messagebox.showerror("Invalid Input", "Please enter a positive frame rate, a start before the end "
+                                 "and a width of at least 2.", parent=self)
+            return
+        self.result = {'fps': fps, 'start': start, 'end': end, 'width': int(width)}
+        self.destroy()
+
+
+class StatsDialog(ctk.CTkToplevel):
+    """Per-stage timings recorded by gifprofile, plus the current memory footprint."""
+
+    def __init__(self, parent, footprint):
+        super().__init__(parent)
+        self.title("Stage Timings")
+        self.geometry("640x360")
+        self.footprint = footprint
+
+        self.text = ctk.CTkTextbox(self, wrap="none")
+        self.text.pack(fill=ctk.BOTH, expand=True, padx=10, pady=(10, 5))
+        buttons = ctk.CTkFrame(self, fg_color="transparent")
+        buttons.pack(pady=(0, 10))
+        ctk.CTkButton(buttons, text="Refresh", command=self.refresh).pack(side=ctk.LEFT, padx=5)
+        ctk.CTkButton(buttons, text="Reset", command=self.reset).pack(side=ctk.LEFT, padx=5)
+        self.transient(parent)
+        self.refresh()
+
+    def refresh(self):
+        lines = [f"{label}: {nbytes / 1024 ** 2:.1f} MB" for label, nbytes in self.footprint()]
+        lines.append("")
+        if not gifprofile.ENABLED:
+            lines.append("Recording is off (Options > Record Stage Timings).")
+        lines += gifprofile.summary() or ["No stages recorded yet."]
+        lines += ["", "Startup:"] + gifstartup.report()
+        if gifprofile.LOG_PATH:
+            lines += ["", f"Log: {gifprofile.LOG_PATH}"]
+        self.text.configure(state="normal")
+        self.text.delete("1.0", "end")
+        self.text.insert("1.0", "\n".join(lines))
+        self.text.configure(state="disabled")
+
+    def reset(self):
+        gifprofile.reset()
+        self.refresh()
+
 
 def resource_path(relative_path):
     try:
@@ -675,4 +1272,15 @@ if __name__ == "__main__":
         print("Icon file not found, using default window icon.")
 
     GifEditor(root)
+    gifstartup.mark("window created")
+
+    def on_first_paint():
+        gifstartup.mark("first paint")
+        # Load the processing backend while the user picks a file
+        gifstartup.warm_up(on_ready=startup_report if "--startup-report" in sys.argv else None)
+
+    def startup_report():
+        print("\n".join(gifstartup.report()))
+
+    root.after_idle(on_first_paint)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""Export under a file size limit.
+
+Instead of full encodes at one guessed size after another, the output size
+is predicted from a few short runs of sample frames: each run is delta
+optimized and encoded like the real export, giving the average cost of a
+full frame and of a delta frame, which scale up to the whole clip. The
+search walks combinations of colors (or WebP quality), frame skipping and
+delta threshold, best first, and for each finds the largest output size
+predicted to fit. The best scoring combination is encoded once for real;
+should it still come out too big, it is shrunk and encoded again.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import math
+import os
+
+import gifencode
+
+SAMPLE_RUNS = 6
+RUN_LENGTH = 4  # frames per run: a full frame, then deltas
+MIN_SCALE = 0.1
+MAX_ATTEMPTS = 3  # full encodes before giving up
+SAFETY = 0.97  # aim this far under the budget, since the prediction is approximate
+# Bytes per frame outside the encoded image data (control/frame headers), and per file
+FRAME_OVERHEAD = {'gif': 19, 'webp': 32, 'apng': 54}
+FILE_OVERHEAD = 1024
+
+# Steps tried for each setting, best first, with the factor each one scales the quality score by.
+# The score of a candidate is its output area (as a fraction of the requested size) times its factors.
+COLOR_STEPS = [(256, 1.0), (128, 0.85), (64, 0.7), (32, 0.5)]
+QUALITY_STEPS = [(90, 1.0), (80, 0.95), (65, 0.85), (50, 0.7), (35, 0.5)]
+SKIP_STEPS = [(1, 1.0), (2, 0.6), (3, 0.4)]
+THRESHOLD_STEPS = [(0, 1.0), (6, 0.9)]
+
+
+def scaled_size(size, scale):
+    """size scaled by scale, rounded down to even pixels (WebP offsets are halved) and at least 2x2."""
+    return tuple(max(int(side * scale) // 2 * 2, 2) for side in size)
+
+
+def skip_frames(count, durations, skip):
+    """(indices kept, their durations) when keeping every skip-th frame and holding it for the ones dropped."""
+    kept = list(range(0, count, skip))
+    return kept, [sum(durations[i:i + skip]) for i in kept]
+
+
+class Subset:
+    """Read-only view of items at indices, so frame skipping doesn't copy the frames out of a store."""
+
+    def __init__(self, items, indices):
+        self.items = items
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        return self.items[self.indices[index]]
+
+    def __iter__(self):
+        return (self.items[i] for i in self.indices)
+
+
+class SizeEstimator:
+    """Predicts export sizes for one clip from encoded sample runs.
+
+    prepare(item, size) renders an item at size. The samples rendered at the
+    last size estimated are kept, so trying several settings at one size
+    resamples only once; estimating at another size drops them.
+    """
+
+    def __init__(self, items, prepare, size, format='gif', lossless=False, effort=gifencode.EFFORT, workers=None):
+        self.items = items
+        self.prepare = prepare
+        self.size = tuple(size)
+        self.format = format
+        self.lossless = lossless
+        self.effort = effort
+        self.workers = workers or os.cpu_count() or 4
+        self.estimates = 0
+        self._rendered = {}
+        self._rendered_size = None
+
+    def _runs(self, skip):
+        """Item indices of SAMPLE_RUNS runs of consecutive kept frames, spread over the clip."""
+        kept = list(range(0, len(self.items), skip))
+        length = min(RUN_LENGTH, len(kept))
+        starts = sorted({round(i * (len(kept) - length) / max(SAMPLE_RUNS - 1, 1)) for i in range(SAMPLE_RUNS)})
+        return [kept[start:start + length] for start in starts], len(kept)
+
+    def _render(self, index, size):
+        if index not in self._rendered:
+            self._rendered[index] = self.prepare(self.items[index], size)
+        return self._rendered[index]
+
+    def _encode_run(self, run, size, colors, quality, threshold):
+        """(bytes of the run's full first frame, bytes of the delta frames after it, how many)."""
+        frames = [self._render(index, size) for index in run]
+        optimizer = gifencode.DeltaOptimizer(threshold, keep_alpha=self.format != 'gif',
+                                             align=2 if self.format == 'webp' else 1)
+        outputs = []
+        for frame in frames:
+            outputs.extend(optimizer.push(frame, 0))
+        # The last frame stays pending, since its disposal depends on the frame after the run.
+        # The first output is always the first frame, whole; if nothing changed it is pending too
+        images = [image for image, _, _, _, _ in outputs] or [frames[0]]
+        sizes = [len(gifencode.encode_image(image, self.format, colors, None, quality, self.lossless,
+                                            self.effort).data) + FRAME_OVERHEAD[self.format]
+                 for image in images]
+        return sizes[0], sum(sizes[1:]), len(frames) - 2
+
+    def estimate(self, scale=1.0, colors=256, quality=gifencode.WEBP_QUALITY, skip=1, threshold=0):
+        """Predicted output bytes with these settings."""
+        self.estimates += 1
+        size = scaled_size(self.size, scale)
+        if size != self._rendered_size:
+            self._rendered, self._rendered_size = {}, size
+        runs, count = self._runs(skip)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(lambda run: self._encode_run(run, size, colors, quality, threshold), runs))
+        full_average = sum(full for full, _, _ in results) / len(results)
+        delta_frames = sum(frames for _, _, frames in results)
+        if count < 3 or delta_frames <= 0:
+            return int(FILE_OVERHEAD + full_average * count)
+        delta_average = sum(delta for _, delta, _ in results) / delta_frames
+        # The first frame is full, and so is the last, which clears the canvas for the loop
+        return int(FILE_OVERHEAD + 2 * full_average + (count - 2) * delta_average)
+
+    def largest_fit(self, max_bytes, floor=None, **settings):
+        """(scale, predicted bytes) of the largest scale up to 1 predicted to fit, or None.
+
+        Output bytes grow roughly with the area, i.e. with scale squared, so
+        each guess solves that model through the last estimate. With a floor,
+        the search starts there and gives up at once if even that doesn't fit.
+        """
+        if floor is not None:
+            scale = max(floor, MIN_SCALE)
+            predicted = self.estimate(scale, **settings)
+            if predicted > max_bytes:
+                return None
+            best = (scale, predicted)
+            scale = min(scale * math.sqrt(max_bytes * SAFETY / predicted), 1.0)
+            if scale - best[0] < 0.01:
+                return best
+        else:
+            scale = 1.0
+            best = None
+        for _ in range(4):
+            predicted = self.estimate(scale, **settings)
+            if predicted <= max_bytes:
+                if best is None or scale > best[0]:
+                    best = (scale, predicted)
+                if scale == 1.0 or predicted >= max_bytes * 0.9:
+                    break  # Can't grow, or close enough
+            next_scale = min(scale * math.sqrt(max_bytes * SAFETY / predicted), 1.0)
+            if next_scale < MIN_SCALE or abs(next_scale - scale) < 0.01:
+                break
+            scale = next_scale
+        return best
+
+
+def candidates(format, skip_allowed=True):
+    """Every combination of steps as (settings, score factor), best factor first."""
+    if format == 'gif':
+        detail = [({'colors': colors}, factor) for colors, factor in COLOR_STEPS]
+    elif format == 'webp':
+        detail = [({'quality': quality}, factor) for quality, factor in QUALITY_STEPS]
+    else:
+        detail = [({}, 1.0)]
+    skips = SKIP_STEPS if skip_allowed else SKIP_STEPS[:1]
+    combos = []
+    for settings, detail_factor in detail:
+        for skip, skip_factor in skips:
+            for threshold, threshold_factor in THRESHOLD_STEPS:
+                combos.append((dict(settings, skip=skip, threshold=threshold),
+                               detail_factor * skip_factor * threshold_factor))
+    return sorted(combos, key=lambda combo: combo[1], reverse=True)
+
+
+def choose_settings(estimator, max_bytes, skip_allowed=True):
+    """Best scoring settings predicted to fit in max_bytes: (settings, predicted bytes), or (None, None)."""
+    best, best_score, best_predicted = None, 0.0, None
+    for settings, factor in candidates(estimator.format, skip_allowed):
+        # Candidates come best factor first, so none of the rest can beat the best so far even at full size
+        if factor <= best_score:
+            break
+        # Only a scale at which this combination would score higher is worth looking at
+        floor = math.sqrt(best_score / factor) if best else None
+        found = estimator.largest_fit(max_bytes, floor, **settings)
+        if found is None:
+            continue
+        scale, predicted = found
+        score = scale * scale * factor
+        if score > best_score:
+            best, best_score, best_predicted = dict(settings, scale=scale), score, predicted
+    return best, best_predicted
+
+
+def export_within(items, output_name, max_bytes, size, prepare, duration=100, format=None,
+                  lossless=False, effort=gifencode.EFFORT, workers=None, progress=None, cancelled=None, report=None):
+    """Export items to output_name in at most max_bytes, at the best settings that fit.
+
+    size is the largest output size wanted and prepare(item, size) renders an
+    item at a size. duration is in ms, per frame or as a list. Returns the
+    export stats plus 'predicted_bytes', 'settings', 'attempts' and
+    'estimates', or None if cancelled() came true during an encode. Raises
+    ValueError if nothing fits.
+    """
+    format = format or gifencode.format_for(output_name)
+    items = items if hasattr(items, '__getitem__') else list(items)
+    durations = [duration] * len(items) if isinstance(duration, (int, float)) else list(duration)
+    estimator = SizeEstimator(items, prepare, size, format, lossless, effort, workers)
+    settings, predicted = choose_settings(estimator, max_bytes, skip_allowed=len(items) > 1)
+    if settings is None:
+        raise ValueError(f"Can't fit the clip in {max_bytes} bytes, even at {MIN_SCALE:.0%} of the size")
+    if report:
+        report(f"Predicted {predicted} bytes with {describe(settings, scaled_size(size, settings['scale']))} "
+               f"({estimator.estimates} estimates)")
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        output_size = scaled_size(size, settings['scale'])
+        kept, kept_durations = skip_frames(len(items), durations, settings['skip'])
+        stats = gifencode.export_animation(
+            Subset(items, kept), output_name, format,
+            prepare=lambda item: prepare(item, output_size), duration=kept_durations,
+            colors=settings.get('colors', 256), quality=settings.get('quality', gifencode.WEBP_QUALITY),
+            lossless=lossless, effort=effort, threshold=settings['threshold'], workers=workers, progress=progress,
+            cancelled=cancelled)
+        if stats is None:
+            return None
+        if stats['bytes'] <= max_bytes or attempt == MAX_ATTEMPTS:
+            break
+        if report:
+            report(f"Came out at {stats['bytes']} bytes, shrinking")
+        scale = settings['scale'] * math.sqrt(max_bytes * SAFETY / stats['bytes'])
+        if scale < MIN_SCALE:
+            break  # settings stay those of the file just written
+        settings = dict(settings, scale=scale)
+
+    stats.update(predicted_bytes=predicted, settings=dict(settings, size=output_size), attempts=attempt,
+                 estimates=estimator.estimates, fits=stats['bytes'] <= max_bytes)
+    return stats
+
+
+def describe(settings, size):
+    """Human readable summary of chosen settings, at output size."""
+    parts = ["{}x{}".format(*size)]
+    if 'colors' in settings:
+        parts.append(f"{settings['colors']} colors")
+    if 'quality' in settings:
+        parts.append(f"quality {settings['quality']}")
+    if settings['skip'] > 1:
+        parts.append(f"every {settings['skip']} frames")
+    if settings['threshold']:
+        parts.append(f"delta threshold {settings['threshold']}")
+    return ", ".join(parts)
@@ -0,0 +1,113 @@
+"""On-disk cache of decoded frame stacks.
+
+Each entry is a .npy file holding the (N, H, W, C) uint8 array of a decoded
+GIF or video, named after a hash of the source file's contents plus the
+decode parameters. Hits are memory-mapped straight into a FrameStore, so
+reopening a recent clip skips decoding entirely. Least recently used entries
+are evicted once the directory grows past MAX_BYTES.
+"""
+import hashlib
+import numpy as np
+import os
+
+CACHE_DIR = os.path.join(os.getenv('APPDATA') or os.path.expanduser("~"), 'gifbruhh', 'cache')
+MAX_BYTES = 4 * 1024 ** 3
+ENABLED = True
+
+_HASH_CHUNK = 1024 * 1024
+_content_hashes = {}
+
+
+def content_hash(filename):
+    """Hash of the file's contents, remembered for as long as its size and mtime don't change."""
+    stat = os.stat(filename)
+    stamp = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    if stamp not in _content_hashes:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+                digest.update(chunk)
+        _content_hashes[stamp] = digest.hexdigest()
+    return _content_hashes[stamp]
+
+
+def key(filename, **params):
+    """Cache key for filename decoded with params (fps, range, size...)."""
+    digest = hashlib.blake2b(content_hash(filename).encode(), digest_size=16)
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()
+
+
+def _path(cache_key):
+    return os.path.join(CACHE_DIR, cache_key + ".npy")
+
+
+def get(cache_key):
+    """Memory-mapped frames for cache_key, or None."""
+    if not ENABLED:
+        return None
+    path = _path(cache_key)
+    try:
+        frames = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    # The file's mtime is its place in the LRU order
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return frames
+
+
+def put(cache_key, frames):
+    """Store frames under cache_key, then evict old entries. Failures are ignored."""
+    if not ENABLED or not len(frames) or frames.nbytes > MAX_BYTES:
+        return
+    path = _path(cache_key)
+    scratch = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(scratch, "wb") as f:
+            np.save(f, frames)
+        os.replace(scratch, path)
+    except OSError:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+        return
+    evict()
+
+
+def entries():
+    """(mtime, bytes, path) of every cache entry, oldest first."""
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    found = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".npy"):
+            path = os.path.join(CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.append((stat.st_mtime, stat.st_size, path))
+    return sorted(found)
+
+
+def evict(max_bytes=None):
+    """Remove least recently used entries until the cache fits in max_bytes."""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    cached = entries()
+    total = sum(size for _, size, _ in cached)
+    for _, size, path in cached:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Still mapped by this process on Windows; try again next time
+            continue
+        total -= size
+
+
+def clear():
+    evict(0)
@@ -0,0 +1,469 @@
+from PIL import Image, ImageSequence
+import numpy as np
+import os
+import threading
+
+import gifcache
+import gifencode
+import gifprofile
+import gifstore
+import gifvideo
+from gifstore import FrameStore
+
+IMAGE_EXTENSIONS = ['.gif', '.png', '.jpg', '.jpeg']
+VIDEO_EXTENSIONS = ['.mp4', '.mov', '.m4v', '.mkv']
+VIDEO_FPS = 5
+# Frames blended per pass; bounds the uint16 scratch space
+COMPOSITE_CHUNK = 32
+# Largest difference (0-255) between any two blocks of a frame's thumbnail that still counts as a duplicate
+DEDUP_THRESHOLD = 2.0
+# Thumbnail blocks along the longer side used to compare frames
+DEDUP_BLOCKS = 64
+
+
+def file_extension(filename):
+    return os.path.splitext(filename)[1].lower()
+
+
+def is_image_file(filename):
+    return file_extension(filename) in IMAGE_EXTENSIONS
+
+
+def is_video_file(filename):
+    return file_extension(filename) in VIDEO_EXTENSIONS
+
+
+def load_frames(filename, progress=None):
+    """Decode an image, GIF or video into a FrameStore."""
+    if is_image_file(filename):
+        return load_image_frames(filename)
+    if is_video_file(filename):
+        return load_video_frames(filename, progress=progress)
+    raise ValueError(f"Unsupported file type: {file_extension(filename)}")
+
+
+def _cached(filename, **params):
+    """(cache key, FrameStore or None) for filename decoded with params."""
+    if not gifcache.ENABLED:
+        return None, None
+    cache_key = gifcache.key(filename, **params)
+    frames = gifcache.get(cache_key)
+    return cache_key, FrameStore(frames) if frames is not None else None
+
+
+def load_image_frames(filename):
+    """Decode an image or GIF into a FrameStore; GIFs go through the frame cache."""
+    im = Image.open(filename)
+    if im.format != 'GIF':
+        return FrameStore.from_images([im])
+    cache_key, store = _cached(filename, kind='gif')
+    if store is None:
+        store = FrameStore.from_images(ImageSequence.Iterator(im), count=getattr(im, 'n_frames', 1))
+        if cache_key:
+            gifcache.put(cache_key, store.array)
+    return store
+
+
+def stream_gif_frames(filename, progress=None, on_done=None, cancelled=None):
+    """Return a FrameStore holding the GIF's first frame while the rest decode on a background thread.
+
+    The store grows as frames come in and has complete set once they all
+    have. progress(done, total) and on_done(store, error) are called from the
+    decoder thread. A GIF already in the frame cache is returned complete.
+    """
+    cache_key, store = _cached(filename, kind='gif')
+    if store is not None:
+        if progress:
+            progress(len(store), len(store))
+        if on_done:
+            on_done(store, None)
+        return store
+
+    im = Image.open(filename)
+    frames = ImageSequence.Iterator(im)
+    store = FrameStore.streaming(next(frames))
+
+    def decode():
+        error = None
+        try:
+            with gifprofile.stage("decode_gif", source=filename) as record:
+                # A second handle, since counting frames seeks through the file
+                with Image.open(filename) as counter:
+                    total = getattr(counter, 'n_frames', 1)
+                for frame in frames:
+                    if cancelled and cancelled():
+                        break
+                    store.append(frame)
+                    if progress:
+                        progress(len(store), total)
+                record['frames'] = len(store)
+        except Exception as e:
+            error = e
+        finally:
+            store.finish()
+            im.close()
+        if cache_key and error is None and not (cancelled and cancelled()):
+            gifcache.put(cache_key, store.array)
+        if on_done:
+            on_done(store, error)
+
+    threading.Thread(target=decode, daemon=True, name="gifbruhh-gif-decode").start()
+    return store
+
+
+def load_video_frames(filename, fps=VIDEO_FPS, start=0, end=None, width=None, height=None,
+                      progress=None, cancelled=None, info=None):
+    """Decode a video at the given frame rate, time range and size.
+
+    progress is called as progress(done, total) after every frame. info is
+    the result of gifvideo.probe, if the caller already has it. Decoded
+    clips are kept in the frame cache, so reopening one with the same
+    settings skips ffmpeg altogether.
+    """
+    cache_key, store = _cached(filename, kind='video', fps=fps, start=start, end=end, width=width, height=height)
+    if store is not None:
+        if progress:
+            progress(len(store), len(store))
+        return store
+    frames = gifvideo.decode(filename, fps=fps, start=start, end=end, width=width, height=height,
+                             progress=progress, cancelled=cancelled, info=info, allocate=gifstore.allocate)
+    if cache_key and not (cancelled and cancelled()):
+        gifcache.put(cache_key, frames)
+    return FrameStore(frames, "RGB")
+
+
+def load_mask(filename):
+    return Image.open(filename).convert("RGBA")
+
+
+def fit_size(size, width=None, height=None):
+    """Return (width, height) for a resize, keeping the aspect ratio when only one side is given."""
+    src_width, src_height = size
+    if width and height:
+        return width, height
+    if width:
+        return width, max(int(width * src_height / src_width), 1)
+    if height:
+        return max(int(height * src_width / src_height), 1), height
+    return size
+
+
+def resize_frames(frames, size):
+    return [frame.resize(size, Image.LANCZOS) for frame in frames]
+
+
+def stretch_mask(mask, width, flip=False):
+    """Scale the mask to the frame width, keeping its (possibly stretched) aspect ratio."""
+    aspect_ratio = mask.height / mask.width
+    new_height = int(width * aspect_ratio)
+    stretched_mask = mask.resize((width, max(new_height, 1)), Image.LANCZOS)
+    if flip:
+        stretched_mask = stretched_mask.transpose(Image.FLIP_LEFT_RIGHT)
+    return stretched_mask
+
+
+def stack_frames(frames):
+    """Copy equally sized RGBA frames into one (N, H, W, 4) uint8 array."""
+    width, height = frames[0].size
+    stack = np.empty((len(frames), height, width, 4), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        stack[i] = np.asarray(frame.convert("RGBA") if frame.mode != "RGBA" else frame)
+    return stack
+
+
+def unstack_frames(stack):
+    """Wrap each slice of the stack as a PIL image without copying the pixels."""
+    return [Image.fromarray(frame, "RGBA") for frame in stack]
+
+
+def _div255(value):
+    """Rounded value / 255 for uint16 arrays, as in PIL's DIV255."""
+    tmp = value + 128
+    return ((tmp >> 8) + tmp) >> 8
+
+
+def prepare_mask(mask, width, height, flip=False):
+    """Stretch the mask to the frame width once and classify its pixels.
+
+    Returns (rgba, full, partial): the mask as an (H, W, 4) array padded or cropped to
+    the frame, an (H, W) bool array of fully opaque pixels, and the flat indices of
+    partially transparent pixels. Pixels with zero alpha never touch the frames.
+    """
+    stretched_mask = stretch_mask(mask, width, flip)
+    rgba = np.zeros((height, width, 4), dtype=np.uint8)
+    visible = np.asarray(stretched_mask)[:height]
+    rgba[:visible.shape[0]] = visible
+    alpha = rgba[:, :, 3]
+    full = alpha == 255
+    partial = np.flatnonzero((alpha > 0) & (alpha < 255))
+    return rgba, full, partial
+
+
+def composite_stack(stack, mask, add=False, flip=False, chunk=COMPOSITE_CHUNK):
+    """Alpha-over (add) or alpha-punch (cutout) the mask into every frame of the stack, in place.
+
+    Uses the same integer blend as Image.paste so results match the per-frame path.
+    """
+    height, width = stack.shape[1:3]
+    return composite_prepared(stack, prepare_mask(mask, width, height, flip), add, chunk)
+
+
+def composite_prepared(stack, prepared, add=False, chunk=COMPOSITE_CHUNK):
+    """composite_stack with a mask already returned by prepare_mask for this frame size."""
+    count, height, width = stack.shape[:3]
+    rgba, full, partial = prepared
+    # Opaque mask pixels are plain copies; viewing each RGBA pixel as one uint32
+    # keeps the masked copy a single pass over memory
+    np.copyto(stack.view(np.uint32)[..., 0], rgba.view(np.uint32)[..., 0] if add else np.uint32(0),
+              where=full)
+
+    if len(partial):
+        pixels = stack.reshape(count, height * width, 4)
+        src = rgba.reshape(-1, 4)[partial].astype(np.uint16)
+        alpha = src[:, 3:4]
+        for start in range(0, count, chunk):
+            dst = pixels[start:start + chunk, partial].astype(np.uint16)
+            if add:
+                out = _div255(dst * (255 - alpha) + src * alpha)
+            else:
+                # Filling an RGBA image through a mask replaces the colour of fully
+                # transparent pixels outright; everywhere else it is a plain blend
+                weight = np.broadcast_to(alpha, dst.shape).copy()
+                weight[..., :3] = np.where(dst[..., 3:4] == 0, np.uint16(255), alpha)
+                out = _div255(dst * (255 - weight))
+            pixels[start:start + chunk, partial] = out
+    return stack
+
+
+def _apply_vectorized(frames, mask, add, flip):
+    if not frames:
+        return frames
+    by_size = {}
+    for i, frame in enumerate(frames):
+        by_size.setdefault(frame.size, []).append(i)
+    for indices in by_size.values():
+        stack = stack_frames([frames[i] for i in indices])
+        composite_stack(stack, mask, add=add, flip=flip)
+        for i, frame in zip(indices, unstack_frames(stack)):
+            frames[i] = frame
+    return frames
+
+
+def add_png(frames, mask, flip=False):
+    """Paste the mask over every frame. The list is updated in place."""
+    return _apply_vectorized(frames, mask, True, flip)
+
+
+def cutout_shape(frames, mask, flip=False):
+    """Make every frame transparent wherever the mask is opaque. The list is updated in place."""
+    return _apply_vectorized(frames, mask, False, flip)
+
+
+def apply_mask(frames, mask, add=False, flip=False):
+    if add:
+        return add_png(frames, mask, flip)
+    return cutout_shape(frames, mask, flip)
+
+
+def _frame_arrays(frames, start, end):
+    """Frames start..end as an (N, H, W, C) array, straight from a FrameStore's array when possible."""
+    if isinstance(frames, FrameStore) and not frames.overrides:
+        return frames.array[start:end]
+    return stack_frames(frames[start:end])
+
+
+def _thumbnails(frames, blocks=DEDUP_BLOCKS, chunk=COMPOSITE_CHUNK, map_chunks=None):
+    """(N, h, w, C) float32 block averages of every frame, about blocks wide on the longer side.
+
+    map_chunks(func, count) calls func(i) for each of the count chunks of
+    frames, by default one after another.
+    """
+    width, height = frames[0].size
+    block = max(max(width, height) // blocks, 1)
+    rows, cols = height // block, width // block
+    channels = _frame_arrays(frames, 0, 1).shape[-1]
+    thumbs = np.empty((len(frames), rows, cols, channels), dtype=np.float32)
+
+    def fill(index):
+        start = index * chunk
+        pixels = _frame_arrays(frames, start, start + chunk)[:, :rows * block, :cols * block]
+        count = len(pixels)
+        # Summing rows then columns is much faster than a mean over both block axes at once
+        row_sums = pixels.reshape(count, rows, block, -1).sum(axis=2, dtype=np.uint16 if block <= 257 else np.uint32)
+        sums = row_sums.reshape(count, rows, cols, block, channels).sum(axis=3, dtype=np.uint32)
+        thumbs[start:start + count] = sums / np.float32(block * block)
+
+    chunks = -(-len(frames) // chunk)
+    if map_chunks is None:
+        for index in range(chunks):
+            fill(index)
+    else:
+        map_chunks(fill, chunks)
+    return thumbs
+
+
+def find_duplicate_runs(frames, threshold=DEDUP_THRESHOLD, map_chunks=None):
+    """Split frames into runs that look the same. Returns [(first index, run length), ...].
+
+    Frames are compared on block-averaged thumbnails, so encoder noise averages
+    out but any region that visibly changes by more than threshold starts a
+    new run. With threshold 0 only pixel-identical frames are merged.
+    map_chunks is passed on to _thumbnails, e.g. gifworker's FrameJob.map to
+    build them on a thread pool.
+    """
+    if not len(frames):
+        return []
+    thumbs = _thumbnails(frames, map_chunks=map_chunks)
+    # Frames far from their predecessor always start a run; the rest are checked against the run's first frame
+    consecutive = np.abs(thumbs[1:] - thumbs[:-1]).max(axis=(1, 2, 3))
+    runs = []
+    first = 0
+    for i in range(1, len(frames)):
+        if consecutive[i - 1] > threshold or not _same_frame(frames, thumbs, first, i, threshold):
+            runs.append((first, i - first))
+            first = i
+    runs.append((first, len(frames) - first))
+    return runs
+
+
+def _same_frame(frames, thumbs, a, b, threshold):
+    if threshold <= 0:
+        return np.array_equal(_frame_arrays(frames, a, a + 1), _frame_arrays(frames, b, b + 1))
+    return np.abs(thumbs[b] - thumbs[a]).max() <= threshold
+
+
+def merge_duplicates(frames, threshold=DEDUP_THRESHOLD, holds=None, map_chunks=None):
+    """Collapse runs of duplicate frames into their first frame.
+
+    Returns (frames, holds): the kept frames (a new FrameStore for a store)
+    and how many source frames each stands for, i.e. its duration in units
+    of the original frame duration. holds carries over from an earlier pass.
+    map_chunks is as in find_duplicate_runs.
+    """
+    runs = find_duplicate_runs(frames, threshold, map_chunks)
+    holds = holds or [1] * len(frames)
+    merged = [sum(holds[first:first + length]) for first, length in runs]
+    keep = [first for first, _ in runs]
+    if len(keep) == len(frames):
+        return frames, merged
+    if isinstance(frames, FrameStore):
+        return frames.select(keep), merged
+    return [frames[i] for i in keep], merged
+
+
+def retime_plan(durations, fps):
+    """Map a clip with per-frame durations (ms) onto a steady fps.
+
+    Returns one (durations of the output frame, [(source index, weight), ...])
+    per output frame: the sources the frame's time slot overlaps, weighted by
+    how much. Slot boundaries are rounded to whole ms from the clip start, so
+    the total length doesn't change.
+    """
+    ends = np.cumsum(np.asarray(durations, dtype=np.float64))
+    total = float(ends[-1]) if len(ends) else 0.0
+    count = max(int(round(total * fps / 1000)), 1)
+    bounds = [round(k * total / count) for k in range(count + 1)]
+    starts = ends - np.asarray(durations, dtype=np.float64)
+    plan = []
+    for start, end in zip(bounds, bounds[1:]):
+        first = int(np.searchsorted(ends, start, side='right'))
+        last = int(np.searchsorted(starts, end, side='left'))
+        sources = []
+        for i in range(min(first, len(ends) - 1), max(last, first + 1)):
+            overlap = min(end, ends[i]) - max(start, starts[i])
+            if overlap > 0:
+                sources.append((i, overlap / max(end - start, 1e-9)))
+        plan.append((end - start, sources or [(min(first, len(ends) - 1), 1.0)]))
+    return plan
+
+
+def retime(frames, durations, fps, blend=False, map_frames=None):
+    """Resample frames shown for durations (ms each) to fps. Returns (frames, durations).
+
+    Without blend each output frame is the source frame showing at the
+    middle of its slot, so frames are dropped when slowing the rate and held
+    when raising it. With blend a slot covering several source frames is
+    their average, weighted by time on screen. Consecutive output frames that
+    come out the same are kept as one frame shown for their combined time.
+    map_frames(func, count) calls func(i) for every blended output frame,
+    by default one after another; gifworker's FrameJob.map spreads them over
+    a thread pool. Returns a new FrameStore for a store, otherwise a list of
+    images.
+    """
+    plan = retime_plan(durations, fps)
+    picks = []  # per output frame: ((source index, weight), ...)
+    for _, sources in plan:
+        if not blend:
+            middle = 0.5
+            for index, weight in sources:
+                middle -= weight
+                if middle <= 0:
+                    break
+            sources = [(index, 1.0)]
+        else:
+            sources = [(index, weight) for index, weight in sources if weight > 1e-6]
+            if len(sources) == 1:
+                sources = [(sources[0][0], 1.0)]
+        picks.append(tuple(sources))
+
+    kept, kept_durations = [], []
+    for (duration, _), sources in zip(plan, picks):
+        if kept and kept[-1] == sources:
+            kept_durations[-1] += duration
+        else:
+            kept.append(sources)
+            kept_durations.append(duration)
+
+    if all(len(sources) == 1 for sources in kept):
+        indices = [sources[0][0] for sources in kept]
+        if isinstance(frames, FrameStore):
+            return frames.select(indices), kept_durations
+        return [frames[i] for i in indices], kept_durations
+
+    with gifprofile.stage("retime", frames=len(kept)):
+        shape = _frame_arrays(frames, 0, 1).shape[1:]
+        array = gifstore.allocate((len(kept),) + shape, budget=getattr(frames, '_budget', None))
+
+        def fill(out):
+            sources = kept[out]
+            if len(sources) == 1:
+                array[out] = _frame_arrays(frames, sources[0][0], sources[0][0] + 1)[0]
+                return
+            # Weighted sum of whole frames at a time, with one float frame of scratch space
+            total = np.full(shape, 0.5, dtype=np.float32)
+            for index, weight in sources:
+                total += np.float32(weight) * _frame_arrays(frames, index, index + 1)[0]
+            np.clip(total, 0, 255, out=total)
+            array[out] = total
+
+        if map_frames is None:
+            for out in range(len(kept)):
+                fill(out)
+        else:
+            map_frames(fill, len(kept))
+
+    mode = "RGBA" if array.shape[-1] == 4 else "RGB"
+    if isinstance(frames, FrameStore):
+        return FrameStore(array, mode), kept_durations
+    return [Image.fromarray(pixels, mode) for pixels in array], kept_durations
+
+
+def save_gif(frames, output_name, size=None, duration=100, optimize=True, workers=None, progress=None,
+             format=None, quality=gifencode.WEBP_QUALITY, lossless=False, effort=gifencode.EFFORT):
+    """Write frames as a looping GIF, resizing them to size first if given.
+
+    Frames are resized and encoded on a thread pool and streamed to disk in order.
+    With optimize, each frame only stores what changed since the previous one.
+    format can also be 'webp' or 'apng' (by default it follows the file
+    extension); quality, lossless and effort are their encoder settings.
+    """
+    prepare = None
+    if size is not None:
+        size = tuple(size)
+
+        def prepare(frame):
+            return frame if frame.size == size else frame.resize(size, Image.LANCZOS)
+
+    return gifencode.export_animation(frames, output_name, format, prepare=prepare, duration=duration,
+                                      optimize=optimize, quality=quality, lossless=lossless, effort=effort,
+                                      workers=workers, progress=progress)
@@ -0,0 +1,67 @@
+"""Hand results from worker threads to the Tk thread.
+
+Tk widgets may only be touched from the thread running the main loop, so
+loaders and exporters never call into the UI directly: they post calls to a
+Dispatcher, which runs them from root.after on the Tk thread. Progress
+reports are merged by key and only the latest one per key is delivered, at
+most every REFRESH_INTERVAL ms, so a decoder reporting every frame costs a
+dictionary write per frame rather than a redraw.
+"""
+import queue
+import threading
+
+REFRESH_INTERVAL = 50  # ms between drains of the queue
+MAX_CALLS = 100  # posted calls run per drain, so a flood can't freeze the UI
+
+
+class Dispatcher:
+    """Runs posted calls and merged progress updates on the Tk thread.
+
+    post(callback, *args) and progress(key, callback, *args) may be called
+    from any thread; callbacks run later on the Tk thread, posted calls in
+    order and after any progress reported before them.
+    """
+
+    def __init__(self, root, interval=REFRESH_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.merged = 0  # progress reports dropped in favour of a later one with the same key
+        self._calls = queue.Queue()
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._after_id = self.root.after(self.interval, self._drain)
+
+    def post(self, callback, *args):
+        self._calls.put((callback, args))
+
+    def progress(self, key, callback, *args):
+        with self._lock:
+            if key in self._progress:
+                self.merged += 1
+            self._progress[key] = (callback, args)
+
+    def discard(self, key):
+        """Drop a pending progress report, e.g. once the job it belongs to is over."""
+        with self._lock:
+            self._progress.pop(key, None)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _drain(self):
+        self._after_id = None
+        with self._lock:
+            updates, self._progress = self._progress, {}
+        try:
+            for callback, args in updates.values():
+                callback(*args)
+            for _ in range(MAX_CALLS):
+                try:
+                    callback, args = self._calls.get_nowait()
+                except queue.Empty:
+                    break
+                callback(*args)
+        finally:
+            self._after_id = self.root.after(self.interval, self._drain)
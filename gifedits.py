@@ -0,0 +1,171 @@
+"""Non-destructive edits over the source frames.
+
+Edits are recorded as a list of operations and only evaluated when a frame is
+actually needed: the preview evaluates the frame it shows, and the export
+evaluates each frame once, resampling straight from the source to the output
+size before compositing the masks.
+
+gifcore (and with it numpy) is imported where it's used, so the editor can
+create an EditList before the processing backend has loaded.
+"""
+from PIL import Image
+import itertools
+import threading
+
+import gifprofile
+
+
+class Resize:
+    """Scale the frames to size."""
+
+    def __init__(self, size):
+        self.size = tuple(size)
+
+
+class Mask:
+    """Composite a mask, stretched to the frame width, over (add) or out of (cutout) the frames.
+
+    The mask is stored as it was on screen; only its aspect ratio matters, so
+    the operation replays at any output resolution.
+    """
+
+    _keys = itertools.count()
+
+    def __init__(self, mask, add=False, flip=False):
+        self.mask = mask
+        self.add = add
+        self.flip = flip
+        # Ops are never changed once made, so a serial number identifies what this one does
+        self.key = next(self._keys)
+        self._prepared = {}
+        self._lock = threading.Lock()
+
+    def prepared(self, size):
+        """prepare_mask for frames of size, kept for the last few sizes used."""
+        import gifcore
+
+        # Playback renders ahead on a worker while the editor renders the same ops
+        with self._lock:
+            if size not in self._prepared:
+                if len(self._prepared) >= 4:
+                    self._prepared.pop(next(iter(self._prepared)))
+                self._prepared[size] = gifcore.prepare_mask(self.mask, size[0], size[1], self.flip)
+            return self._prepared[size]
+
+
+class Speed:
+    """Show every frame for duration milliseconds."""
+
+    def __init__(self, duration):
+        self.duration = duration
+
+
+class EditList:
+    """Ordered edit operations plus a version number that changes with every edit."""
+
+    def __init__(self):
+        self.ops = []
+        self.version = 0
+
+    def __len__(self):
+        return len(self.ops)
+
+    def add(self, op):
+        # Consecutive resizes or speed changes collapse into the last one
+        if self.ops and type(op) in (Resize, Speed) and type(self.ops[-1]) is type(op):
+            self.ops[-1] = op
+        else:
+            self.ops.append(op)
+        self.version += 1
+        return op
+
+    def copy(self):
+        """Snapshot of the current edits, e.g. for a background export."""
+        edits = EditList()
+        edits.ops = list(self.ops)
+        edits.version = self.version
+        return edits
+
+    def clear(self, keep=()):
+        """Drop every operation except those of the types in keep."""
+        self.ops = [op for op in self.ops if keep and isinstance(op, keep)]
+        self.version += 1
+
+    def output_size(self, source_size):
+        for op in reversed(self.ops):
+            if isinstance(op, Resize):
+                return op.size
+        return tuple(source_size)
+
+    def duration(self, default=100):
+        for op in reversed(self.ops):
+            if isinstance(op, Speed):
+                return op.duration
+        return default
+
+    @property
+    def masks(self):
+        return [op for op in self.ops if isinstance(op, Mask)]
+
+    def render_key(self, size):
+        """Hashable key for render(..., size): it changes with every op that affects the pixels."""
+        return (tuple(size),) + tuple(op.key for op in self.masks)
+
+    def render(self, source, size=None, resample=Image.LANCZOS):
+        """Evaluate the edits for one source frame at size (default: the output size)."""
+        return self.render_many([source], size, resample)[0]
+
+    def render_many(self, sources, size=None, resample=Image.LANCZOS):
+        """Evaluate the edits for equally sized source frames with one resample each."""
+        import gifcore
+
+        size = tuple(size or self.output_size(sources[0].size))
+        with gifprofile.stage("resize", frames=len(sources)):
+            frames = [source if source.size == size else source.resize(size, resample) for source in sources]
+        masks = self.masks
+        if not masks:
+            return frames
+        with gifprofile.stage("composite", frames=len(frames), masks=len(masks)):
+            stack = gifcore.stack_frames(frames)
+            for op in masks:
+                gifcore.composite_prepared(stack, op.prepared(size), op.add)
+            return gifcore.unstack_frames(stack)
+
+    def iter_frames(self, sources, size=None, chunk=None):
+        """Yield every edited frame exactly once, evaluating chunk source frames at a time."""
+        import gifcore
+
+        chunk = chunk or gifcore.COMPOSITE_CHUNK
+        for start in range(0, len(sources), chunk):
+            yield from self.render_many(sources[start:start + chunk], size)
+
+
+class EditedFrames:
+    """Read-only sequence view of the source frames with the edits applied.
+
+    Frames are evaluated on access at the output size. The last one is kept, so
+    repeated access to the same index between edits costs nothing.
+    """
+
+    def __init__(self, sources, edits):
+        self.sources = sources
+        self.edits = edits
+        self._last = None
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __iter__(self):
+        return self.edits.iter_frames(self.sources)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        source = self.sources[index]
+        if self._last is not None:
+            last_index, version, last_source, frame = self._last
+            if last_index == index and version == self.edits.version and last_source is source:
+                return frame
+        frame = self.edits.render(source)
+        self._last = (index, self.edits.version, source, frame)
+        return frame
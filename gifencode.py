@@ -0,0 +1,761 @@
+"""Streaming animation export: GIF, animated WebP and APNG.
+
+Frames are encoded by PIL one at a time on a thread pool (quantized and
+LZW-encoded for GIF, VP8/VP8L for WebP, deflated for PNG), the encoded data
+is lifted out of each single-frame file and written to the output in order
+as soon as it is ready. At most a small window of frames is in memory at
+once, however long the clip is.
+"""
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import hashlib
+import io
+import numpy as np
+import os
+import struct
+import threading
+import time
+import zlib
+
+import gifprofile
+
+# Pixels with less alpha than this become the transparent palette entry
+ALPHA_THRESHOLD = 128
+# Frames sampled when building a shared palette
+PALETTE_SAMPLE = 8
+# Fast octree is ~10x quicker than median cut and what PIL itself uses for RGBA
+QUANTIZE_METHOD = Image.Quantize.FASTOCTREE
+
+FORMATS = ('gif', 'webp', 'apng')
+EXTENSIONS = {'gif': '.gif', 'webp': '.webp', 'apng': '.png'}
+WEBP_QUALITY = 80
+# 0 (fastest) to 6 (smallest), as libwebp's method; APNG maps it onto the zlib level
+EFFORT = 4
+# Encoded data an EncodeCache keeps for re-exports
+ENCODE_CACHE_BYTES = 256 * 1024 ** 2
+
+# Alpha byte of an RGBA pixel viewed as a native-endian uint32
+_OPAQUE_BITS = np.array([0, 0, 0, 255], dtype=np.uint8).view(np.uint32)[0]
+
+EncodedFrame = namedtuple('EncodedFrame', 'size offset interlaced palette transparency data')
+# A WebP or PNG frame: data is the VP8/VP8L (+ALPH) chunks, or the zlib stream of the IDAT chunks
+EncodedImage = namedtuple('EncodedImage', 'size offset data')
+
+
+def format_for(filename):
+    """Output format for filename: .webp is WebP, .png and .apng are APNG, anything else GIF."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.webp':
+        return 'webp'
+    if extension in ('.png', '.apng'):
+        return 'apng'
+    return 'gif'
+
+
+def _skip_sub_blocks(data, pos):
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def _color_table_bits(palette):
+    """Size field for a color table of len(palette) bytes (2 ** (bits + 1) entries)."""
+    return max((len(palette) // 3).bit_length() - 2, 0)
+
+
+def parse_single_frame(data, transparency=None):
+    """Pull the image descriptor, color table and LZW data out of a one-frame GIF."""
+    if data[:3] != b'GIF':
+        raise ValueError("Not a GIF stream")
+    flags = data[10]
+    pos = 13
+    palette = None
+    if flags & 0x80:
+        table_size = 3 << ((flags & 0x07) + 1)
+        palette = data[pos:pos + table_size]
+        pos += table_size
+
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x21:  # Extension
+            pos = _skip_sub_blocks(data, pos + 2)
+        elif block == 0x2C:  # Image descriptor
+            left, top, width, height = struct.unpack('<4H', data[pos + 1:pos + 9])
+            image_flags = data[pos + 9]
+            pos += 10
+            if image_flags & 0x80:
+                table_size = 3 << ((image_flags & 0x07) + 1)
+                palette = data[pos:pos + table_size]
+                pos += table_size
+            start = pos
+            pos = _skip_sub_blocks(data, pos + 1)
+            return EncodedFrame((width, height), (left, top), bool(image_flags & 0x40),
+                                bytes(palette), transparency, bytes(data[start:pos]))
+        else:
+            break
+    raise ValueError("GIF stream has no image data")
+
+
+def quantize_frame(frame, colors=256, palette=None, method=QUANTIZE_METHOD, dither=Image.Dither.NONE):
+    """Quantize a frame to a P image. Returns (image, transparency index or None).
+
+    With palette (a P image from build_palette) every frame shares the same
+    colors and the last entry is reserved for transparency. Dithering only
+    applies to a shared palette; it hides banding but costs LZW compression.
+    """
+    transparent = None
+    if frame.mode in ("RGBA", "LA", "PA"):
+        transparent = np.asarray(frame.getchannel("A")) < ALPHA_THRESHOLD
+        if not transparent.any():
+            transparent = None
+    rgb = frame.convert("RGB")
+
+    if palette is not None:
+        quantized = rgb.quantize(palette=palette, dither=dither)
+        transparency = colors - 1
+    else:
+        quantized = rgb.quantize(colors - 1 if transparent is not None else colors, method=method)
+        transparency = len(quantized.getpalette()) // 3
+
+    if transparent is None:
+        return quantized, None
+
+    indices = np.array(quantized)
+    indices[transparent] = transparency
+    result = Image.fromarray(indices, "P")
+    colors_used = quantized.getpalette()[:transparency * 3]
+    result.putpalette(colors_used + [0, 0, 0] * (transparency + 1 - len(colors_used) // 3))
+    return result, transparency
+
+
+def build_palette(frames, colors=256, method=QUANTIZE_METHOD):
+    """Quantize a montage of sample frames into one palette shared by all of them.
+
+    One entry is left free for transparency.
+    """
+    width = max(frame.width for frame in frames)
+    montage = Image.new("RGB", (width, sum(frame.height for frame in frames)))
+    top = 0
+    for frame in frames:
+        montage.paste(frame.convert("RGB"), (0, top))
+        top += frame.height
+    palette = montage.quantize(colors - 1, method=method)
+    entries = palette.getpalette()[:(colors - 1) * 3]
+    palette.putpalette(entries + [0, 0, 0] * (colors - len(entries) // 3))
+    return palette
+
+
+def encode_frame(frame, colors=256, palette=None, method=QUANTIZE_METHOD, dither=Image.Dither.NONE):
+    """Quantize and LZW-encode one frame."""
+    quantized, transparency = quantize_frame(frame, colors, palette, method, dither)
+    buffer = io.BytesIO()
+    quantized.save(buffer, format="GIF", optimize=False, interlace=False)
+    return parse_single_frame(buffer.getvalue(), transparency)
+
+
+class GifStreamWriter:
+    """Writes a GIF block by block, so frames can be appended as they are encoded."""
+
+    def __init__(self, fp, loop=0, palette=None):
+        self.fp = fp
+        self.loop = loop
+        self.palette = palette
+        self.frames = 0
+        self._elapsed = 0  # ms written so far
+        self._started = False
+
+    def _write_header(self, size):
+        flags = 0
+        if self.palette:
+            flags = 0x80 | 0x70 | _color_table_bits(self.palette)
+        self.fp.write(b'GIF89a' + struct.pack('<2H', *size) + bytes((flags, 0, 0)))
+        if self.palette:
+            self.fp.write(self.palette)
+        if self.loop is not None:
+            self.fp.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+        self._started = True
+
+    def write(self, frame, duration=100, disposal=2, screen_size=None):
+        """Append an EncodedFrame shown for duration milliseconds."""
+        if not self._started:
+            self._write_header(screen_size or frame.size)
+
+        packed = (disposal & 0x07) << 2 | (1 if frame.transparency is not None else 0)
+        # GIF delays are in 1/100 s: round the running total rather than each frame, so durations
+        # like 66.7 ms (15 fps) come out as 70, 60, 70, ... instead of all drifting to 70
+        delay = int(round((self._elapsed + duration) / 10)) - int(round(self._elapsed / 10))
+        self._elapsed += duration
+        self.fp.write(b'!\xf9\x04' + bytes((packed,)) + struct.pack('<H', delay)
+                      + bytes((frame.transparency or 0, 0)))
+
+        local_palette = frame.palette if frame.palette != self.palette else None
+        flags = 0x40 if frame.interlaced else 0
+        if local_palette:
+            flags |= 0x80 | _color_table_bits(local_palette)
+        self.fp.write(b',' + struct.pack('<4H', *frame.offset, *frame.size) + bytes((flags,)))
+        if local_palette:
+            self.fp.write(local_palette)
+        self.fp.write(frame.data)
+        self.frames += 1
+
+    def close(self):
+        if self._started:
+            self.fp.write(b';')
+
+
+def _riff_chunks(data, pos=12):
+    """(fourcc, payload) of every chunk in a RIFF stream from pos on."""
+    while pos + 8 <= len(data):
+        fourcc = data[pos:pos + 4]
+        length = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        yield fourcc, data[pos + 8:pos + 8 + length]
+        pos += 8 + length + (length & 1)
+
+
+def _riff_chunk(fourcc, payload):
+    return fourcc + struct.pack('<I', len(payload)) + payload + (b'\0' if len(payload) & 1 else b'')
+
+
+def encode_webp_frame(frame, quality=WEBP_QUALITY, lossless=False, effort=EFFORT):
+    """Encode one frame as WebP and return its image chunks (ALPH and VP8, or VP8L)."""
+    if frame.mode not in ("RGB", "RGBA"):
+        frame = frame.convert("RGBA")
+    buffer = io.BytesIO()
+    frame.save(buffer, format="WEBP", quality=quality, lossless=lossless, method=effort)
+    data = buffer.getvalue()
+    if data[:4] != b'RIFF' or data[8:12] != b'WEBP':
+        raise ValueError("Not a WebP stream")
+    chunks = b''.join(_riff_chunk(fourcc, payload) for fourcc, payload in _riff_chunks(data)
+                      if fourcc in (b'ALPH', b'VP8 ', b'VP8L'))
+    return EncodedImage(frame.size, (0, 0), chunks)
+
+
+def encode_image(image, format='gif', colors=256, palette=None, quality=WEBP_QUALITY, lossless=False, effort=EFFORT):
+    """Encode one frame for format: an EncodedFrame for GIF, an EncodedImage otherwise."""
+    if format == 'webp':
+        return encode_webp_frame(image, quality, lossless, effort)
+    if format == 'apng':
+        return encode_png_frame(image, effort)
+    return encode_frame(image, colors, palette)
+
+
+class WebPStreamWriter:
+    """Writes an animated WebP frame by frame; the RIFF size is filled in on close.
+
+    Frame offsets must be even, so frames come from a DeltaOptimizer with
+    align=2. Without blend every frame replaces its area outright.
+    """
+
+    def __init__(self, fp, loop=0, blend=True):
+        self.fp = fp
+        self.loop = loop
+        self.blend = blend
+        self.frames = 0
+        self._start = None
+
+    def _write_header(self, size):
+        self._start = self.fp.tell()
+        # Animation and alpha flags; the alpha flag is only a hint, so it is always set
+        vp8x = bytes((0x12, 0, 0, 0)) + (size[0] - 1).to_bytes(3, 'little') + (size[1] - 1).to_bytes(3, 'little')
+        anim = bytes(4) + struct.pack('<H', 1 if self.loop is None else self.loop)
+        self.fp.write(b'RIFF' + bytes(4) + b'WEBP' + _riff_chunk(b'VP8X', vp8x) + _riff_chunk(b'ANIM', anim))
+
+    def write(self, frame, duration=100, disposal=2, screen_size=None):
+        """Append an EncodedImage shown for duration milliseconds."""
+        if self._start is None:
+            self._write_header(screen_size or frame.size)
+        left, top = frame.offset
+        header = ((left // 2).to_bytes(3, 'little') + (top // 2).to_bytes(3, 'little')
+                  + (frame.size[0] - 1).to_bytes(3, 'little') + (frame.size[1] - 1).to_bytes(3, 'little')
+                  + min(int(round(duration)), 0xFFFFFF).to_bytes(3, 'little')
+                  + bytes(((0 if self.blend else 2) | (1 if disposal == 2 else 0),)))
+        self.fp.write(_riff_chunk(b'ANMF', header + frame.data))
+        self.frames += 1
+
+    def close(self):
+        if self._start is None:
+            return
+        end = self.fp.tell()
+        self.fp.seek(self._start + 4)
+        self.fp.write(struct.pack('<I', end - self._start - 8))
+        self.fp.seek(end)
+
+
+def _png_chunk(kind, payload):
+    return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+
+
+def encode_png_frame(frame, effort=EFFORT):
+    """Deflate one frame as RGBA and return the concatenated IDAT data."""
+    buffer = io.BytesIO()
+    frame.convert("RGBA").save(buffer, format="PNG", compress_level=min(effort * 3 // 2 + 1, 9))
+    data = buffer.getvalue()
+    pos = 8
+    idat = []
+    while pos < len(data):
+        length = struct.unpack('>I', data[pos:pos + 4])[0]
+        if data[pos + 4:pos + 8] == b'IDAT':
+            idat.append(data[pos + 8:pos + 8 + length])
+        pos += 12 + length
+    return EncodedImage(frame.size, (0, 0), b''.join(idat))
+
+
+class ApngStreamWriter:
+    """Writes an APNG chunk by chunk; the frame count is filled in on close.
+
+    The first frame doubles as the default image, so it must cover the whole
+    canvas, which DeltaOptimizer guarantees. Without blend every frame
+    replaces its area outright, which also sidesteps readers (PIL among
+    them) that blend translucent pixels incorrectly.
+    """
+
+    def __init__(self, fp, loop=0, blend=True):
+        self.fp = fp
+        self.loop = loop
+        self.blend = blend
+        self.frames = 0
+        self._sequence = 0
+        self._actl = None
+
+    def _write_header(self, size):
+        self.fp.write(b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', struct.pack('>2I5B', *size, 8, 6, 0, 0, 0)))
+        self._actl = self.fp.tell()
+        self.fp.write(_png_chunk(b'acTL', struct.pack('>2I', 0, 1 if self.loop is None else self.loop)))
+
+    def write(self, frame, duration=100, disposal=2, screen_size=None):
+        """Append an EncodedImage shown for duration milliseconds."""
+        if self._actl is None:
+            self._write_header(screen_size or frame.size)
+        # Delay as a fraction of a second; with 1000ths the numerator tops out at 65 s
+        self.fp.write(_png_chunk(b'fcTL', struct.pack('>5I2H2B', self._sequence, *frame.size, *frame.offset,
+                                                      min(int(round(duration)), 0xFFFF), 1000,
+                                                      1 if disposal == 2 else 0, 1 if self.blend else 0)))
+        self._sequence += 1
+        if not self.frames:
+            self.fp.write(_png_chunk(b'IDAT', frame.data))
+        else:
+            self.fp.write(_png_chunk(b'fdAT', struct.pack('>I', self._sequence) + frame.data))
+            self._sequence += 1
+        self.frames += 1
+
+    def close(self):
+        if self._actl is None:
+            return
+        self.fp.write(_png_chunk(b'IEND', b''))
+        end = self.fp.tell()
+        self.fp.seek(self._actl)
+        self.fp.write(_png_chunk(b'acTL', struct.pack('>2I', self.frames, 1 if self.loop is None else self.loop)))
+        self.fp.seek(end)
+
+
+def _bbox(mask):
+    """(left, top, right, bottom) of the True pixels in a 2D bool array, or None."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def _union(a, b):
+    if a is None or b is None:
+        return a or b
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+class DeltaOptimizer:
+    """Turns full frames into cropped delta frames drawn over the previous ones.
+
+    Each frame is compared with what is on screen after the previous frame.
+    It is cropped to the bounding box of the pixels that changed, and pixels
+    inside that box that did not change become transparent so the old ones show
+    through. A frame is normally left in place (disposal 1). Where the new frame
+    is transparent but the screen is not, the previous frame is cleared instead
+    (disposal 2), with its box grown to cover those pixels. Frames that change
+    nothing extend the previous frame's duration.
+
+    Because a frame's disposal depends on the next frame, push() hands back the
+    previous frame and flush() the last one.
+
+    GIF only knows on and off, so alpha is cut at ALPHA_THRESHOLD. With
+    keep_alpha (WebP, APNG) partial alpha is kept, and a pixel that turns
+    translucent counts as needing a clear like one that turns transparent,
+    since drawing it over the old pixel would blend the two. align rounds
+    frame offsets down to a multiple (WebP stores them halved). The first
+    frame always covers the whole canvas.
+    """
+
+    def __init__(self, threshold=0, keep_alpha=False, align=1):
+        self.threshold = threshold
+        self.keep_alpha = keep_alpha
+        self.align = align
+        self.canvas = None
+        self.pending = None
+
+    def _normalize(self, frame):
+        """Frame as an (H, W) uint32 array of RGBA pixels, with transparent pixels all zero.
+
+        Working on whole pixels instead of channels keeps every comparison a single pass.
+        """
+        pixels = np.ascontiguousarray(np.asarray(frame.convert("RGBA")))
+        packed = pixels.view(np.uint32)[..., 0]
+        if self.keep_alpha:
+            return np.where(pixels[..., 3] > 0, packed, np.uint32(0))
+        opaque = pixels[..., 3] >= ALPHA_THRESHOLD
+        return np.where(opaque, packed | _OPAQUE_BITS, np.uint32(0))
+
+    def _align(self, rect):
+        if rect is None or self.align == 1:
+            return rect
+        left, top, right, bottom = rect
+        return left - left % self.align, top - top % self.align, right, bottom
+
+    def _changed(self, current, before):
+        if not self.threshold:
+            return current != before
+        difference = np.abs(current.view(np.uint8).astype(np.int16) - before.view(np.uint8))
+        exceeded = np.ascontiguousarray(difference > self.threshold)
+        return exceeded.view(np.uint32).reshape(current.shape) != 0
+
+    def push(self, frame, duration):
+        """Add the next full frame. Returns a list of (image, offset, duration, disposal, frames).
+
+        frames is how many of the pushed frames the output stands for.
+        """
+        current = self._normalize(frame)
+        first = self.canvas is None
+        if first:
+            self.canvas = np.zeros_like(current)
+
+        before = self.canvas
+        must_clear = None
+        if self.pending is not None:
+            # Pixels that aren't fully opaque can only replace what's on screen once it is cleared
+            must_clear = _bbox(((current & _OPAQUE_BITS) != _OPAQUE_BITS) & (before != 0) & (current != before))
+            if must_clear is not None:
+                self.pending['rect'] = self._align(_union(self.pending['rect'], must_clear))
+                left, top, right, bottom = self.pending['rect']
+                before = before.copy()
+                before[top:bottom, left:right] = 0
+
+        changed = self._changed(current, before)
+        rect = (0, 0, current.shape[1], current.shape[0]) if first else self._align(_bbox(changed))
+
+        finished = []
+        if self.pending is not None:
+            if rect is None and must_clear is None:
+                self.pending['duration'] += duration
+                self.pending['frames'] += 1
+                return finished
+            self.pending['disposal'] = 2 if must_clear is not None else 1
+            finished.append(self._finish(self.pending))
+
+        after = np.where(changed, current, before)
+        self.pending = {
+            'before': before,
+            'after': after,
+            'rect': rect or (0, 0, 1, 1),
+            'duration': duration,
+            'disposal': 1,
+            'frames': 1,
+        }
+        self.canvas = after
+        return finished
+
+    def flush(self):
+        """Return the last frame, cleared over the whole canvas so the loop restarts cleanly."""
+        if self.pending is None:
+            return []
+        height, width = self.canvas.shape
+        self.pending['rect'] = (0, 0, width, height)
+        self.pending['disposal'] = 2
+        finished = [self._finish(self.pending)]
+        self.pending = None
+        return finished
+
+    def _finish(self, pending):
+        left, top, right, bottom = pending['rect']
+        before = pending['before'][top:bottom, left:right]
+        after = pending['after'][top:bottom, left:right]
+        image = np.ascontiguousarray(np.where(before != after, after, np.uint32(0)))
+        pixels = image.view(np.uint8).reshape(image.shape + (4,))
+        return (Image.fromarray(pixels, "RGBA"), (left, top), pending['duration'], pending['disposal'],
+                pending['frames'])
+
+
+def image_digest(image):
+    """Hash of an image's mode, size and pixels."""
+    digest = hashlib.blake2b(f"{image.mode}{image.size}".encode(), digest_size=16)
+    digest.update(image.tobytes())
+    return digest.digest()
+
+
+def _encoded_size(encoded):
+    return len(encoded.data) + len(getattr(encoded, 'palette', b'') or b'')
+
+
+class EncodeCache:
+    """Encoded frames kept between exports, so a re-export only encodes what changed.
+
+    Blocks are keyed by the encoder settings plus a hash of the exact image
+    (delta frame) handed to the encoder and its offset, and evicted least
+    recently used past max_bytes. Independently, the last export's outputs
+    are remembered per settings against the caller's per-item keys: when
+    every key matches, as after a speed change, the file is reassembled
+    from them without preparing or encoding a single frame. Remembered
+    exports count against max_bytes too, and are evicted least recently
+    used once no blocks are left to evict.
+    """
+
+    def __init__(self, max_bytes=ENCODE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._sequences = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            encoded = self._blocks.get(key)
+            if encoded is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return encoded
+
+    def put(self, key, encoded):
+        size = _encoded_size(encoded)
+        if size > self.max_bytes:
+            return  # Would only push everything else out, then go itself
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = encoded
+            self.bytes += size
+            self._evict()
+
+    def sequence(self, settings, keys):
+        """The remembered export for settings if it was made from exactly keys, else None."""
+        with self._lock:
+            remembered = self._sequences.get(settings)
+            if remembered is None or remembered['keys'] != keys:
+                return None
+            self._sequences.move_to_end(settings)
+            return remembered
+
+    def remember(self, settings, keys, screen_size, palette, outputs):
+        size = len(palette or b'') + sum(_encoded_size(encoded) for encoded, _, _ in outputs)
+        with self._lock:
+            # Only the newest export per settings; older ones would rarely match again
+            old = self._sequences.pop(settings, None)
+            if old is not None:
+                self.bytes -= old['bytes']
+            if size > self.max_bytes:
+                return
+            self._sequences[settings] = {'keys': keys, 'screen_size': screen_size, 'palette': palette,
+                                         'outputs': outputs, 'bytes': size}
+            self.bytes += size
+            self._evict(keep=settings)
+
+    def _evict(self, keep=None):
+        """Drop blocks, then remembered exports other than keep, least recently used first, until under max_bytes.
+
+        The newest block is dropped last, after the other remembered exports.
+        """
+        while self.bytes > self.max_bytes:
+            if len(self._blocks) > 1:
+                _, dropped = self._blocks.popitem(last=False)
+                self.bytes -= _encoded_size(dropped)
+            elif len(self._sequences) > (keep in self._sequences):
+                oldest = next(settings for settings in self._sequences if settings != keep)
+                self.bytes -= self._sequences.pop(oldest)['bytes']
+            elif self._blocks:
+                _, dropped = self._blocks.popitem(last=False)
+                self.bytes -= _encoded_size(dropped)
+            else:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._sequences.clear()
+            self.bytes = 0
+
+
+def export_animation(items, output_name, format=None, prepare=None, duration=100, loop=0, shared_palette=False,
+                     colors=256, optimize=True, threshold=0, quality=WEBP_QUALITY, lossless=False, effort=EFFORT,
+                     workers=None, progress=None, cancelled=None, cache=None, keys=None):
+    """Encode items to output_name on a thread pool, writing frames in order as they finish.
+
+    format is one of FORMATS, by default picked from the file extension.
+    items is a sequence of frames, or of anything prepare(item) turns into a
+    frame on a worker. duration is in ms, for every frame or as a list with
+    one entry per item. With optimize, frames go through a DeltaOptimizer
+    (threshold is the per-channel difference still counted as unchanged)
+    before being encoded. shared_palette and colors apply to GIF, quality
+    and lossless to WebP, effort to WebP and APNG. progress(done, total) is
+    called from this thread after every frame; export stops early if
+    cancelled() returns True. Returns a stats dict, or None when cancelled.
+
+    With an EncodeCache, frames encoded before are reused. keys, one
+    hashable per item that changes whenever prepare(item) would, lets an
+    export of the same items with different durations skip everything
+    but writing the file.
+    """
+    format = format or format_for(output_name)
+    if format not in FORMATS:
+        raise ValueError(f"Unknown output format: {format}")
+    items = items if hasattr(items, '__getitem__') else list(items)
+    total = len(items)
+    if not total:
+        raise ValueError("No frames to save")
+    durations = [duration] * total if isinstance(duration, (int, float)) else list(duration)
+    if len(durations) != total:
+        raise ValueError(f"Got {len(durations)} frame durations for {total} frames")
+    prepare = prepare or (lambda item: item)
+    workers = workers or os.cpu_count() or 4
+    window = workers * 2
+    start = time.perf_counter()
+
+    settings = (format, optimize, threshold, colors, shared_palette, quality, lossless, effort)
+    if cache is None or keys is None:
+        keys = None
+    else:
+        keys = tuple(keys)
+        if len(keys) != total:
+            raise ValueError(f"Got {len(keys)} keys for {total} frames")
+        remembered = cache.sequence(settings, keys)
+        if remembered is not None:
+            with gifprofile.stage("reassemble", frames=total, format=format):
+                return _reassemble(remembered, output_name, format, loop, optimize, durations, start, progress)
+    hits_before = cache.hits if cache is not None else 0
+
+    palette = None
+    palette_bytes = None
+    if shared_palette and format == 'gif':
+        step = max(total // PALETTE_SAMPLE, 1)
+        palette = build_palette([prepare(items[i]) for i in range(0, total, step)][:PALETTE_SAMPLE], colors)
+        palette_bytes = bytes(palette.getpalette()[:colors * 3])
+
+    def encode(image, offset):
+        block_key = None
+        if cache is not None:
+            block_key = (settings, palette_bytes, offset, image_digest(image))
+            encoded = cache.get(block_key)
+            if encoded is not None:
+                return encoded
+        with gifprofile.stage("encode", frames=1, format=format):
+            encoded = encode_image(image, format, colors, palette, quality, lossless, effort)._replace(offset=offset)
+        if block_key is not None:
+            cache.put(block_key, encoded)
+        return encoded
+
+    optimizer = None
+    if optimize:
+        optimizer = DeltaOptimizer(threshold, keep_alpha=format != 'gif', align=2 if format == 'webp' else 1)
+    prepared = deque()
+    encoded = deque()
+    written = []
+    state = {'done': 0, 'screen_size': None}
+    completed = False
+
+    with open(output_name, 'wb') as fp, ThreadPoolExecutor(max_workers=workers) as pool:
+        writer = open_writer(fp, format, loop, optimize, palette_bytes)
+
+        def submit(outputs):
+            for image, offset, frame_duration, disposal, frames in outputs:
+                encoded.append((pool.submit(encode, image, offset), frame_duration, disposal, frames))
+
+        def drain(limit):
+            while len(encoded) > limit:
+                future, frame_duration, disposal, frames = encoded.popleft()
+                block = future.result()
+                writer.write(block, frame_duration, disposal, state['screen_size'])
+                if keys is not None:
+                    written.append((block, disposal, frames))
+
+        def take_prepared():
+            frame = prepared.popleft().result()
+            state['screen_size'] = state['screen_size'] or frame.size
+            frame_duration = durations[state['done']]
+            if optimizer:
+                with gifprofile.stage("delta", frames=1):
+                    outputs = optimizer.push(frame, frame_duration)
+                submit(outputs)
+            else:
+                submit([(frame, (0, 0), frame_duration, 2, 1)])
+            # Keep a bounded window in flight so memory stays flat
+            drain(window)
+            state['done'] += 1
+            if progress:
+                progress(state['done'], total)
+
+        try:
+            for item in items:
+                if cancelled and cancelled():
+                    break
+                prepared.append(pool.submit(prepare, item))
+                if len(prepared) >= window:
+                    take_prepared()
+            while prepared and not (cancelled and cancelled()):
+                take_prepared()
+            if state['done'] == total:
+                if optimizer:
+                    submit(optimizer.flush())
+                drain(0)
+                completed = True
+        finally:
+            for future in prepared:
+                future.cancel()
+            for future, _, _, _ in encoded:
+                future.cancel()
+            writer.close()
+            if not completed:
+                fp.close()
+                os.remove(output_name)
+
+    if not completed:
+        return None
+    if keys is not None:
+        cache.remember(settings, keys, state['screen_size'], palette_bytes, written)
+    return {
+        'format': format,
+        'frames': total,
+        'written_frames': writer.frames,
+        'reused_frames': cache.hits - hits_before if cache is not None else 0,
+        'seconds': time.perf_counter() - start,
+        'bytes': os.path.getsize(output_name),
+    }
+
+
+def open_writer(fp, format, loop, blend, palette=None):
+    if format == 'webp':
+        return WebPStreamWriter(fp, loop=loop, blend=blend)
+    if format == 'apng':
+        return ApngStreamWriter(fp, loop=loop, blend=blend)
+    return GifStreamWriter(fp, loop=loop, palette=palette)
+
+
+def _reassemble(remembered, output_name, format, loop, blend, durations, start, progress=None):
+    """Write a remembered export again with new durations."""
+    with open(output_name, 'wb') as fp:
+        writer = open_writer(fp, format, loop, blend, remembered['palette'])
+        first = 0
+        for block, disposal, frames in remembered['outputs']:
+            writer.write(block, sum(durations[first:first + frames]), disposal, remembered['screen_size'])
+            first += frames
+        writer.close()
+    if progress:
+        progress(len(durations), len(durations))
+    return {
+        'format': format,
+        'frames': len(durations),
+        'written_frames': writer.frames,
+        'reused_frames': writer.frames,
+        'seconds': time.perf_counter() - start,
+        'bytes': os.path.getsize(output_name),
+    }
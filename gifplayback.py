@@ -0,0 +1,192 @@
+"""Preview playback against a monotonic clock.
+
+Frames are rendered ahead of time on a worker thread into a small buffer,
+and the Tk side only ever pastes finished images. Each tick works out which
+frame is due from the time elapsed since playback started, so slow renders
+drop frames instead of stretching the animation.
+"""
+from collections import deque
+import threading
+import time
+
+PLAYBACK_BUFFER = 8
+STATS_WINDOW = 1.0  # seconds of displayed frames the achieved fps is measured over
+STATS_INTERVAL = 500  # ms between reports
+RETRY_DELAY = 5  # ms to wait for a frame that isn't rendered yet
+
+
+class PlaybackEngine:
+    """Plays frames 0..count-1 in a loop.
+
+    duration is each frame's display time in ms, or a function of the frame
+    index for per-frame durations. count may be a function, for a sequence
+    that is still growing; it is checked every tick. render(index) runs on
+    the worker thread and must not touch Tk; show(index, image) and
+    report(achieved_fps, target_fps, dropped) run on the Tk thread.
+    """
+
+    def __init__(self, root, show, report=None, buffer_size=PLAYBACK_BUFFER):
+        self.root = root
+        self.show = show
+        self.report = report
+        self.buffer_size = buffer_size
+        self.render = None
+        self.count = 0
+        self.running = False
+        self.dropped = 0
+        self._count = lambda: 0
+        self._duration = lambda index: 100
+        self._buffer = {}
+        self._due = 0
+        self._due_at = 0
+        self._due_shown = False
+        self._generation = 0
+        self._condition = threading.Condition()
+        self._worker = None
+        self._after_id = None
+        self._shown = deque()
+        self._last_report = 0
+        self._render_time = 0.0
+
+    def duration(self, index):
+        return max(self._duration(index), 1)
+
+    @property
+    def target_fps(self):
+        total = sum(self.duration(i) for i in range(self.count))
+        return self.count * 1000 / total if total else 0.0
+
+    @property
+    def achieved_fps(self):
+        if len(self._shown) < 2:
+            return 0.0
+        return (len(self._shown) - 1) / max(self._shown[-1] - self._shown[0], 1e-9)
+
+    def start(self, render, count, index=0, duration=100):
+        self.stop()
+        self._count = count if callable(count) else (lambda: count)
+        self.count = self._count()
+        if not self.count:
+            return
+        self.render = render
+        self._duration = duration if callable(duration) else (lambda i: duration)
+        self.dropped = 0
+        self._shown.clear()
+        self._buffer.clear()
+        self._due = index % self.count
+        self._due_at = time.monotonic()
+        self._due_shown = False
+        self._render_time = 0.0
+        self.running = True
+        self._generation += 1
+        self._worker = threading.Thread(target=self._render_ahead, args=(self._generation,), daemon=True,
+                                        name="gifbruhh-playback")
+        self._worker.start()
+        self._tick()
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._generation += 1
+            self._buffer.clear()
+            self._condition.notify_all()
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+    def update(self, render=None, duration=None):
+        """Swap in a new render function (e.g. after an edit) and/or frame durations, keeping the position."""
+        if not self.running:
+            return
+        with self._condition:
+            if render is not None:
+                self.render = render
+                self._buffer.clear()
+            if duration is not None:
+                self._duration = duration if callable(duration) else (lambda i: duration)
+            self._condition.notify_all()
+
+    def _window(self):
+        """(indices worth keeping from the due frame on, how many of them are too close to start rendering)."""
+        lead = 0
+        elapsed = self.duration(self._due)
+        while elapsed < self._render_time * 1000 and lead < self.count - self.buffer_size:
+            lead += 1
+            elapsed += self.duration((self._due + lead) % self.count)
+        return [(self._due + i) % self.count for i in range(min(lead + self.buffer_size, self.count))], lead
+
+    def _wanted(self):
+        """Indices to render next, nearest first.
+
+        Frames that would already be past due by the time a render finishes
+        are skipped, so a slow render drops frames rather than falling
+        further behind.
+        """
+        window, lead = self._window()
+        return window[lead:]
+
+    def _render_ahead(self, generation):
+        while True:
+            with self._condition:
+                while True:
+                    if generation != self._generation:
+                        return
+                    index = next((i for i in self._wanted() if i not in self._buffer), None)
+                    if index is not None:
+                        break
+                    self._condition.wait()
+                render = self.render
+            started = time.monotonic()
+            try:
+                image = render(index)
+            except Exception:
+                # Leave the frame out; the tick keeps showing the previous one
+                image = None
+            elapsed = time.monotonic() - started
+            with self._condition:
+                self._render_time = elapsed if not self._render_time else 0.8 * self._render_time + 0.2 * elapsed
+                if generation != self._generation:
+                    return
+                if render is self.render:
+                    window, _ = self._window()
+                    self._buffer[index] = image
+                    for stale in [i for i in self._buffer if i not in window]:
+                        del self._buffer[stale]
+
+    def _tick(self):
+        self._after_id = None
+        if not self.running:
+            return
+        now = time.monotonic()
+        with self._condition:
+            self.count = self._count()
+            # Walk the due frame forward through every slot that has already ended
+            while now >= self._due_at + self.duration(self._due) / 1000:
+                if not self._due_shown:
+                    self.dropped += 1
+                self._due_at += self.duration(self._due) / 1000
+                self._due = (self._due + 1) % self.count
+                self._due_shown = False
+                if now - self._due_at > 1:
+                    # Stalled for a long time (e.g. a modal dialog): resync instead of counting every slot
+                    self._due_at = now
+            index = self._due
+            image = self._buffer.get(index)
+            self._condition.notify_all()
+
+        if not self._due_shown and image is not None:
+            self._due_shown = True
+            self.show(index, image)
+            self._shown.append(now)
+            while self._shown and now - self._shown[0] > STATS_WINDOW:
+                self._shown.popleft()
+            if self.report and (now - self._last_report) * 1000 >= STATS_INTERVAL:
+                self._last_report = now
+                self.report(self.achieved_fps, self.target_fps, self.dropped)
+
+        next_due = self._due_at + self.duration(index) / 1000
+        delay = (next_due - time.monotonic()) * 1000
+        if not self._due_shown:
+            # Due frame isn't rendered yet: look again shortly, but never past its slot
+            delay = min(RETRY_DELAY, delay)
+        self._after_id = self.root.after(max(int(delay), 1), self._tick)
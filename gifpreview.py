@@ -0,0 +1,198 @@
+"""Preview rendering for the editor canvas.
+
+Previews are rendered straight at canvas resolution and kept in a small LRU
+cache, so scrubbing back over frames that have not changed costs nothing.
+"""
+from collections import OrderedDict
+from PIL import Image
+import weakref
+
+PREVIEW_CACHE_BYTES = 256 * 1024 * 1024
+# Cheap resampler used while the mouse button is held
+DRAFT_RESAMPLE = Image.BILINEAR
+
+
+def preview_size(size, max_width, max_height):
+    """Size an image of the given size is shown at, never upscaling."""
+    width, height = size
+    if width > max_width or height > max_height:
+        scaling_factor = min(max_width / width, max_height / height)
+        return max(int(width * scaling_factor), 1), max(int(height * scaling_factor), 1)
+    return width, height
+
+
+class MipPyramid:
+    """Successive half-size copies of an image, built lazily.
+
+    Downscaling from the smallest level that still covers the target keeps a
+    cheap resampler from aliasing and makes its cost independent of the
+    source resolution.
+    """
+
+    def __init__(self, image):
+        self.source = image
+        self._levels = [image]
+
+    def level_for(self, size):
+        width, height = size
+        level = self._levels[0]
+        for i in range(1, 32):
+            if i >= len(self._levels):
+                if level.width < 2 * width or level.height < 2 * height or min(level.size) < 2:
+                    break
+                self._levels.append(level.reduce(2))
+            candidate = self._levels[i]
+            if candidate.width < width or candidate.height < height:
+                break
+            level = candidate
+        return level
+
+    def resize(self, size, resample=DRAFT_RESAMPLE):
+        size = (max(int(size[0]), 1), max(int(size[1]), 1))
+        level = self.level_for(size)
+        return level.copy() if level.size == size else level.resize(size, resample)
+
+
+class PreviewCache:
+    """LRU cache of rendered previews bounded by their total pixel memory.
+
+    Entries remember weak references to the frame and mask they were rendered
+    from, so a hit is only returned while those exact objects are still alive.
+    """
+
+    def __init__(self, max_bytes=PREVIEW_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _image_bytes(image):
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, key, sources):
+        entry = self._entries.get(key)
+        if entry is not None:
+            refs, image = entry
+            if all((ref() if ref is not None else None) is source for ref, source in zip(refs, sources)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return image
+            self._remove(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, sources, image):
+        if key in self._entries:
+            self._remove(key)
+        size = self._image_bytes(image)
+        if size > self.max_bytes:
+            return
+        refs = tuple(weakref.ref(source) if source is not None else None for source in sources)
+        self._entries[key] = (refs, image)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, image = self._entries.pop(key)
+        self.current_bytes -= self._image_bytes(image)
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+
+class PreviewRenderer:
+    """Renders a frame with its mask overlaid at preview resolution."""
+
+    def __init__(self, max_width, max_height, max_bytes=PREVIEW_CACHE_BYTES):
+        self.max_width = max_width
+        self.max_height = max_height
+        self.cache = PreviewCache(max_bytes)
+        self._mask_key = None
+        self._mask_ref = None
+        self._mask_preview = None
+
+    def _scaled_mask(self, mask, scale, flip, resample):
+        """Scale the mask by the preview factor, reusing the last result while nothing changed."""
+        size = (max(int(mask.width * scale), 1), max(int(mask.height * scale), 1))
+        key = (mask.size, size, flip, resample)
+        if key != self._mask_key or self._mask_ref() is not mask:
+            scaled = mask if size == mask.size else mask.resize(size, resample)
+            if flip:
+                scaled = scaled.transpose(Image.FLIP_LEFT_RIGHT)
+            self._mask_key = key
+            self._mask_ref = weakref.ref(mask)
+            self._mask_preview = scaled
+        return self._mask_preview
+
+    def render(self, index, frame, mask=None, flip=False, resample=Image.LANCZOS):
+        """Return the preview for frame number index, from the cache when possible."""
+        target_size = preview_size(frame.size, self.max_width, self.max_height)
+        key = (index, frame.size, mask.size if mask else None, flip, target_size, resample)
+        sources = (frame, mask)
+        cached = self.cache.get(key, sources)
+        if cached is not None:
+            return cached
+
+        preview = frame if target_size == frame.size else frame.resize(target_size, resample)
+        preview = self._overlay(preview, frame, frame.size, mask, flip, resample)
+        self.cache.put(key, sources, preview)
+        return preview
+
+    def render_edited(self, index, source, edits, mask=None, flip=False, resample=Image.LANCZOS,
+                      source_size=None):
+        """Like render, but evaluates an EditList for the source frame straight at preview size.
+
+        source_size is the size the edits were made against, when source is a
+        downscaled proxy of that frame.
+        """
+        frame_size = edits.output_size(source_size or source.size)
+        target_size = preview_size(frame_size, self.max_width, self.max_height)
+        key = (index, id(edits), edits.version, source.size, mask.size if mask else None, flip, target_size, resample)
+        sources = (source, mask)
+        cached = self.cache.get(key, sources)
+        if cached is not None:
+            return cached
+
+        preview = edits.render(source, target_size, resample)
+        preview = self._overlay(preview, source, frame_size, mask, flip, resample)
+        self.cache.put(key, sources, preview)
+        return preview
+
+    def _overlay(self, preview, source, frame_size, mask, flip, resample):
+        """Paste the mask, sized for a frame of frame_size, over the preview."""
+        if mask is None:
+            return preview
+        scaled_mask = self._scaled_mask(mask, preview.width / frame_size[0], flip, resample)
+        if preview is source:
+            preview = source.copy()
+        preview.paste(scaled_mask, (0, 0), scaled_mask)
+        return preview
+
+    def render_draft(self, frame_pyramid, frame_size, mask_pyramid=None, mask_size=None, flip=False):
+        """Approximate render(...) for a frame and mask about to be resized to the given sizes.
+
+        Both are sampled from their pyramids with DRAFT_RESAMPLE and nothing is
+        cached; the caller follows up with a full-quality render once input settles.
+        """
+        target_size = preview_size(frame_size, self.max_width, self.max_height)
+        preview = frame_pyramid.resize(target_size)
+        if mask_pyramid is not None and mask_size is not None:
+            scale = target_size[0] / frame_size[0]
+            scaled_mask = mask_pyramid.resize((mask_size[0] * scale, mask_size[1] * scale))
+            if flip:
+                scaled_mask = scaled_mask.transpose(Image.FLIP_LEFT_RIGHT)
+            preview.paste(scaled_mask, (0, 0), scaled_mask)
+        return preview
+
+    def clear(self):
+        self.cache.clear()
+        self._mask_key = None
+        self._mask_ref = None
+        self._mask_preview = None
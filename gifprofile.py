@@ -0,0 +1,109 @@
+"""Opt-in timing of the processing stages.
+
+Wrap a stage in `with gifprofile.stage("name") as record:` and, while
+ENABLED is set, its wall time is recorded together with whatever frame
+count and byte footprint the caller fills into record. Records are kept in
+memory for the stats panel, appended to LOG_PATH as JSON lines, and
+top-level operations can additionally dump a cProfile file to PROFILE_DIR.
+When disabled a stage costs one function call.
+"""
+from collections import deque
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import threading
+import time
+
+ENABLED = False
+LOG_PATH = None  # JSON-lines file, one record per stage
+PROFILE_DIR = None  # cProfile dumps for operations started with profile=True
+RECENT_LIMIT = 200
+
+recent = deque(maxlen=RECENT_LIMIT)
+totals = {}
+_lock = threading.Lock()
+
+
+class _Disabled(dict):
+    """Record handed out while disabled; writes to it go nowhere."""
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_DISABLED = _Disabled()
+
+
+@contextmanager
+def stage(name, profile=False, **fields):
+    """Time the body as stage name. Extra fields (frames=, bytes=, ...) go into the record."""
+    if not ENABLED:
+        yield _DISABLED
+        return
+    record = {'stage': name, 'thread': threading.current_thread().name}
+    record.update(fields)
+    profiler = _start_profiler() if profile and PROFILE_DIR else None
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        record['time'] = time.time()
+        if profiler is not None:
+            profiler.disable()
+            record['profile'] = _dump_profile(profiler, name)
+        _store(record)
+
+
+def _start_profiler():
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another stage is already being profiled
+        return None
+    return profiler
+
+
+def _dump_profile(profiler, name):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{id(profiler):x}.prof")
+    profiler.dump_stats(path)
+    return path
+
+
+def _store(record):
+    with _lock:
+        recent.append(record)
+        total = totals.setdefault(record['stage'], {'count': 0, 'seconds': 0.0, 'max': 0.0, 'frames': 0})
+        total['count'] += 1
+        total['seconds'] += record['seconds']
+        total['max'] = max(total['max'], record['seconds'])
+        total['frames'] += record.get('frames') or 0
+        if LOG_PATH:
+            try:
+                with open(LOG_PATH, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError:
+                pass
+
+
+def summary():
+    """One line per stage, slowest total first, for the stats panel."""
+    with _lock:
+        rows = sorted(totals.items(), key=lambda item: item[1]['seconds'], reverse=True)
+    lines = []
+    for name, total in rows:
+        line = (f"{name}: {total['count']}x, {total['seconds'] * 1000:.0f} ms total, "
+                f"{total['seconds'] / total['count'] * 1000:.1f} ms avg, {total['max'] * 1000:.1f} ms max")
+        if total['frames']:
+            line += f", {total['frames'] / max(total['seconds'], 1e-9):.1f} frames/s"
+        lines.append(line)
+    return lines
+
+
+def reset():
+    with _lock:
+        recent.clear()
+        totals.clear()
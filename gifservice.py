@@ -0,0 +1,422 @@
+"""Run gifbatch's pipeline as a long-lived local service.
+
+Jobs come from a watched folder and/or a small HTTP endpoint bound to
+localhost, wait in a bounded queue and run on a persistent process pool
+with the mask loaded once per worker. Failed jobs are retried; GET /status
+reports queue depth, job counts and per-job latency.
+
+Example:
+    python gifservice.py --watch inbox/ --out done/ --size 480 --port 8765
+    curl -X POST localhost:8765/jobs -d '{"input": "clip.mp4", "add": true}'
+    curl localhost:8765/status
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import itertools
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+
+import gifbatch
+import gifcore
+
+QUEUE_SIZE = 32
+RETRIES = 2
+RETRY_DELAY = 2.0  # seconds before the first retry, doubled for each further one
+POLL_INTERVAL = 1.0  # seconds between scans of the watch folder
+HISTORY = 100  # finished jobs kept for /status
+CONFIG_FILE = os.path.join(os.getenv('APPDATA') or os.path.expanduser("~"), 'gifbruhh', 'config.txt')
+
+
+def remembered_mask():
+    """The mask the editor last used (PNG_FILE in its config.txt), or None."""
+    try:
+        with open(CONFIG_FILE) as f:
+            for line in f:
+                if line.startswith("PNG_FILE="):
+                    path = line.strip().split("=", 1)[1]
+                    return path if os.path.exists(path) else None
+    except OSError:
+        pass
+    return None
+
+
+class Job:
+    """One file to convert, plus its timing for the status report."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, input_path, output_path, options=None, on_done=None):
+        self.id = next(self._ids)
+        self.input = input_path
+        self.output = output_path
+        self.options = options or {}
+        self.on_done = on_done
+        self.state = 'queued'
+        self.attempts = 0
+        self.error = None
+        self.stats = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def status(self):
+        now = time.time()
+        return {
+            'id': self.id,
+            'input': self.input,
+            'output': self.output,
+            'state': self.state,
+            'attempts': self.attempts,
+            'error': self.error,
+            'wait_seconds': (self.started or now) - self.submitted,
+            'run_seconds': (self.finished or now) - self.started if self.started else None,
+            'latency_seconds': (self.finished - self.submitted) if self.finished else None,
+            'frames': self.stats['frames'] if self.stats else None,
+            'bytes': self.stats['bytes'] if self.stats else None,
+        }
+
+
+class Service:
+    """A process pool fed from a bounded queue.
+
+    submit() refuses jobs once QUEUE_SIZE are waiting, so callers see
+    backpressure instead of the queue growing without bound. One dispatcher
+    thread per worker process keeps exactly that many jobs in flight. If
+    a worker process dies (out of memory, a crashing decoder), the pool is
+    replaced and the jobs that were running on it are resubmitted.
+    """
+
+    def __init__(self, out_dir, mask_path=None, defaults=None, workers=None, queue_size=QUEUE_SIZE,
+                 retries=RETRIES, memory_budget=None, cache=True, report=print):
+        self.out_dir = out_dir
+        self.defaults = defaults or {}
+        self.workers = workers or os.cpu_count() or 1
+        self.retries = retries
+        self.report = report
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.jobs = {}
+        self._outputs = {}  # output names handed out, so two inputs never share one
+        self.history = deque(maxlen=HISTORY)
+        self.counts = {'completed': 0, 'failed': 0, 'retried': 0, 'rejected': 0, 'pool_restarts': 0}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        os.makedirs(out_dir, exist_ok=True)
+        self._pool_args = (mask_path, memory_budget, cache)
+        self._pool_lock = threading.Lock()
+        self.pool = self._new_pool()
+        self._dispatchers = [threading.Thread(target=self._dispatch, daemon=True, name=f"gifservice-{i}")
+                             for i in range(self.workers)]
+        for thread in self._dispatchers:
+            thread.start()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=gifbatch._init_worker,
+                                   initargs=self._pool_args)
+
+    def _replace_pool(self, broken):
+        """Swap in a new pool for broken, unless another dispatcher already has."""
+        with self._pool_lock:
+            if self.pool is not broken or self._stopping.is_set():
+                return
+            self.pool = self._new_pool()
+            with self._lock:
+                self.counts['pool_restarts'] += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.report("A worker process died; restarted the pool")
+
+    def submit(self, input_path, output_path=None, options=None, on_done=None, block=False):
+        """Queue a job and return it, or None when the queue is full (and block is False)."""
+        options = dict(self.defaults, **(options or {}))
+        if output_path is None:
+            with self._lock:
+                output_path = gifbatch.output_path(input_path, self.out_dir, taken=self._outputs)
+        job = Job(input_path, output_path, options, on_done)
+        try:
+            self.queue.put(job, block=block)
+        except queue.Full:
+            with self._lock:
+                self.counts['rejected'] += 1
+            return None
+        with self._lock:
+            self.jobs[job.id] = job
+        return job
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._run(job)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, job):
+        job.state = 'running'
+        job.started = time.time()
+        options = job.options
+        while True:
+            job.attempts += 1
+            with self._pool_lock:
+                pool = self.pool
+            try:
+                job.stats = pool.submit(
+                    gifbatch.process_file, job.input, job.output, options.get('size', (None, None)),
+                    options.get('add', False), options.get('flip', False), options.get('speed', 100),
+                    options.get('optimize', True), options.get('video_options'),
+                    dedup=options.get('dedup'), formats=options.get('formats'),
+                    encoder_options={key: options[key] for key in ('quality', 'lossless', 'effort')
+                                     if key in options}).result()
+                job.state = 'done'
+                job.error = None
+                break
+            except BrokenProcessPool as e:
+                # Every job running on the pool sees this, not just the one that killed it, so it is
+                # retried on a fresh pool right away; it still counts as an attempt, so a file that
+                # crashes the worker every time ends up failed rather than taking pools down forever
+                job.error = str(e) or type(e).__name__
+                self._replace_pool(pool)
+                if job.attempts > self.retries or self._stopping.is_set():
+                    job.state = 'failed'
+                    break
+                with self._lock:
+                    self.counts['retried'] += 1
+                self.report(f"Resubmitting {job.input} ({job.attempts}/{self.retries}) after a worker died")
+            except Exception as e:
+                job.error = str(e) or type(e).__name__
+                if job.attempts > self.retries or self._stopping.is_set():
+                    job.state = 'failed'
+                    break
+                with self._lock:
+                    self.counts['retried'] += 1
+                self.report(f"Retrying {job.input} ({job.attempts}/{self.retries}): {job.error}")
+                time.sleep(RETRY_DELAY * 2 ** (job.attempts - 1))
+        job.finished = time.time()
+        with self._lock:
+            self.counts['completed' if job.state == 'done' else 'failed'] += 1
+            self.history.append(job)
+            self.jobs.pop(job.id, None)
+        if job.state == 'done':
+            self.report(f"{os.path.basename(job.input)}: {job.stats['frames']} frames in "
+                        f"{job.finished - job.submitted:.2f}s ({job.finished - job.started:.2f}s running)")
+        else:
+            self.report(f"FAILED {job.input} after {job.attempts} attempts: {job.error}")
+        if job.on_done:
+            job.on_done(job)
+
+    def job(self, job_id):
+        with self._lock:
+            found = self.jobs.get(job_id)
+            if found is None:
+                found = next((job for job in self.history if job.id == job_id), None)
+        return found
+
+    def status(self):
+        with self._lock:
+            active = list(self.jobs.values())
+            finished = list(self.history)
+            counts = dict(self.counts)
+        latencies = [job.finished - job.submitted for job in finished if job.state == 'done']
+        last = latencies[-1] if latencies else None
+        latencies.sort()
+        return {
+            'uptime_seconds': time.time() - self.started,
+            'workers': self.workers,
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'running': sum(1 for job in active if job.state == 'running'),
+            'counts': counts,
+            'latency_seconds': {
+                'last': last,
+                'median': latencies[len(latencies) // 2] if latencies else None,
+                'max': latencies[-1] if latencies else None,
+            },
+            'jobs': [job.status() for job in active] + [job.status() for job in reversed(finished)],
+        }
+
+    def stop(self, wait=True):
+        """Stop taking work; with wait, let queued and running jobs finish first."""
+        if wait:
+            self.queue.join()
+        with self._pool_lock:
+            self._stopping.set()
+            pool = self.pool
+        pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class FolderWatcher:
+    """Poll a folder and submit every supported file that has stopped growing.
+
+    Inputs move to done/ or failed/ inside the folder once their job
+    finishes, so nothing is converted twice, even across restarts. A file
+    waits in the folder while the queue is full and is picked up on a later scan.
+    """
+
+    def __init__(self, service, folder, interval=POLL_INTERVAL):
+        self.service = service
+        self.folder = folder
+        self.interval = interval
+        self._sizes = {}
+        self._pending = set()
+        self._stopping = threading.Event()
+        for name in ('done', 'failed'):
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="gifservice-watch")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.scan()
+            except OSError as e:
+                self.service.report(f"Watching {self.folder} failed: {e}")
+            self._stopping.wait(self.interval)
+
+    def scan(self):
+        sizes = {}
+        for path in gifbatch.collect_inputs([self.folder]):
+            if path in self._pending:
+                continue
+            sizes[path] = os.path.getsize(path)
+            # Only take files whose size held still since the last scan, i.e. finished copying
+            if self._sizes.get(path) != sizes[path] or self.service.queue.full():
+                continue
+            if self.service.submit(path, on_done=self._finished) is not None:
+                self._pending.add(path)
+                del sizes[path]
+        self._sizes = sizes
+
+    def _finished(self, job):
+        target = os.path.join(self.folder, 'done' if job.state == 'done' else 'failed',
+                              os.path.basename(job.input))
+        try:
+            shutil.move(job.input, target)
+        except OSError as e:
+            self.service.report(f"Couldn't move {job.input}: {e}")
+        self._pending.discard(job.input)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path in ('/', '/status'):
+            return self._reply(200, self.service.status())
+        if self.path.startswith('/jobs/'):
+            try:
+                job = self.service.job(int(self.path[len('/jobs/'):]))
+            except ValueError:
+                job = None
+            if job is not None:
+                return self._reply(200, job.status())
+        self._reply(404, {'error': "not found"})
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            return self._reply(404, {'error': "not found"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b"{}")
+            input_path = os.path.abspath(request.pop('input'))
+            output = request.pop('output', None)
+            if 'size' in request and not isinstance(request['size'], (list, tuple)):
+                request['size'] = gifbatch.parse_size(str(request['size']))
+        except (ValueError, KeyError, TypeError, argparse.ArgumentTypeError) as e:
+            return self._reply(400, {'error': f"bad request: {e}"})
+        if not os.path.isfile(input_path):
+            return self._reply(400, {'error': f"no such file: {input_path}"})
+        job = self.service.submit(input_path, output, request)
+        if job is None:
+            return self._reply(503, {'error': "queue full, try again later",
+                                     'queue_depth': self.service.queue.qsize()})
+        self._reply(202, job.status())
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_http(service, port, host="127.0.0.1"):
+    """Start the job/status endpoint on a daemon thread. Only binds to the loopback interface."""
+    handler = type('Handler', (_Handler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="gifservice-http").start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert files dropped into a folder or posted to localhost.")
+    parser.add_argument('--watch', help="folder to pick up new files from")
+    parser.add_argument('--port', type=int, help="localhost port for POST /jobs and GET /status")
+    parser.add_argument('--out', default='gifbruhh_out', help="output directory")
+    parser.add_argument('--mask', help="PNG mask to apply (default: the one the editor last used)")
+    parser.add_argument('--no-mask', action='store_true', help="don't apply any mask")
+    parser.add_argument('--size', type=gifbatch.parse_size, default=(None, None),
+                        help="output size as WIDTH, WIDTHxHEIGHT or xHEIGHT")
+    parser.add_argument('--add', action='store_true', help="paste the mask instead of cutting it out")
+    parser.add_argument('--flip', action='store_true', help="flip the mask horizontally")
+    parser.add_argument('--speed', type=int, default=100, help="frame duration in milliseconds")
+    parser.add_argument('--dedup', type=float, nargs='?', const=gifcore.DEDUP_THRESHOLD, default=None,
+                        metavar='THRESHOLD', help="merge runs of (near-)duplicate frames into longer frames")
+    gifbatch.add_encoder_arguments(parser)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help="jobs waiting before new ones are refused")
+    parser.add_argument('--retries', type=int, default=RETRIES, help="extra attempts for a failed job")
+    parser.add_argument('--memory-budget', type=int, default=None, metavar='MB',
+                        help="decoded frames per file above this spill to a scratch file")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="don't read or write the decoded-frame cache")
+    args = parser.parse_args(argv)
+    if not args.watch and not args.port:
+        parser.error("give --watch, --port or both")
+
+    mask_path = None if args.no_mask else args.mask or remembered_mask()
+    defaults = {'size': args.size, 'add': args.add, 'flip': args.flip, 'speed': args.speed, 'dedup': args.dedup,
+                'formats': args.formats, **gifbatch.encoder_options(args)}
+    service = Service(args.out, mask_path, defaults, args.workers, args.queue_size, args.retries,
+                      args.memory_budget * 1024 ** 2 if args.memory_budget else None, args.cache)
+    print(f"{service.workers} workers, mask: {mask_path or 'none'}, output: {os.path.abspath(args.out)}")
+    watcher = server = None
+    if args.watch:
+        watcher = FolderWatcher(service, args.watch)
+        watcher.start()
+        print(f"Watching {os.path.abspath(args.watch)}")
+    if args.port:
+        server = serve_http(service, args.port)
+        print(f"Listening on http://127.0.0.1:{args.port} (POST /jobs, GET /status)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("Stopping...")
+    if watcher:
+        watcher.stop()
+    if server:
+        server.shutdown()
+    service.stop(wait=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Startup timing and deferred loading of the processing modules.
+
+The editor only needs PIL and Tk to put a window up; numpy, the decoders
+and the encoder are handed out as LazyModule stand-ins, imported by
+warm_up() on a background thread once the window is showing, or on first
+use if that comes sooner. Import times and milestones such as the first
+paint are collected for report().
+"""
+from contextlib import contextmanager
+import importlib
+import threading
+import time
+
+STARTED = time.perf_counter()
+# Loaded in this order by warm_up, so each time excludes what came before
+BACKEND_MODULES = ["numpy", "gifstore", "gifcache", "gifvideo", "gifencode", "gifcore"]
+
+import_times = {}
+marks = []
+_lazy = {}
+
+
+def mark(label):
+    """Record label as happening now, relative to STARTED."""
+    marks.append((label, time.perf_counter() - STARTED))
+
+
+@contextmanager
+def timing(name):
+    """Record how long the import statements in the body take, as name."""
+    start = time.perf_counter()
+    yield
+    import_times[name] = time.perf_counter() - start
+
+
+class LazyModule:
+    """Module stand-in that imports the real module on first attribute access.
+
+    Attributes assigned before then (settings from config.txt) are kept and
+    applied to the module once it is imported.
+    """
+
+    def __init__(self, name):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_module', None)
+        object.__setattr__(self, '_pending', {})
+        object.__setattr__(self, '_lock', threading.RLock())
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = self._module
+                if module is None:
+                    with timing(self._name):
+                        module = importlib.import_module(self._name)
+                    for attr, value in self._pending.items():
+                        setattr(module, attr, value)
+                    object.__setattr__(self, '_module', module)
+        return module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        with self._lock:
+            if self._module is None:
+                self._pending[attr] = value
+                return
+        setattr(self._module, attr, value)
+
+
+def lazy_import(name):
+    if name not in _lazy:
+        _lazy[name] = LazyModule(name)
+    return _lazy[name]
+
+
+def warm_up(on_ready=None):
+    """Import the backend on a daemon thread; on_ready() is called from that thread when done."""
+    def run():
+        for name in BACKEND_MODULES:
+            if name in _lazy:
+                _lazy[name]._load()
+            elif name not in import_times:
+                with timing(name):
+                    importlib.import_module(name)
+        # Resolves the bundled ffmpeg binary, which imports imageio-ffmpeg
+        lazy_import("gifvideo").ffmpeg_exe()
+        mark("backend ready")
+        if on_ready:
+            on_ready()
+
+    thread = threading.Thread(target=run, daemon=True, name="gifbruhh-warmup")
+    thread.start()
+    return thread
+
+
+def report():
+    """Lines describing import times (slowest first) and startup milestones."""
+    lines = [f"{label}: {seconds * 1000:.0f} ms after start" for label, seconds in marks]
+    for name, seconds in sorted(import_times.items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"import {name}: {seconds * 1000:.0f} ms")
+    return lines
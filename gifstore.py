@@ -0,0 +1,236 @@
+"""Compact storage for decoded frames.
+
+All frames of a clip live in one contiguous (N, H, W, C) uint8 array, with
+C = 3 when the source is opaque. Once a store would exceed the memory budget
+the array is backed by an anonymous scratch file through np.memmap instead,
+so long captures page from disk rather than pushing the machine into swap.
+"""
+from PIL import Image
+from collections import OrderedDict
+import hashlib
+import numpy as np
+import tempfile
+import threading
+
+MEMORY_BUDGET = 2 * 1024 ** 3
+VIEW_CACHE = 64
+SCRATCH_DIR = None  # tempfile's default
+
+
+def allocate(shape, dtype=np.uint8, budget=None):
+    """Return an empty array of shape, memory-mapped to a scratch file when it is over budget."""
+    budget = MEMORY_BUDGET if budget is None else budget
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if nbytes <= budget or not nbytes:
+        return np.empty(shape, dtype=dtype)
+    # The file has no name and is removed by the OS once the mapping is gone
+    scratch = tempfile.TemporaryFile(prefix="gifbruhh-", suffix=".frames", dir=SCRATCH_DIR)
+    return np.memmap(scratch, dtype=dtype, mode="w+", shape=shape)
+
+
+class FrameStore:
+    """A sequence of PIL frames backed by one contiguous array.
+
+    Indexing returns a PIL image of the frame. The last VIEW_CACHE of them are
+    kept, so repeated access returns the same object (the preview cache
+    relies on it) without holding a second copy of every frame: PIL keeps RGB
+    pixels four bytes wide, so RGB images can't share the array's memory.
+    Assigning a frame never touches the array: the new image is kept as an
+    override.
+    """
+
+    def __init__(self, array, mode=None, length=None):
+        self.array = array
+        self.mode = mode or ("RGBA" if array.shape[-1] == 4 else "RGB")
+        self.length = len(array) if length is None else length
+        self.complete = True
+        self._budget = None
+        self._opaque = True
+        self.overrides = {}
+        self._views = OrderedDict()
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_images(cls, images, count=None, budget=None):
+        """Copy images into a new store; count, if known, sizes the array up front.
+
+        Frames are stored as RGB unless at least one of them has transparency.
+        """
+        images = iter(images)
+        first = next(images, None)
+        if first is None:
+            return cls(np.empty((0, 1, 1, 3), dtype=np.uint8))
+        store = cls.streaming(first, capacity=count or 64, budget=budget)
+        for image in images:
+            store.append(image)
+        store.finish()
+        return store
+
+    @classmethod
+    def streaming(cls, first, capacity=64, budget=None):
+        """An incomplete store holding first; add frames with append() and call finish() at the end.
+
+        Readers can use the frames already appended while the rest are still
+        coming in, e.g. from a decoder thread.
+        """
+        width, height = first.size
+        store = cls(allocate((capacity, height, width, 4), budget=budget), "RGBA", length=0)
+        store.complete = False
+        store._budget = budget
+        store.append(first)
+        return store
+
+    def append(self, image):
+        pixels = np.asarray(image.convert("RGBA"))
+        with self._lock:
+            if self.length == len(self.array):
+                # Grow geometrically; views handed out earlier keep the old array alive
+                grown = allocate((len(self.array) * 2,) + self.array.shape[1:], budget=self._budget)
+                grown[:self.length] = self.array[:self.length]
+                self.array = grown
+            self.array[self.length] = pixels
+            self.length += 1
+        self._opaque = self._opaque and pixels[..., 3].min() == 255
+
+    def finish(self):
+        """Trim the array to the frames appended, and keep them as RGB if none had transparency."""
+        with self._lock:
+            if self._opaque:
+                rgb = allocate((self.length,) + self.array.shape[1:3] + (3,), budget=self._budget)
+                for start in range(0, self.length, 64):
+                    rgb[start:start + 64] = self.array[start:min(start + 64, self.length), ..., :3]
+                self.array, self.mode = rgb, "RGB"
+                self._views.clear()
+                self._digests.clear()
+            else:
+                self.array = self.array[:self.length]
+            self.complete = True
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index in self.overrides:
+            return self.overrides[index]
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        with self._lock:
+            view = self._views.get(index)
+            if view is None:
+                view = self._views[index] = Image.fromarray(self.array[index], self.mode)
+                if len(self._views) > VIEW_CACHE:
+                    self._views.popitem(last=False)
+            else:
+                self._views.move_to_end(index)
+            return view
+
+    def __setitem__(self, index, image):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        self.overrides[index] = image
+
+    def digest(self, index):
+        """Hash of frame index's pixels; for the array's frames it is computed once."""
+        if index < 0:
+            index += len(self)
+        if index in self.overrides:
+            image = self.overrides[index]
+            digest = hashlib.blake2b(f"{image.mode}{image.size}".encode(), digest_size=16)
+            digest.update(image.tobytes())
+            return digest.digest()
+        digest = self._digests.get(index)
+        if digest is None:
+            digest = hashlib.blake2b(f"{self.mode}{self.size}".encode(), digest_size=16)
+            digest.update(np.ascontiguousarray(self.array[index]))
+            digest = self._digests[index] = digest.digest()
+        return digest
+
+    def select(self, indices):
+        """A new store with copies of just the frames at indices, in that order."""
+        with self._lock:
+            array = allocate((len(indices),) + self.array.shape[1:], budget=self._budget)
+            for start in range(0, len(indices), 64):
+                array[start:start + 64] = self.array[indices[start:start + 64]]
+        store = FrameStore(array, self.mode)
+        store.overrides = {new: self.overrides[old] for new, old in enumerate(indices) if old in self.overrides}
+        return store
+
+    @property
+    def size(self):
+        return self.array.shape[2], self.array.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.array[:self.length].nbytes
+
+
+class ProxyStore(FrameStore):
+    """Downscaled stand-in for a store, for editing at preview resolution.
+
+    Frames are resampled from the source the first time they are needed and
+    kept in the proxy's own (much smaller) array; the source store is left
+    untouched for the full-resolution export.
+    """
+
+    def __init__(self, source, size, resample=Image.LANCZOS):
+        width, height = size
+        channels = 4 if source.mode == "RGBA" else 3
+        super().__init__(allocate((max(len(source), 1), height, width, channels)), source.mode)
+        self.source = source
+        self.resample = resample
+        self.ready = np.zeros(len(self.array), dtype=bool)
+
+    def __len__(self):
+        # Follows a source that is still being decoded
+        return len(self.source)
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+    def _reserve(self, count):
+        with self._lock:
+            if count > len(self.array):
+                capacity = max(count, len(self.array) * 2)
+                grown = allocate((capacity,) + self.array.shape[1:])
+                grown[:len(self.array)] = self.array
+                ready = np.zeros(capacity, dtype=bool)
+                ready[:len(self.ready)] = self.ready
+                self.array, self.ready = grown, ready
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return super().__getitem__(index)
+        if index < 0:
+            index += len(self)
+        if 0 <= index < len(self) and index >= len(self.array):
+            self._reserve(len(self))
+        if 0 <= index < len(self) and not self.ready[index] and index not in self.overrides:
+            frame = self.source[index].resize(self.size, self.resample, reducing_gap=3.0)
+            pixels = np.asarray(frame.convert(self.mode))
+            # Under the lock, so a _reserve on another thread can't swap the array out from under the write
+            with self._lock:
+                self.array[index] = pixels
+                self.ready[index] = True
+        return super().__getitem__(index)
+
+
+def proxy(store, max_width, max_height):
+    """A ProxyStore of store fitting in max_width x max_height, or store itself if it already fits."""
+    if not len(store):
+        return store
+    width, height = store.size
+    scale = min(max_width / width, max_height / height)
+    if scale >= 1:
+        return store
+    return ProxyStore(store, (max(int(width * scale), 1), max(int(height * scale), 1)))
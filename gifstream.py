@@ -0,0 +1,254 @@
+"""Convert a video to an animation without holding the clip in memory.
+
+The editor and gifbatch decode every frame before saving, so the longest
+clip they can handle is bounded by RAM. convert_video instead runs the
+stages as a pipeline joined by bounded queues:
+
+    ffmpeg decode + resize -> composite the mask -> delta + quantize/encode -> write
+
+A decoder thread reads frames from ffmpeg (which also does the resizing).
+Compositing and encoding run on a shared thread pool. The futures pass
+through the queues in frame order, so the delta optimizer and the writer
+see frames in sequence while the work itself runs in parallel. Each queue
+holds at most QUEUE_SIZE entries, so at most a fixed window of frames is
+alive at once, however long the clip is.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+import gifcore
+import gifencode
+import gifprofile
+import gifvideo
+
+QUEUE_SIZE = 8  # frames (or encode jobs) per queue
+REPORT_INTERVAL = 0.5  # seconds between report() calls
+_DONE = object()  # end of stream marker passed down the queues
+
+
+class _Stopped(Exception):
+    """Raised inside a stage when another stage failed or the user cancelled."""
+
+
+class Pipeline:
+    """Stage threads and queues of one conversion, with the counters report() reads."""
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.decoded = queue.Queue(queue_size)  # (H, W, 3) arrays from ffmpeg
+        self.composited = queue.Queue(queue_size)  # futures of composited frames, in order
+        self.encoding = queue.Queue(queue_size)  # (future of EncodedImage, duration, disposal, frames), in order
+        self.stop = threading.Event()
+        self.error = None
+        self.counts = {'decoded': 0, 'composited': 0, 'written': 0}  # source frames past each stage
+        self.peak_depths = {'decoded': 0, 'composited': 0, 'encoding': 0}
+
+    def depths(self):
+        return {'decoded': self.decoded.qsize(), 'composited': self.composited.qsize(),
+                'encoding': self.encoding.qsize()}
+
+    def put(self, name, item):
+        """Put item on queue name, waiting for room unless the pipeline stops meanwhile."""
+        target = getattr(self, name)
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                target.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.peak_depths[name] = max(self.peak_depths[name], target.qsize())
+
+    def get(self, name):
+        source = getattr(self, name)
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stop.set()
+
+    def run(self, target, name):
+        """Run target on a daemon thread; an error in it stops the whole pipeline."""
+        def stage():
+            try:
+                target()
+            except _Stopped:
+                pass
+            except Exception as e:
+                self.fail(e)
+
+        thread = threading.Thread(target=stage, daemon=True, name=f"gifbruhh-stream-{name}")
+        thread.start()
+        return thread
+
+
+def convert_video(filename, output_name, mask=None, add=False, flip=False, width=None, height=None,
+                  fps=gifcore.VIDEO_FPS, start=0, end=None, duration=None, format=None, optimize=True,
+                  colors=256, quality=gifencode.WEBP_QUALITY, lossless=False, effort=gifencode.EFFORT,
+                  workers=None, queue_size=QUEUE_SIZE, report=None, cancelled=None, info=None):
+    """Decode, mask and encode a video straight to output_name in bounded memory.
+
+    mask, add and flip are as in gifcore.apply_mask; width/height, fps and
+    start/end (seconds) as in gifcore.load_video_frames. duration is each
+    frame's display time in ms, by default 1000 / fps. report(stats) is
+    called every REPORT_INTERVAL seconds from this thread with the frames
+    written, the estimated total, frames/s and the depth of every queue.
+    Stops early if cancelled() returns True. Returns a stats dict like
+    gifencode.export_animation's plus 'fps' and 'peak_depths', or None when
+    cancelled.
+    """
+    format = format or gifencode.format_for(output_name)
+    if format not in gifencode.FORMATS:
+        raise ValueError(f"Unknown output format: {format}")
+    info = info or gifvideo.probe(filename)
+    duration = duration or 1000 / fps
+    workers = workers or os.cpu_count() or 4
+    pipeline = Pipeline(queue_size)
+    state = {'total': None, 'size': None, 'prepared_mask': None}
+    start_time = time.perf_counter()
+
+    def on_decoded(done, total):
+        state['total'] = total
+
+    def decode():
+        frames = gifvideo.stream(filename, fps=fps, start=start, end=end, width=width, height=height,
+                                 progress=on_decoded, info=info)
+        try:
+            for frame in frames:
+                if cancelled and cancelled():
+                    pipeline.stop.set()
+                    raise _Stopped()
+                pipeline.put('decoded', frame)
+                pipeline.counts['decoded'] += 1
+        finally:
+            frames.close()
+        pipeline.put('decoded', _DONE)
+
+    def composite(pixels):
+        with gifprofile.stage("stream_composite", frames=1):
+            if mask is None:
+                return Image.fromarray(pixels, "RGB")
+            stack = np.empty(pixels.shape[:2] + (4,), dtype=np.uint8)
+            stack[..., :3] = pixels
+            stack[..., 3] = 255
+            gifcore.composite_prepared(stack[np.newaxis], state['prepared_mask'], add)
+            return Image.fromarray(stack, "RGBA")
+
+    def dispatch_composites():
+        while True:
+            pixels = pipeline.get('decoded')
+            if pixels is _DONE:
+                break
+            if mask is not None and state['prepared_mask'] is None:
+                frame_height, frame_width = pixels.shape[:2]
+                state['prepared_mask'] = gifcore.prepare_mask(mask, frame_width, frame_height, flip)
+            pipeline.put('composited', pool.submit(composite, pixels))
+        pipeline.put('composited', _DONE)
+
+    def encode(image, offset):
+        with gifprofile.stage("encode", frames=1, format=format):
+            return gifencode.encode_image(image, format, colors, None, quality, lossless,
+                                          effort)._replace(offset=offset)
+
+    def dispatch_encodes():
+        optimizer = None
+        if optimize:
+            optimizer = gifencode.DeltaOptimizer(0, keep_alpha=format != 'gif', align=2 if format == 'webp' else 1)
+        while True:
+            future = pipeline.get('composited')
+            if future is _DONE:
+                break
+            frame = future.result()
+            state['size'] = state['size'] or frame.size
+            pipeline.counts['composited'] += 1
+            if optimizer:
+                with gifprofile.stage("delta", frames=1):
+                    outputs = optimizer.push(frame, duration)
+            else:
+                outputs = [(frame, (0, 0), duration, 2, 1)]
+            for image, offset, frame_duration, disposal, frames in outputs:
+                pipeline.put('encoding', (pool.submit(encode, image, offset), frame_duration, disposal, frames))
+        if optimizer:
+            for image, offset, frame_duration, disposal, frames in optimizer.flush():
+                pipeline.put('encoding', (pool.submit(encode, image, offset), frame_duration, disposal, frames))
+        pipeline.put('encoding', _DONE)
+
+    completed = False
+    threads = []
+    last_report = start_time
+    with open(output_name, 'wb') as fp, ThreadPoolExecutor(max_workers=workers) as pool:
+        writer = gifencode.open_writer(fp, format, 0, optimize)
+        try:
+            with gifprofile.stage("stream_video", profile=True, source=filename, format=format) as record:
+                threads = [pipeline.run(decode, "decode"), pipeline.run(dispatch_composites, "composite"),
+                           pipeline.run(dispatch_encodes, "encode")]
+                # The calling thread is the writer: it takes encodes in order and waits on each one
+                while True:
+                    job = pipeline.get('encoding')
+                    if job is _DONE:
+                        break
+                    future, frame_duration, disposal, frames = job
+                    writer.write(future.result(), frame_duration, disposal, state['size'])
+                    pipeline.counts['written'] += frames
+                    now = time.perf_counter()
+                    if report and now - last_report >= REPORT_INTERVAL:
+                        last_report = now
+                        report(_progress(pipeline, state['total'], now - start_time))
+                completed = pipeline.counts['composited'] > 0
+                record['frames'] = pipeline.counts['composited']
+        except _Stopped:
+            pass
+        finally:
+            pipeline.stop.set()
+            for thread in threads:
+                thread.join()
+            # Nothing more will read the queues; drop what is left so pending work isn't waited on
+            for name in ('composited', 'encoding'):
+                while True:
+                    try:
+                        job = getattr(pipeline, name).get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is not _DONE:
+                        (job if name == 'composited' else job[0]).cancel()
+            writer.close()
+            if not completed:
+                fp.close()
+                os.remove(output_name)
+
+    if pipeline.error is not None:
+        raise pipeline.error
+    if not completed:
+        if cancelled and cancelled():
+            return None
+        raise ValueError(f"No frames could be decoded from {filename}")
+    seconds = time.perf_counter() - start_time
+    stats = _progress(pipeline, pipeline.counts['composited'], seconds)
+    stats.update({
+        'format': format,
+        'frames': pipeline.counts['composited'],
+        'written_frames': writer.frames,
+        'seconds': seconds,
+        'bytes': os.path.getsize(output_name),
+        'peak_depths': dict(pipeline.peak_depths),
+    })
+    return stats
+
+
+def _progress(pipeline, total, seconds):
+    done = pipeline.counts['written']
+    return {'done': done, 'total': max(total or 0, done), 'fps': done / max(seconds, 1e-9),
+            'depths': pipeline.depths()}
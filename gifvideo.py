@@ -0,0 +1,185 @@
+"""Video decoding through an ffmpeg pipe.
+
+ffmpeg does the frame-rate conversion, trimming and scaling itself, so only
+the frames that are actually needed are ever handed to Python, already at
+their final size. Raw RGB frames are read straight into one preallocated
+array.
+"""
+import math
+import numpy as np
+import re
+import subprocess
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_VIDEO_RE = re.compile(r"Stream #.*?Video:.*?(\d{2,5})x(\d{2,5})")
+_FPS_RE = re.compile(r"(\d+(?:\.\d+)?) (?:fps|tbr)")
+# A rotate tag (older ffmpeg) or display matrix (newer) on the video stream
+_ROTATE_RE = re.compile(r"rotate\s*:\s*(-?\d+(?:\.\d+)?)|rotation of (-?\d+(?:\.\d+)?) degrees")
+
+
+def ffmpeg_exe():
+    """Path of the ffmpeg binary: the one bundled with imageio-ffmpeg, else the one on PATH."""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return "ffmpeg"
+
+
+def _startupinfo():
+    # Keep a console window from flashing up in the windowed build
+    if hasattr(subprocess, "STARTUPINFO"):
+        info = subprocess.STARTUPINFO()
+        info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        return info
+    return None
+
+
+def probe(filename):
+    """Return {'duration', 'width', 'height', 'fps', 'rotation'} for a video file.
+
+    ffmpeg turns the frames upright while decoding, so width and height are
+    as displayed: swapped for a video rotated by 90 or 270 degrees, such as
+    a portrait phone video.
+    """
+    result = subprocess.run([ffmpeg_exe(), "-hide_banner", "-i", filename],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            startupinfo=_startupinfo())
+    header = result.stderr.decode("utf-8", "replace")
+
+    video = _VIDEO_RE.search(header)
+    if not video:
+        raise ValueError(f"No video stream found in {filename}")
+    duration = _DURATION_RE.search(header)
+    stream = header[video.start():]
+    fps = _FPS_RE.search(stream)
+    next_stream = stream.find("Stream #", 1)
+    rotate = _ROTATE_RE.search(stream if next_stream < 0 else stream[:next_stream])
+    rotation = round(float(rotate.group(1) or rotate.group(2))) % 360 if rotate else 0
+    width, height = int(video.group(1)), int(video.group(2))
+    if rotation in (90, 270):
+        width, height = height, width
+    return {
+        'duration': (int(duration.group(1)) * 3600 + int(duration.group(2)) * 60
+                     + float(duration.group(3))) if duration else None,
+        'width': width,
+        'height': height,
+        'fps': float(fps.group(1)) if fps else None,
+        'rotation': rotation,
+    }
+
+
+def output_size(info, width=None, height=None):
+    """Decode size for the requested width and/or height, keeping the aspect ratio (even sizes for ffmpeg)."""
+    src_width, src_height = info['width'], info['height']
+    if width and not height:
+        height = src_height * width / src_width
+    elif height and not width:
+        width = src_width * height / src_height
+    elif not width:
+        width, height = src_width, src_height
+    return max(int(round(width / 2)) * 2, 2), max(int(round(height / 2)) * 2, 2)
+
+
+def _command(filename, fps, start, end, width, height, info):
+    """(ffmpeg command line, output size, estimated frame count) for a decode."""
+    info = info or probe(filename)
+    size = output_size(info, width, height)
+    duration = info['duration']
+    end = duration if end is None else (min(end, duration) if duration else end)
+    length = (end - start) if end is not None else None
+    total = max(int(math.ceil(length * fps)) + 1, 1) if length else 256
+
+    command = [ffmpeg_exe(), "-v", "error", "-nostdin"]
+    if start:
+        command += ["-ss", f"{start:.3f}"]
+    command += ["-i", filename]
+    if length is not None:
+        command += ["-t", f"{length:.3f}"]
+    command += ["-an", "-vf", f"fps={fps},scale={size[0]}:{size[1]}:flags=lanczos",
+                "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+    return command, size, total
+
+
+def _read_frame(stream, view):
+    """Fill view from stream; False if the stream ended first."""
+    read = 0
+    while read < len(view):
+        chunk = stream.readinto(view[read:])
+        if not chunk:
+            return False
+        read += chunk
+    return True
+
+
+def decode(filename, fps=5, start=0, end=None, width=None, height=None, progress=None,
+           cancelled=None, info=None, allocate=np.empty):
+    """Decode filename into an (N, H, W, 3) uint8 array.
+
+    fps, start/end (seconds) and the output size are all applied by ffmpeg.
+    progress(done, total) is called after every frame; decoding stops early
+    when cancelled() returns True. allocate(shape, dtype) creates the frame
+    buffer, e.g. gifstore.allocate to spill long clips to disk.
+    """
+    command, size, total = _command(filename, fps, start, end, width, height, info)
+    frames = allocate((total, size[1], size[0], 3), np.uint8)
+    count = 0
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               startupinfo=_startupinfo())
+    try:
+        while not (cancelled and cancelled()):
+            if count == len(frames):
+                # Estimate was short (variable frame rate or unknown duration); grow geometrically
+                grown = allocate((len(frames) * 2,) + frames.shape[1:], np.uint8)
+                grown[:count] = frames[:count]
+                frames = grown
+            if not _read_frame(process.stdout, memoryview(frames[count]).cast("B")):
+                break
+            count += 1
+            if progress:
+                progress(count, max(total, count))
+    finally:
+        process.stdout.close()
+        process.kill()
+        error = process.stderr.read().decode("utf-8", "replace").strip()
+        process.stderr.close()
+        process.wait()
+
+    if not count and error:
+        raise RuntimeError(error)
+    if count > len(frames) // 2:
+        return frames[:count]
+    # Don't keep a mostly empty buffer alive behind the slice
+    trimmed = allocate((count,) + frames.shape[1:], np.uint8)
+    trimmed[:] = frames[:count]
+    return trimmed
+
+
+def stream(filename, fps=5, start=0, end=None, width=None, height=None, progress=None, info=None):
+    """Yield the frames decode() would return one at a time, as (H, W, 3) uint8 arrays.
+
+    Only the frame being read is held here, so memory doesn't grow with the
+    clip. progress(done, estimated total) is called before each frame is
+    yielded. Closing the generator stops ffmpeg.
+    """
+    command, size, total = _command(filename, fps, start, end, width, height, info)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               startupinfo=_startupinfo())
+    count = 0
+    try:
+        while True:
+            frame = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            if not _read_frame(process.stdout, memoryview(frame).cast("B")):
+                break
+            count += 1
+            if progress:
+                progress(count, max(total, count))
+            yield frame
+    finally:
+        process.stdout.close()
+        process.kill()
+        error = process.stderr.read().decode("utf-8", "replace").strip()
+        process.stderr.close()
+        process.wait()
+    if not count and error:
+        raise RuntimeError(error)
@@ -0,0 +1,121 @@
+"""Background execution of bulk frame operations for the editor.
+
+Retiming or merging a long clip touches every frame, which would freeze the
+window if it ran in a Tk callback. A FrameJobExecutor runs one such job at a
+time on its own thread, and the job can split its per-frame work into chunks
+across a shared thread pool (numpy and PIL release the GIL for the heavy
+parts). Starting a job cancels the one still running, so repeating an edit
+never queues several full passes over a long video. Progress and the result
+are handed to the Tk thread through a gifdispatch.Dispatcher, which also
+throttles the progress reports.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+CHUNK_SIZE = 8  # frames per pool task
+
+
+class Cancelled(Exception):
+    """Raised inside a job once it has been cancelled, and passed to its on_done as the error."""
+
+
+class FrameJob:
+    """One bulk operation: func(job) run on the job thread, returning the result.
+
+    cancel_event is set when the job is cancelled or replaced; func should
+    call check() or use map(), which both stop at the next frame. name
+    tells the caller which kind of job is running.
+    """
+
+    def __init__(self, executor, func, on_done, on_progress=None, name=None):
+        self.executor = executor
+        self.name = name
+        self.func = func
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.cancel_event = threading.Event()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        if self.cancel_event.is_set():
+            raise Cancelled()
+
+    def progress(self, done, total):
+        if self.on_progress:
+            self.executor.dispatcher.progress(self, self.on_progress, done, total)
+
+    def map(self, func, count, chunk_size=CHUNK_SIZE):
+        """[func(i) for i in range(count)], run in chunks on the pool, with progress as they finish."""
+        def run(start, end):
+            results = []
+            for i in range(start, end):
+                self.check()
+                results.append(func(i))
+            return results
+
+        futures = [self.executor.pool.submit(run, start, min(start + chunk_size, count))
+                   for start in range(0, count, chunk_size)]
+        results = []
+        try:
+            for future in futures:
+                results.extend(future.result())
+                self.progress(len(results), count)
+        finally:
+            # After an error or a cancel, chunks that haven't started never will
+            for future in futures:
+                future.cancel()
+        return results
+
+
+class FrameJobExecutor:
+    """Runs one bulk frame job at a time, off the Tk thread.
+
+    on_done(result, error) is called on the Tk thread once the job has
+    stopped: with the result, with the exception it raised, or with a
+    Cancelled error if it was cancelled or replaced meanwhile, so the caller
+    can swap the result in with a single assignment or tidy up.
+    """
+
+    def __init__(self, dispatcher, workers=None):
+        self.dispatcher = dispatcher
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4,
+                                       thread_name_prefix="gifbruhh-frames")
+        self.job = None
+
+    @property
+    def busy(self):
+        return self.job is not None
+
+    def submit(self, func, on_done, on_progress=None, name=None):
+        self.cancel()
+        job = self.job = FrameJob(self, func, on_done, on_progress, name)
+        threading.Thread(target=self._run, args=(job,), daemon=True, name="gifbruhh-frame-job").start()
+        return job
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel_event.set()
+            self.job = None
+
+    def _run(self, job):
+        result, error = None, None
+        try:
+            result = job.func(job)
+        except Exception as e:
+            error = e
+        self.dispatcher.post(self._finish, job, result, error)
+
+    def _finish(self, job, result, error):
+        self.dispatcher.discard(job)
+        if job is self.job:
+            self.job = None
+        if job.cancelled():
+            result, error = None, Cancelled()
+        job.on_done(result, error)
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)